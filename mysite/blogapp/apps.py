@@ -1,9 +1,21 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 from django.utils.translation import gettext_lazy as _
 
+from mysite.fts import restore_search_index
+
 
 class BlogappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'blogapp'
     verbose_name = _('blog')
     verbose_name_plural = _('blogs')
+    # Индекс, триггеры которого восстанавливаются после миграций
+    search_index = "blogapp.search.SEARCH_INDEX"
+
+    def ready(self):
+        """Подключает сигналы приложения и восстановление индекса поиска после миграций."""
+        from . import signals  # noqa: F401
+
+        post_migrate.connect(restore_search_index, sender=self)
+
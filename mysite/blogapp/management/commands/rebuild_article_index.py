@@ -0,0 +1,24 @@
+"""Команда перестроения полнотекстового индекса статей."""
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+
+from blogapp.search import SEARCH_INDEX
+
+
+class Command(BaseCommand):
+    """Перестраивает индекс поиска статей и восстанавливает его триггеры."""
+
+    help = "Rebuild the full-text search index of blog articles"
+
+    def handle(self, *args, **options) -> None:
+        """Обрабатывает выполнение команды."""
+        if connection.vendor == "postgresql":
+            self.stdout.write("PostgreSQL keeps the GIN index up to date, nothing to rebuild")
+            return
+        if not SEARCH_INDEX.available():
+            raise CommandError("Full-text index is not available, run migrate first")
+
+        self.stdout.write("Rebuild article search index")
+        SEARCH_INDEX.ensure(rebuild=True)
+        self.stdout.write(self.style.SUCCESS("Article search index rebuilt"))
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:57
+
+from django.contrib.postgres.indexes import GinIndex
+from django.db import migrations
+
+from blogapp.search import POSTGRES_INDEX, SEARCH_INDEX, SEARCH_VECTOR
+
+
+def create_search_index(apps, schema_editor):
+    """Создает полнотекстовый индекс статей для текущей СУБД."""
+    Article = apps.get_model("blogapp", "Article")
+    if schema_editor.connection.vendor == "sqlite":
+        SEARCH_INDEX.install(schema_editor)
+        SEARCH_INDEX.rebuild(schema_editor)
+    elif schema_editor.connection.vendor == "postgresql":
+        schema_editor.add_index(Article, GinIndex(SEARCH_VECTOR, name=POSTGRES_INDEX))
+
+
+def drop_search_index(apps, schema_editor):
+    """Удаляет полнотекстовый индекс статей."""
+    Article = apps.get_model("blogapp", "Article")
+    if schema_editor.connection.vendor == "sqlite":
+        SEARCH_INDEX.uninstall(schema_editor)
+    elif schema_editor.connection.vendor == "postgresql":
+        schema_editor.remove_index(Article, GinIndex(SEARCH_VECTOR, name=POSTGRES_INDEX))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogapp', '0004_alter_article_content'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:58
+
+from django.db import migrations, models
+
+from blogapp.models import make_excerpt
+
+BATCH_SIZE = 500
+
+
+def fill_excerpts(apps, schema_editor):
+    """Заполняет excerpt существующих статей пачками, не загружая все тексты разом."""
+    Article = apps.get_model("blogapp", "Article")
+    articles = Article.objects.only("content").order_by("pk")
+    last_pk = 0
+    while batch := list(articles.filter(pk__gt=last_pk)[:BATCH_SIZE]):
+        for article in batch:
+            article.excerpt = make_excerpt(article.content)
+        Article.objects.bulk_update(batch, ["excerpt"])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogapp', '0005_article_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=200, verbose_name='excerpt'),
+        ),
+        migrations.RunPython(fill_excerpts, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['pub_date', 'id'], name='blogapp_art_pub_dat_68b4c6_idx'),
+        ),
+    ]
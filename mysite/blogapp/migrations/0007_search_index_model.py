@@ -0,0 +1,26 @@
+# Generated by Django 5.1.1 on 2026-10-18 22:06
+
+import django.db.models.deletion
+import mysite.fts
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogapp', '0006_article_excerpt'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArticleSearchIndex',
+            fields=[
+                ('article', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='blogapp.article')),
+                ('document', mysite.fts.DocumentField(db_column='blogapp_article_fts')),
+            ],
+            options={
+                'db_table': 'blogapp_article_fts',
+                'managed': False,
+            },
+        ),
+    ]
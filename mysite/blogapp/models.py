@@ -1,7 +1,18 @@
 from django.db import models
 from django.urls import reverse
+from django.utils.text import Truncator
 from django.utils.translation import pgettext_lazy, gettext_lazy as _
 
+from mysite.fts import DocumentField
+
+
+EXCERPT_LENGTH = 200
+
+
+def make_excerpt(content: str | None) -> str:
+    """Возвращает начало текста статьи для списков и лент, не длиннее EXCERPT_LENGTH."""
+    return Truncator(content or "").chars(EXCERPT_LENGTH)
+
 
 class Author(models.Model):
     name = models.CharField(
@@ -63,6 +74,12 @@ class Article(models.Model):
         blank=True,
         verbose_name=_("content"),
     )
+    excerpt = models.CharField(
+        max_length=EXCERPT_LENGTH,
+        blank=True,
+        editable=False,
+        verbose_name=_("excerpt"),
+    )
     pub_date = models.DateTimeField(verbose_name=_("publication date"))
     author = models.ForeignKey(
         Author,
@@ -85,9 +102,47 @@ class Article(models.Model):
     class Meta:
         verbose_name = _("article")
         verbose_name_plural = _("articles")
+        indexes = [
+            models.Index(fields=["pub_date", "id"]),
+        ]
 
     def __str__(self) -> str:
         return _("Article id %(pk)d author %(author)s") % {'pk': self.pk, 'author': self.author}
 
+    def save(self, *args, **kwargs):
+        """
+        Сохраняет статью, обновляя excerpt по тексту.
+
+        bulk_create и update() save() не вызывают, там excerpt задается явно через make_excerpt.
+        """
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "content" in update_fields:
+            self.excerpt = make_excerpt(self.content)
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "excerpt"}
+        super().save(*args, **kwargs)
+
     def get_absolute_url(self) -> str:
         return reverse("blogapp:article_details", kwargs={"pk": self.pk})
+
+
+class ArticleSearchIndex(models.Model):
+    """
+    Строка полнотекстового индекса статей (таблица FTS5 на SQLite, см. blogapp.search).
+
+    Таблицу создает и синхронизирует со статьями :class:`mysite.fts.FTSIndex`, модель
+    нужна только для соединения с ней в запросах поиска.
+    """
+
+    article = models.OneToOneField(
+        Article,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column="rowid",
+        related_name="search_index",
+    )
+    document = DocumentField(db_column="blogapp_article_fts")
+
+    class Meta:
+        managed = False
+        db_table = "blogapp_article_fts"
@@ -0,0 +1,102 @@
+"""
+Курсорная (keyset) пагинация статей блога.
+
+Страница выбирается условием по паре (pub_date, pk) последней статьи предыдущей
+страницы, а не через OFFSET, поэтому запрос идет по индексу (pub_date, id) и не
+зависит от глубины страницы, а COUNT(*) не нужен вовсе.
+"""
+
+import base64
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.db.models import Q, QuerySet
+from django.http import Http404
+from django.utils.translation import gettext as _
+
+
+@dataclass
+class KeysetPage:
+    """Страница статей и курсоры соседних страниц."""
+
+    object_list: list
+    next_cursor: str | None = None
+    previous_cursor: str | None = None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self) -> int:
+        return len(self.object_list)
+
+    def has_next(self) -> bool:
+        """Проверяет, есть ли следующая страница."""
+        return self.next_cursor is not None
+
+    def has_previous(self) -> bool:
+        """Проверяет, есть ли предыдущая страница."""
+        return self.previous_cursor is not None
+
+    def has_other_pages(self) -> bool:
+        """Проверяет, есть ли соседние страницы."""
+        return self.has_next() or self.has_previous()
+
+
+def encode_cursor(pub_date: datetime, pk: int) -> str:
+    """Кодирует позицию статьи в строку для параметра запроса."""
+    return base64.urlsafe_b64encode(f"{pub_date.isoformat()}|{pk}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Разбирает курсор из параметра запроса, для испорченного курсора отдает 404."""
+    try:
+        pub_date, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(pub_date), int(pk)
+    except ValueError:
+        raise Http404(_("Invalid cursor"))
+
+
+class KeysetPaginator:
+    """
+    Пагинатор статей от новых к старым по (pub_date, pk).
+
+    after - курсор, после которого начинается страница (переход вперед), before -
+    курсор, перед которым она заканчивается (переход назад).
+    """
+
+    def __init__(self, queryset: QuerySet, per_page: int):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    def page(self, after: str | None = None, before: str | None = None) -> KeysetPage:
+        """Возвращает страницу статей с курсорами соседних страниц."""
+        queryset = self.queryset
+        backwards = before is not None and after is None
+        if backwards:
+            pub_date, pk = decode_cursor(before)
+            queryset = queryset.filter(Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, pk__gt=pk))
+            queryset = queryset.order_by("pub_date", "pk")
+        else:
+            if after is not None:
+                pub_date, pk = decode_cursor(after)
+                queryset = queryset.filter(Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk))
+            queryset = queryset.order_by("-pub_date", "-pk")
+
+        # Лишняя статья показывает, есть ли еще страница в направлении перехода
+        object_list = list(queryset[: self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[: self.per_page]
+        if backwards:
+            object_list.reverse()
+            has_previous, has_next = has_more, True
+        else:
+            has_previous, has_next = after is not None, has_more
+
+        page = KeysetPage(object_list)
+        if object_list:
+            first, last = object_list[0], object_list[-1]
+            if has_previous:
+                page.previous_cursor = encode_cursor(first.pub_date, first.pk)
+            if has_next:
+                page.next_cursor = encode_cursor(last.pub_date, last.pk)
+        return page
@@ -0,0 +1,118 @@
+"""
+Полнотекстовый поиск статей блога.
+
+На SQLite поиск идет по индексу FTS5 ``blogapp_article_fts`` (см. :mod:`mysite.fts`)
+с внешним содержимым из ``blogapp_article``: в индексе хранятся только токены заголовка
+и текста, а фрагменты с подсветкой совпадений функция snippet() строит из строк самой
+статьи. На PostgreSQL используется GIN-индекс по ``to_tsvector``. На остальных СУБД
+поиск сводится к обычному icontains.
+"""
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import CharField, Count, F, Q, QuerySet, Value
+from django.db.models.functions import Left
+from django.utils.html import escape
+from django.utils.safestring import SafeString, mark_safe
+
+from mysite.fts import FTSIndex, Rank, Snippet, fts_query
+
+SEARCH_INDEX = FTSIndex("blogapp_article", ("title", "content"))
+FTS_TABLE = SEARCH_INDEX.table
+POSTGRES_INDEX = "blogapp_article_search"
+# Вес совпадения в заголовке относительно совпадения в тексте статьи
+TITLE_WEIGHT = 10.0
+CONTENT_WEIGHT = 1.0
+# Число слов во фрагменте текста и маркеры начала и конца совпадения в нем
+SNIPPET_WORDS = 24
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_END = "\x03"
+ELLIPSIS = "…"
+
+SEARCH_VECTOR = SearchVector("title", weight="A", config="simple") + SearchVector(
+    "content", weight="B", config="simple"
+)
+
+
+def search_articles(queryset: QuerySet, text: str) -> QuerySet:
+    """
+    Отбирает статьи по поисковой строке text.
+
+    Добавляет к статьям релевантность search_rank (чем больше, тем выше статья
+    в выдаче) и фрагмент текста search_snippet, в котором совпадения обрамлены
+    маркерами HIGHLIGHT_START и HIGHLIGHT_END (см. :func:`highlight`).
+    """
+    if connection.vendor == "postgresql":
+        query = SearchQuery(text, config="simple", search_type="websearch")
+        # Фильтр по тому же выражению, что и в GIN-индексе миграции, иначе индекс не используется
+        return (
+            queryset.annotate(search_vector=SEARCH_VECTOR)
+            .filter(search_vector=query)
+            .annotate(
+                search_rank=SearchRank(F("search_vector"), query),
+                search_snippet=SearchHeadline(
+                    "content",
+                    query,
+                    config="simple",
+                    start_sel=HIGHLIGHT_START,
+                    stop_sel=HIGHLIGHT_END,
+                    max_words=SNIPPET_WORDS,
+                    fragment_delimiter=ELLIPSIS,
+                ),
+            )
+        )
+
+    if connection.vendor != "sqlite" or not SEARCH_INDEX.available():
+        return queryset.filter(Q(title__icontains=text) | Q(content__icontains=text)).annotate(
+            search_rank=Value(0.0),
+            search_snippet=Left("content", SNIPPET_WORDS * 8, output_field=CharField()),
+        )
+
+    match = fts_query([text])
+    if not match:
+        return queryset.none().annotate(search_rank=Value(0.0), search_snippet=Value(""))
+    return queryset.filter(search_index__document__match=match).annotate(
+        search_rank=Rank("search_index__document", weights=(TITLE_WEIGHT, CONTENT_WEIGHT)),
+        search_snippet=Snippet(
+            "search_index__document",
+            SEARCH_INDEX.columns.index("content"),
+            HIGHLIGHT_START,
+            HIGHLIGHT_END,
+            ELLIPSIS,
+            SNIPPET_WORDS,
+        ),
+    )
+
+
+def facet_counts(queryset: QuerySet) -> dict[str, list[dict]]:
+    """
+    Возвращает число статей queryset по категориям и тегам.
+
+    Оба разреза считаются одним SQL-запросом (UNION ALL двух группировок), а не
+    отдельным запросом на каждый фасет. Результат: {"category": [...], "tag": [...]},
+    где каждый элемент - словарь с ключами pk, name и count, по убыванию count.
+    """
+    # Сортировка и лишние столбцы выдачи в группировке не нужны
+    queryset = queryset.order_by()
+    categories = queryset.annotate(facet=Value("category")).values_list(
+        "facet", "category_id", "category__name"
+    ).annotate(count=Count("pk"))
+    tags = (
+        queryset.filter(tags__isnull=False)
+        .annotate(facet=Value("tag"))
+        .values_list("facet", "tags__id", "tags__name")
+        .annotate(count=Count("pk"))
+    )
+
+    facets: dict[str, list[dict]] = {"category": [], "tag": []}
+    for facet, pk, name, count in categories.union(tags, all=True):
+        facets[facet].append({"pk": pk, "name": name, "count": count})
+    for values in facets.values():
+        values.sort(key=lambda value: (-value["count"], value["name"]))
+    return facets
+
+
+def highlight(snippet: str | None) -> SafeString:
+    """Экранирует фрагмент текста и выделяет в нем совпадения тегом <mark>."""
+    html = escape(snippet or "")
+    return mark_safe(html.replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_END, "</mark>"))
@@ -0,0 +1,33 @@
+"""
+Сигналы моделей blogapp.
+
+Любое изменение статей, их авторов, категорий и тегов делает устаревшими данные
+пространства имен ARTICLES :mod:`shopapp.cache`, в том числе ETag страниц блога.
+"""
+
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from shopapp.cache import ARTICLES, invalidate
+
+from .models import Article, Author, Category, Tag
+
+
+@receiver(post_save, sender=Article)
+@receiver(post_delete, sender=Article)
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def blog_changed(sender, **kwargs) -> None:
+    """Сбрасывает кэш статей после сохранения или удаления статьи и связанных с ней данных."""
+    invalidate(ARTICLES)
+
+
+@receiver(m2m_changed, sender=Article.tags.through)
+def article_tags_changed(sender, action: str, **kwargs) -> None:
+    """Сбрасывает кэш статей после изменения тегов статьи."""
+    if action.startswith("post_"):
+        invalidate(ARTICLES)
@@ -1,3 +1,210 @@
+from unittest import mock
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone, translation
+
+from .models import EXCERPT_LENGTH, Article, Author, Category, Tag
+from .search import FTS_TABLE, HIGHLIGHT_END, HIGHLIGHT_START, SEARCH_INDEX, facet_counts, search_articles
+from .views import ArticleListView
+
+
+class ArticleSearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(name="Search author")
+        cls.science = Category.objects.create(name="Science")
+        cls.travel = Category.objects.create(name="Travel")
+        cls.space = Tag.objects.create(name="space")
+        cls.photo = Tag.objects.create(name="photo")
+        now = timezone.now()
+        cls.in_title = Article.objects.create(
+            title="Observing nebulae at night",
+            content="Long exposure photography of faint objects.",
+            pub_date=now,
+            author=cls.author,
+            category=cls.science,
+        )
+        cls.in_content = Article.objects.create(
+            title="A trip to the mountains",
+            content="The sky was dark enough to spot a nebula with bare eyes. " * 20,
+            pub_date=now,
+            author=cls.author,
+            category=cls.travel,
+        )
+        cls.in_title.tags.set([cls.space, cls.photo])
+        cls.in_content.tags.set([cls.space])
+
+    def setUp(self):
+        # LANGUAGE_CODE "en-us" нет в LANGUAGES, без явной активации reverse дает 404
+        translation.activate("en")
+
+    def search(self, text):
+        return list(search_articles(Article.objects.all(), text).order_by("-search_rank", "pk"))
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(self.search("nebul"), [self.in_title, self.in_content])
+        self.assertEqual(self.search("nebula bare"), [self.in_content])
+        self.assertEqual(self.search('"nebula" OR NOT'), [])
+
+    def test_missing_index_is_not_remembered(self):
+        with mock.patch("mysite.fts._available", set()):
+            with mock.patch.object(connection.introspection, "table_names", return_value=[]):
+                self.assertFalse(SEARCH_INDEX.available())
+            self.assertTrue(SEARCH_INDEX.available())
+
+    def test_snippet_highlights_matches(self):
+        article = self.search("bare")[0]
+
+        self.assertIn(f"{HIGHLIGHT_START}bare{HIGHLIGHT_END}", article.search_snippet)
+        self.assertLess(len(article.search_snippet), len(article.content))
+
+    def test_index_follows_updates_and_stores_no_content(self):
+        Article.objects.filter(pk=self.in_title.pk).update(title="Observing galaxies at night")
+
+        self.assertEqual(self.search("galax"), [self.in_title])
+        self.assertEqual(self.search("nebul"), [self.in_content])
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT name FROM sqlite_master WHERE name LIKE '{FTS_TABLE}%'")
+            tables = {row[0] for row in cursor.fetchall()}
+        self.assertNotIn(f"{FTS_TABLE}_content", tables)
+
+    def test_facets_in_one_query(self):
+        matches = search_articles(Article.objects.all(), "nebul")
+
+        with CaptureQueriesContext(connection) as queries:
+            facets = facet_counts(matches)
+
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(
+            facets["category"],
+            [
+                {"pk": self.science.pk, "name": "Science", "count": 1},
+                {"pk": self.travel.pk, "name": "Travel", "count": 1},
+            ],
+        )
+        self.assertEqual(
+            facets["tag"],
+            [
+                {"pk": self.space.pk, "name": "space", "count": 2},
+                {"pk": self.photo.pk, "name": "photo", "count": 1},
+            ],
+        )
+
+    def test_search_view_filters_by_facet(self):
+        url = reverse("blogapp:article_search")
+
+        response = self.client.get(url, {"q": "nebula", "tag": self.photo.pk})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context["articles"]), [self.in_title])
+        self.assertEqual([tag["name"] for tag in response.context["facets"]["tag"]], ["photo", "space"])
+        self.assertContains(self.client.get(url, {"q": "bare"}), "<mark>bare</mark>")
+
+
+class ArticleListViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(name="Keyset author")
+        category = Category.objects.create(name="Keyset")
+        tag = Tag.objects.create(name="keyset")
+        pub_date = timezone.now() + timezone.timedelta(days=365)
+        # Две пары статей с одинаковой датой проверяют сортировку по pk внутри даты
+        cls.articles = []
+        for i in range(5):
+            article = Article.objects.create(
+                title=f"Keyset article {i}",
+                content="Long body. " * 1000,
+                pub_date=pub_date - timezone.timedelta(hours=i // 2),
+                author=author,
+                category=category,
+            )
+            article.tags.add(tag)
+            cls.articles.append(article)
+        cls.newest_first = sorted(cls.articles, key=lambda article: (article.pub_date, article.pk), reverse=True)
+
+    def setUp(self):
+        # LANGUAGE_CODE "en-us" нет в LANGUAGES, без явной активации reverse дает 404
+        translation.activate("en")
+
+    def get_page(self, **params):
+        response = self.client.get(reverse("blogapp:article"), params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_excerpt_is_saved_with_content(self):
+        article = self.articles[0]
+
+        self.assertLessEqual(len(article.excerpt), EXCERPT_LENGTH)
+        self.assertTrue(article.excerpt.startswith("Long body."))
+
+        article.content = "Short body."
+        article.save(update_fields=["content"])
+        article.refresh_from_db()
+        self.assertEqual(article.excerpt, "Short body.")
+
+    @mock.patch.object(ArticleListView, "paginate_by", 2)
+    def test_keyset_pages_forward_and_back(self):
+        first = self.get_page()
+        self.assertEqual(list(first.context["articles"]), self.newest_first[:2])
+        self.assertFalse(first.context["page_obj"].has_previous())
+
+        second = self.get_page(after=first.context["page_obj"].next_cursor)
+        self.assertEqual(list(second.context["articles"]), self.newest_first[2:4])
+
+        back = self.get_page(before=second.context["page_obj"].previous_cursor)
+        self.assertEqual(list(back.context["articles"]), self.newest_first[:2])
+        self.assertFalse(back.context["page_obj"].has_previous())
+        self.assertTrue(back.context["page_obj"].has_next())
+
+    def test_list_does_not_load_content(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_page()
+
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn("content", queries[0]["sql"])
+        self.assertContains(response, self.articles[0].excerpt)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("blogapp:article"), {"after": "broken"})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_feed_uses_excerpt(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("blogapp:articles-feed"))
+
+        self.assertContains(response, self.newest_first[0].excerpt[:50])
+        self.assertNotIn('"content"', queries[0]["sql"])
+
+
+class ArticleConditionalGetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(name="etag")
+        cls.article = Article.objects.create(
+            title="ETag article",
+            content="Conditional body",
+            pub_date=timezone.now(),
+            author=Author.objects.create(name="ETag author"),
+            category=Category.objects.create(name="ETag"),
+        )
+
+    def setUp(self):
+        # LANGUAGE_CODE "en-us" нет в LANGUAGES, без явной активации reverse дает 404
+        translation.activate("en")
+
+    def test_article_and_feed_not_modified_until_changed(self):
+        for url in (
+            reverse("blogapp:article_details", kwargs={"pk": self.article.pk}),
+            reverse("blogapp:articles-feed"),
+        ):
+            with self.subTest(url=url):
+                etag = self.client.get(url)["ETag"]
+                self.assertEqual(self.client.get(url, headers={"If-None-Match": etag}).status_code, 304)
 
-# Create your tests here.
+                self.article.tags.add(self.tag)
+                self.assertEqual(self.client.get(url, headers={"If-None-Match": etag}).status_code, 200)
+                self.article.tags.clear()
@@ -2,6 +2,7 @@ from django.urls import path, include
 
 from .views import (
     ArticleListView,
+    ArticleSearchView,
     ArticleDetailView,
     LatestArticlesFeed,
 )
@@ -10,6 +11,7 @@ app_name = "blogapp"
 
 urlpatterns = [
     path("article/", ArticleListView.as_view(), name="article"),
+    path("article/search/", ArticleSearchView.as_view(), name="article_search"),
     path("article/<int:pk>/", ArticleDetailView.as_view(), name="article_details"),
     path("article/latest/feed/", LatestArticlesFeed(), name="articles-feed"),
 ]
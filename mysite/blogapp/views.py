@@ -1,38 +1,117 @@
 from django.contrib.syndication.views import Feed
+from django.db.models import Prefetch
 from django.shortcuts import render
 from django.urls import reverse, reverse_lazy
 from django.views.generic import ListView, DetailView
 from django.utils.translation import gettext_lazy as _
 
-from blogapp.models import Article
+from shopapp.cache import ARTICLES
+from shopapp.conditional import ConditionalFeedMixin, ConditionalGetMixin
+
+from blogapp.models import Article, Tag
+from blogapp.pagination import KeysetPaginator
+from blogapp.search import facet_counts, highlight, search_articles
 
 
 class ArticleListView(ListView):
+    """
+    Список опубликованных статей от новых к старым.
+
+    Страницы переключаются курсорами after и before (см. blogapp.pagination), из базы
+    выбираются только выводимые в шаблоне столбцы, вместо текста статьи - excerpt.
+    """
+
     context_object_name = "articles"
+    paginate_by = 20
     queryset = (
         Article.objects.filter(pub_date__isnull=False)
-        .only("title", "pub_date", "author", "category", "tags")
+        .only("title", "excerpt", "pub_date", "author__name", "category__name")
         .select_related("author", "category")
-        .prefetch_related("tags")
-        .order_by("-pub_date")
+        .prefetch_related(Prefetch("tags", queryset=Tag.objects.only("name")))
     )
 
+    def paginate_queryset(self, queryset, page_size):
+        """Выбирает страницу по курсору вместо номера страницы."""
+        page = KeysetPaginator(queryset, page_size).page(
+            after=self.request.GET.get("after"),
+            before=self.request.GET.get("before"),
+        )
+        return None, page, page.object_list, page.has_other_pages()
+
+
+class ArticleSearchView(ListView):
+    """
+    Поиск статей по заголовку и тексту с фасетами по категориям и тегам.
+
+    Параметры запроса: q - поисковая строка, category и tag - id категории и тега
+    для уточнения выдачи.
+    """
+
+    template_name = "blogapp/article_search.html"
+    context_object_name = "articles"
+    paginate_by = 20
+
+    def get_search_text(self) -> str:
+        """Возвращает поисковую строку из параметра q."""
+        return self.request.GET.get("q", "").strip()
+
+    def get_matches(self):
+        """Возвращает опубликованные статьи, подходящие под поиск и выбранные фасеты."""
+        queryset = Article.objects.filter(pub_date__isnull=False)
+        for facet, lookup in (("category", "category_id"), ("tag", "tags__id")):
+            value = self.request.GET.get(facet, "")
+            if value.isdigit():
+                queryset = queryset.filter(**{lookup: value})
+        return search_articles(queryset, self.get_search_text())
+
+    def get_queryset(self):
+        """Возвращает найденные статьи по убыванию релевантности."""
+        if not self.get_search_text():
+            return Article.objects.none()
+        return (
+            self.get_matches()
+            .only("title", "pub_date", "author__name", "category__name")
+            .select_related("author", "category")
+            .prefetch_related("tags")
+            .order_by("-search_rank", "-pub_date", "pk")
+        )
+
+    def get_context_data(self, **kwargs):
+        """Добавляет в контекст поисковую строку, фасеты и подсвеченные фрагменты."""
+        context = super().get_context_data(**kwargs)
+        text = self.get_search_text()
+        context["query"] = text
+        params = self.request.GET.copy()
+        params.pop("page", None)
+        context["query_string"] = params.urlencode()
+        context["facets"] = facet_counts(self.get_matches()) if text else {"category": [], "tag": []}
+        for article in context["articles"]:
+            article.snippet_html = highlight(article.search_snippet)
+        return context
+
 
-class ArticleDetailView(DetailView):
+class ArticleDetailView(ConditionalGetMixin, DetailView):
+    etag_namespaces = (ARTICLES,)
+    etag_vary_on_user = True
     queryset = Article.objects.only("title", "pub_date", "author", "content").select_related("author")
     context_object_name = "article"
 
 
-class LatestArticlesFeed(Feed):
+class LatestArticlesFeed(ConditionalFeedMixin, Feed):
+    etag_namespaces = (ARTICLES,)
     title = _("Blog Articles (latest)")
     description = _("Updates on changes and addition blog articles")
     link = reverse_lazy("blogapp:article")
 
     def items(self):
-        return Article.objects.filter(pub_date__isnull=False).order_by("-pub_date")[:5]
+        return (
+            Article.objects.filter(pub_date__isnull=False)
+            .only("title", "excerpt")
+            .order_by("-pub_date", "-pk")[:5]
+        )
 
     def item_title(self, item: Article):
         return item.title
 
     def item_description(self, item: Article):
-        return item.content[:20] + ("" if len(item.content) < 20 else "...")
+        return item.excerpt
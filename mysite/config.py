@@ -12,6 +12,15 @@ class Settings(BaseSettings):
     loglevel: str | None = None
     django_debug: str | None = None
     allowed_hosts: Annotated[str, Field(default="localhost")]
+    # Адреса или сети обратных прокси через запятую, им доверяются X-Real-IP и X-Forwarded-For
+    trusted_proxies: Annotated[str, Field(default="")]
+    # Кэш второго уровня: file, redis, locmem или dummy (кэширование выключено)
+    cache_backend: Annotated[str, Field(default="file")]
+    cache_location: Annotated[str, Field(default="/var/tmp/django_cache")]
+    cache_max_entries: Annotated[int, Field(default=20000)]
+    cache_l1_max_entries: Annotated[int, Field(default=1000)]
+    cache_l1_max_bytes: Annotated[int, Field(default=16 * 1024 * 1024)]
+    cache_l1_timeout: Annotated[int, Field(default=60)]
     model_config = SettingsConfigDict(env_file=env_path, env_file_encoding='utf-8')
 
 
@@ -21,3 +21,8 @@ class FooBarViewTestCase(TestCase):
         # received_data = json.loads(response.content)
         # self.assertEqual(received_data, expected_data)
         self.assertJSONEqual(response.content, expected_data)
+
+    async def test_foo_bar_view_in_async_mode(self):
+        response = await self.async_client.get(reverse("myauth:foo-bar"))
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONEqual(response.content, {"foo": "bar", "spam": "eggs"})
@@ -261,7 +261,7 @@ class FooBarView(View):
 class UserListView(ListView):
     """Представление для отображения списка пользователей."""
 
-    model = User
+    queryset = User.objects.select_related("profile")
     template_name = "myauth/user_list.html"
     context_object_name = "users"
 
@@ -3,6 +3,25 @@ ASGI config for mysite project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+По умолчанию docker-compose запускает WSGI (mysite.wsgi). ASGI включается вручную,
+gunicorn с воркерами uvicorn::
+
+    gunicorn mysite.asgi:application --worker-class uvicorn.workers.UvicornWorker
+
+Middleware проекта работают в асинхронном режиме без sync_to_async
+(см. :class:`requestdataapp.middlewares.HybridMiddleware`), а представления остаются
+синхронными, пока по умолчанию используется WSGI: при WSGI асинхронное представление
+выполнялось бы через async_to_sync в отдельном цикле событий на каждый запрос.
+Django запускает их в потоке через sync_to_async. Ограничения ASGI в Django:
+
+* синхронный итератор потокового ответа (выгрузки CSV, JSON и NDJSON заказов, ленты
+  изменений, FileResponse результатов задач) собирается в список целиком через
+  sync_to_async и только потом отправляется, то есть ответ буферизуется в памяти;
+* тело запроса читается во временный файл до middleware, поэтому
+  :class:`requestdataapp.uploads.UploadLimitHandler` отклоняет слишком большую
+  загрузку уже после приема. Размер тела при ASGI ограничивает только nginx
+  (client_max_body_size).
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
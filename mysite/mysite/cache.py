@@ -0,0 +1,384 @@
+"""
+Двухуровневый кэш: LRU в памяти процесса (L1) перед общим кэшем (L2).
+
+L1 отвечает на повторные чтения горячих ключей без обращения к L2 (файлам или Redis),
+L2 общий для всех воркеров и серверов. Запись идет в оба уровня, атомарные операции
+(add, incr) выполняются только в L2, поэтому L2 должен выполнять их атомарно: Redis,
+LocMemCache или :class:`AtomicFileBasedCache`, но не FileBasedCache. Чтобы процессы не расходились надолго, записи L1
+живут не дольше L1_TIMEOUT секунд, а ключи с префиксами из L2_ONLY_PREFIXES (версии,
+счетчики ограничителя частоты) в L1 не попадают вовсе.
+
+aget и aget_many отвечают из L1 прямо в цикле событий ASGI, без sync_to_async, и
+обращаются к асинхронному API L2 только при промахе.
+
+Пример настройки::
+
+    CACHES = {
+        "default": {
+            "BACKEND": "mysite.cache.TieredCache",
+            "OPTIONS": {"L2": "shared", "L1_MAX_ENTRIES": 1000},
+        },
+        "shared": {"BACKEND": "mysite.cache.AtomicFileBasedCache", ...},
+    }
+"""
+
+import os
+import pickle
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files import locks
+
+
+@dataclass
+class LRUStore:
+    """Хранилище L1 одного процесса: значения в порядке последнего обращения."""
+
+    max_entries: int
+    max_bytes: int
+    entries: OrderedDict = field(default_factory=OrderedDict)
+    size: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    stats: dict[str, int] = field(default_factory=lambda: {"l1_hits": 0, "l2_hits": 0, "misses": 0, "evictions": 0})
+
+    def get(self, key: str) -> bytes | None:
+        """Возвращает сериализованное значение или None, если его нет или оно истекло."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            pickled, expires_at = entry
+            if expires_at <= time.monotonic():
+                self.pop(key)
+                return None
+            self.entries.move_to_end(key)
+            return pickled
+
+    def set(self, key: str, pickled: bytes, timeout: float) -> None:
+        """Сохраняет значение на timeout секунд, вытесняя самые старые записи."""
+        with self.lock:
+            self.pop(key)
+            if len(pickled) > self.max_bytes:
+                return
+            self.entries[key] = (pickled, time.monotonic() + timeout)
+            self.size += len(pickled)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self.size -= len(self.entries.popitem(last=False)[1][0])
+                self.stats["evictions"] += 1
+
+    def delete(self, key: str) -> None:
+        """Удаляет значение."""
+        with self.lock:
+            self.pop(key)
+
+    def pop(self, key: str) -> None:
+        """Удаляет значение, вызывается под блокировкой."""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def clear(self) -> None:
+        """Удаляет все значения."""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def count(self, result: str, value: int = 1) -> None:
+        """Увеличивает счетчик статистики."""
+        with self.lock:
+            self.stats[result] += value
+
+
+# Значение "нет в кэше", отличимое от сохраненного None
+_MISSING = object()
+
+# Хранилища L1 общие для всех потоков процесса, как у LocMemCache
+_stores: dict[str, LRUStore] = {}
+_stores_lock = threading.Lock()
+
+
+class TieredCache(BaseCache):
+    """
+    Кэш Django с уровнями L1 (LRU в памяти процесса) и L2 (другой кэш из CACHES).
+
+    Параметры OPTIONS:
+
+    * ``L2`` - псевдоним кэша второго уровня;
+    * ``L1_MAX_ENTRIES`` и ``L1_MAX_BYTES`` - ограничения размера L1;
+    * ``L1_TIMEOUT`` - наибольшее время жизни записи в L1, в секундах;
+    * ``L2_ONLY_PREFIXES`` - префиксы ключей, которые всегда читаются из L2.
+    """
+
+    def __init__(self, location: str, params: dict):
+        """Инициализирует кэш по настройкам из CACHES."""
+        options = params.get("OPTIONS", {})
+        super().__init__(params)
+        self.l2_alias = options["L2"]
+        self.l1_timeout = options.get("L1_TIMEOUT", 60)
+        self.l2_only_prefixes = tuple(options.get("L2_ONLY_PREFIXES", ()))
+        name = location or self.l2_alias
+        with _stores_lock:
+            if name not in _stores:
+                _stores[name] = LRUStore(
+                    max_entries=options.get("L1_MAX_ENTRIES", 1000),
+                    max_bytes=options.get("L1_MAX_BYTES", 16 * 1024 * 1024),
+                )
+            self.l1 = _stores[name]
+
+    @property
+    def l2(self) -> BaseCache:
+        """Кэш второго уровня."""
+        return caches[self.l2_alias]
+
+    def l1_key(self, key: str, version: int | None) -> str | None:
+        """Возвращает ключ L1 или None, если ключ хранится только в L2."""
+        if key.startswith(self.l2_only_prefixes):
+            return None
+        return self.make_and_validate_key(key, version=version)
+
+    def l1_timeout_for(self, timeout) -> float:
+        """Время жизни записи в L1 с учетом времени жизни в L2."""
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None:
+            return self.l1_timeout
+        return min(timeout - time.time(), self.l1_timeout)
+
+    def store(self, l1_key: str | None, value, timeout) -> None:
+        """Сохраняет значение в L1."""
+        if l1_key is None:
+            return
+        l1_timeout = self.l1_timeout_for(timeout)
+        if l1_timeout > 0:
+            self.l1.set(l1_key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), l1_timeout)
+        else:
+            self.l1.delete(l1_key)
+
+    def get(self, key, default=None, version=None):
+        """Ищет значение в L1, затем в L2."""
+        l1_key = self.l1_key(key, version)
+        value = self.read_l1(l1_key)
+        if value is not _MISSING:
+            return value
+        return self.fill_l1(l1_key, self.l2.get(key, _MISSING, version=version), default)
+
+    async def aget(self, key, default=None, version=None):
+        """Ищет значение в L1 без переключения в поток, затем асинхронно в L2."""
+        l1_key = self.l1_key(key, version)
+        value = self.read_l1(l1_key)
+        if value is not _MISSING:
+            return value
+        return self.fill_l1(l1_key, await self.l2.aget(key, _MISSING, version=version), default)
+
+    def get_many(self, keys, version=None):
+        """Ищет значения в L1, недостающие запрашивает из L2 одним обращением."""
+        found, missing = self.read_many_l1(keys, version)
+        if missing:
+            found.update(self.fill_many_l1(missing, self.l2.get_many(missing, version=version), version))
+        return found
+
+    async def aget_many(self, keys, version=None):
+        """Ищет значения в L1, недостающие запрашивает из L2 одним асинхронным обращением."""
+        found, missing = self.read_many_l1(keys, version)
+        if missing:
+            found.update(self.fill_many_l1(missing, await self.l2.aget_many(missing, version=version), version))
+        return found
+
+    def read_l1(self, l1_key: str | None):
+        """Возвращает значение из L1 или _MISSING."""
+        if l1_key is None:
+            return _MISSING
+        pickled = self.l1.get(l1_key)
+        if pickled is None:
+            return _MISSING
+        self.l1.count("l1_hits")
+        return pickle.loads(pickled)
+
+    def fill_l1(self, l1_key: str | None, value, default):
+        """Учитывает ответ L2 и копирует найденное значение в L1."""
+        if value is _MISSING:
+            self.l1.count("misses")
+            return default
+        self.l1.count("l2_hits")
+        # Оставшееся время жизни в L2 неизвестно, поэтому в L1 запись живет L1_TIMEOUT
+        self.store(l1_key, value, DEFAULT_TIMEOUT)
+        return value
+
+    def read_many_l1(self, keys, version) -> tuple[dict, list]:
+        """Возвращает найденные в L1 значения и ключи, которые нужно искать в L2."""
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.read_l1(self.l1_key(key, version))
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        return found, missing
+
+    def fill_many_l1(self, missing: list, from_l2: dict, version) -> dict:
+        """Учитывает ответ L2 на ключи missing и копирует найденные значения в L1."""
+        self.l1.count("l2_hits", len(from_l2))
+        self.l1.count("misses", len(missing) - len(from_l2))
+        for key, value in from_l2.items():
+            self.store(self.l1_key(key, version), value, DEFAULT_TIMEOUT)
+        return from_l2
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        """Сохраняет значение в оба уровня."""
+        self.l2.set(key, value, timeout=self.l2_timeout(timeout), version=version)
+        self.store(self.l1_key(key, version), value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        """Сохраняет значения в оба уровня."""
+        failed = self.l2.set_many(data, timeout=self.l2_timeout(timeout), version=version)
+        for key, value in data.items():
+            if key not in failed:
+                self.store(self.l1_key(key, version), value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        """Добавляет значение, если его нет. Проверка выполняется только в L2."""
+        added = self.l2.add(key, value, timeout=self.l2_timeout(timeout), version=version)
+        if added:
+            self.store(self.l1_key(key, version), value, timeout)
+        return added
+
+    async def aadd(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        """Асинхронный вариант :meth:`add`."""
+        return await sync_to_async(self.add, thread_sensitive=True)(key, value, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        """Увеличивает значение в L2 и убирает устаревшую копию из L1."""
+        self.drop(key, version)
+        return self.l2.incr(key, delta, version=version)
+
+    async def aincr(self, key, delta=1, version=None):
+        """
+        Асинхронный вариант :meth:`incr`.
+
+        BaseCache.aincr выполняет aget и aset, то есть не атомарен и сбрасывает время
+        жизни ключа, а RedisCache и LocMemCache его не переопределяют. Поэтому
+        вызывается синхронный incr L2.
+        """
+        return await sync_to_async(self.incr, thread_sensitive=True)(key, delta, version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        """Продлевает время жизни значения в L2."""
+        return self.l2.touch(key, timeout=self.l2_timeout(timeout), version=version)
+
+    def delete(self, key, version=None):
+        """Удаляет значение из обоих уровней."""
+        self.drop(key, version)
+        return self.l2.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        """Удаляет значения из обоих уровней."""
+        for key in keys:
+            self.drop(key, version)
+        self.l2.delete_many(keys, version=version)
+
+    def has_key(self, key, version=None):
+        """Проверяет наличие значения."""
+        l1_key = self.l1_key(key, version)
+        return (l1_key is not None and self.l1.get(l1_key) is not None) or self.l2.has_key(key, version=version)
+
+    def clear(self):
+        """Очищает оба уровня."""
+        self.l1.clear()
+        self.l2.clear()
+
+    def drop(self, key, version=None) -> None:
+        """Удаляет значение из L1."""
+        l1_key = self.l1_key(key, version)
+        if l1_key is not None:
+            self.l1.delete(l1_key)
+
+    def l2_timeout(self, timeout):
+        """Время жизни для L2: значение по умолчанию берется из настроек этого кэша."""
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def stats(self) -> dict[str, int]:
+        """Возвращает статистику попаданий и размер L1."""
+        with self.l1.lock:
+            return {**self.l1.stats, "l1_entries": len(self.l1.entries), "l1_bytes": self.l1.size}
+
+
+class AtomicFileBasedCache(FileBasedCache):
+    """
+    Файловый кэш с атомарными add и incr для всех процессов сервера.
+
+    FileBasedCache выполняет add как has_key и set, а incr как get и set: два воркера
+    могут оба добавить один ключ или потерять увеличение счетчика. Кроме того, incr
+    записывает значение со временем жизни TIMEOUT, и версия кэша без срока истекает
+    через TIMEOUT после первого увеличения. Здесь add и incr выполняются под общей
+    блокировкой файла в каталоге кэша, а incr сохраняет срок ключа.
+
+    Каталог кэша у каждого сервера свой, поэтому для нескольких серверов нужен Redis.
+    """
+
+    lock_name = "atomic.lock"
+
+    @contextmanager
+    def atomic(self) -> Iterator[None]:
+        """Блокирует add и incr всех процессов, работающих с каталогом кэша."""
+        self._createdir()
+        with open(os.path.join(self._dir, self.lock_name), "ab") as lock_file:
+            locks.lock(lock_file, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(lock_file)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        """Добавляет значение, если его нет, под блокировкой."""
+        with self.atomic():
+            return super().add(key, value, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        """Увеличивает значение под блокировкой, не меняя срок ключа."""
+        with self.atomic():
+            try:
+                with open(self._key_to_file(key, version), "rb") as file:
+                    expiry = pickle.load(file)
+                    value = pickle.loads(zlib.decompress(file.read()))
+            except (FileNotFoundError, EOFError):
+                raise ValueError(f"Key '{key}' not found")
+            now = time.time()
+            if expiry is not None and expiry < now:
+                raise ValueError(f"Key '{key}' not found")
+            new_value = value + delta
+            self.set(key, new_value, timeout=None if expiry is None else expiry - now, version=version)
+        return new_value
+
+    async def aincr(self, key, delta=1, version=None):
+        """Асинхронный вариант :meth:`incr`."""
+        return await sync_to_async(self.incr, thread_sensitive=True)(key, delta, version)
+
+
+def local_caches(cache_settings: dict, location: str) -> dict:
+    """
+    Возвращает настройки cache_settings, в которых все кэши хранятся в памяти процесса.
+
+    Псевдонимы и TieredCache сохраняются, остальные кэши заменяются LocMemCache с
+    хранилищами ``<location>-<псевдоним>``. Используется тестами и бенчмарком, чтобы не
+    трогать Redis и файловый кэш запущенного сервера.
+    """
+    local = {}
+    for alias, params in cache_settings.items():
+        if params["BACKEND"] == "mysite.cache.TieredCache":
+            local[alias] = {**params, "LOCATION": f"{location}-{alias}"}
+        else:
+            local[alias] = {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": f"{location}-{alias}",
+            }
+    return local
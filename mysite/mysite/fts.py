@@ -0,0 +1,225 @@
+"""
+Полнотекстовые индексы SQLite FTS5 с внешним содержимым.
+
+Индекс :class:`FTSIndex` - виртуальная таблица ``<таблица>_fts`` по текстовым
+столбцам таблицы модели. В ней хранятся только токены, сами строки FTS5 читает из
+таблицы модели. Таблицу синхронизируют триггеры, поэтому индекс обновляется при
+каждом изменении строк, в том числе через bulk_create и update().
+
+Запросы к индексу идут через неуправляемую модель таблицы FTS5 со связью один к
+одному с моделью по rowid и полем :class:`DocumentField`. Поиск - обычное соединение
+с таблицей индекса, поэтому MATCH, bm25() и snippet() вычисляются за один проход по
+индексу::
+
+    class ProductSearchIndex(models.Model):
+        product = models.OneToOneField(
+            Product, models.DO_NOTHING, primary_key=True, db_column="rowid", related_name="search_index"
+        )
+        document = DocumentField(db_column="shopapp_product_fts")
+
+        class Meta:
+            managed = False
+            db_table = "shopapp_product_fts"
+
+    Product.objects.filter(search_index__document__match=fts_query(terms)).annotate(
+        search_rank=Rank("search_index__document", weights=(10.0, 1.0)),
+    )
+"""
+
+import re
+from dataclasses import dataclass
+
+from django.db import DEFAULT_DB_ALIAS, connection, models
+from django.db.models import F, FloatField, Func, Lookup, TextField, Value
+from django.utils.module_loading import import_string
+
+
+def fts_query(terms: list[str]) -> str:
+    """
+    Составляет запрос FTS5 из слов terms.
+
+    Каждое слово берется в кавычки, чтобы операторы FTS5 в пользовательском вводе не
+    сработали, и ищется как префикс. Все слова должны встретиться в записи.
+    """
+    words = [word for term in terms for word in re.findall(r"\w+", term)]
+    return " ".join(f'"{word}"*' for word in words)
+
+
+class Match(Lookup):
+    """Условие MATCH по скрытому столбцу таблицы FTS5."""
+
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        """Составляет условие "<столбец> MATCH <запрос>"."""
+        lhs_sql, lhs_params = self.process_lhs(compiler, connection)
+        rhs_sql, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs_sql} MATCH {rhs_sql}", (*lhs_params, *rhs_params)
+
+
+class DocumentField(models.Field):
+    """
+    Скрытый столбец таблицы FTS5, имя которого совпадает с именем таблицы.
+
+    По нему выполняется поиск (lookup match), его же принимают первым аргументом
+    вспомогательные функции FTS5 :class:`Rank` и :class:`Snippet`.
+    """
+
+    def db_type(self, connection):
+        """Столбец создает сама FTS5, модель индекса не управляется миграциями."""
+        return None
+
+
+DocumentField.register_lookup(Match)
+
+
+class Rank(Func):
+    """Релевантность bm25 с весами столбцов weights: чем больше, тем выше."""
+
+    template = "-bm25(%(expressions)s)"
+    output_field = FloatField()
+
+    def __init__(self, document: str, weights: tuple[float, ...]):
+        """Готовит вызов bm25 для столбца document модели индекса."""
+        super().__init__(F(document), *(Value(weight) for weight in weights))
+
+
+class Snippet(Func):
+    """Фрагмент столбца номер column длиной до words слов, совпадения обрамлены start и end."""
+
+    function = "snippet"
+    output_field = TextField()
+
+    def __init__(self, document: str, column: int, start: str, end: str, ellipsis: str, words: int):
+        """Готовит вызов snippet для столбца document модели индекса."""
+        super().__init__(F(document), *(Value(arg) for arg in (column, start, end, ellipsis, words)))
+
+
+@dataclass(frozen=True)
+class FTSIndex:
+    """Таблица FTS5 по столбцам columns таблицы content_table с первичным ключом id."""
+
+    content_table: str
+    columns: tuple[str, ...]
+
+    @property
+    def table(self) -> str:
+        """Имя виртуальной таблицы индекса."""
+        return f"{self.content_table}_fts"
+
+    @property
+    def triggers(self) -> dict[str, str]:
+        """SQL триггеров синхронизации по их именам."""
+        columns = ", ".join(self.columns)
+        new = ", ".join(f"new.{column}" for column in self.columns)
+        old = ", ".join(f"old.{column}" for column in self.columns)
+        insert = f"INSERT INTO {self.table}(rowid, {columns}) VALUES (new.id, {new});"
+        delete = f"INSERT INTO {self.table}({self.table}, rowid, {columns}) VALUES ('delete', old.id, {old});"
+        return {
+            f"{self.table}_ai": f"""
+                CREATE TRIGGER IF NOT EXISTS {self.table}_ai AFTER INSERT ON {self.content_table} BEGIN
+                    {insert}
+                END
+            """,
+            f"{self.table}_ad": f"""
+                CREATE TRIGGER IF NOT EXISTS {self.table}_ad AFTER DELETE ON {self.content_table} BEGIN
+                    {delete}
+                END
+            """,
+            f"{self.table}_au": f"""
+                CREATE TRIGGER IF NOT EXISTS {self.table}_au AFTER UPDATE OF {columns} ON {self.content_table} BEGIN
+                    {delete}
+                    {insert}
+                END
+            """,
+        }
+
+    def install(self, executor) -> None:
+        """
+        Создает таблицу FTS5 и триггеры синхронизации, если их еще нет.
+
+        executor - редактор схемы в миграции или курсор базы данных.
+        """
+        executor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+            f"{', '.join(self.columns)}, content='{self.content_table}', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        for sql in self.triggers.values():
+            executor.execute(sql)
+
+    def uninstall(self, executor) -> None:
+        """Удаляет таблицу FTS5 и триггеры, executor как у install."""
+        for name in self.triggers:
+            executor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        executor.execute(f"DROP TABLE IF EXISTS {self.table}")
+        # Таблица могла быть уже найдена в этом процессе
+        _available.clear()
+
+    def rebuild(self, executor=None) -> None:
+        """Перестраивает таблицу FTS5 по текущему содержимому content_table."""
+        sql = f"INSERT INTO {self.table}({self.table}) VALUES ('rebuild')"
+        if executor is not None:
+            executor.execute(sql)
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+
+    def missing_triggers(self) -> set[str]:
+        """
+        Возвращает имена отсутствующих триггеров синхронизации.
+
+        SQLite пересоздает таблицу при многих ALTER TABLE в миграциях, и триггеры старой
+        таблицы при этом удаляются.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [self.content_table])
+            existing = {row[0] for row in cursor.fetchall()}
+        return set(self.triggers) - existing
+
+    def ensure(self, rebuild: bool = False) -> bool:
+        """
+        Восстанавливает индекс, если он поврежден, или перестраивает его при rebuild.
+
+        Возвращает True, если индекс был перестроен.
+        """
+        if connection.vendor != "sqlite" or not self.available():
+            return False
+        if self.missing_triggers():
+            rebuild = True
+            with connection.cursor() as cursor:
+                self.install(cursor)
+        if rebuild:
+            self.rebuild()
+        return rebuild
+
+    def available(self) -> bool:
+        """
+        Проверяет, что для текущей СУБД есть полнотекстовый индекс.
+
+        На PostgreSQL индекс GIN создает миграция. На SQLite запоминается только
+        найденная таблица: до migrate ее еще нет, а после должна найтись без перезапуска.
+        """
+        if connection.vendor == "postgresql":
+            return True
+        if connection.vendor != "sqlite":
+            return False
+        key = (connection.alias, self.table)
+        if key not in _available and self.table in connection.introspection.table_names():
+            _available.add(key)
+        return key in _available
+
+
+# Найденные таблицы FTS5 по псевдониму соединения, чтобы не проверять их в каждом запросе
+_available: set[tuple[str, str]] = set()
+
+
+def restore_search_index(sender, using, **kwargs) -> None:
+    """
+    Обработчик post_migrate: восстанавливает триггеры индекса приложения sender.
+
+    SQLite пересоздает таблицу модели при изменении полей, и ее триггеры теряются.
+    Индекс указывается путем импорта в атрибуте search_index конфигурации приложения.
+    """
+    if using == DEFAULT_DB_ALIAS:
+        import_string(sender.search_index).ensure()
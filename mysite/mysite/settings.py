@@ -48,6 +48,10 @@ ALLOWED_HOSTS = [
 INTERNAL_IPS = [
     "127.0.0.1",
 ]
+# Адреса или сети (CIDR) обратных прокси, например nginx из docker-compose. Только для
+# запросов с этих адресов IP клиента берется из X-Real-IP или X-Forwarded-For, иначе
+# любой клиент мог бы подставить чужой адрес (см. requestdataapp.middlewares.client_ip)
+TRUSTED_PROXIES = [proxy.strip() for proxy in settings.trusted_proxies.split(",") if proxy.strip()]
 
 if DEBUG:
     import socket
@@ -83,9 +87,13 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     # "django.middleware.cache.UpdateCacheMiddleware",  # Обязательно должен быть вверху списка
+    # Первым, чтобы в метрики попало время всех остальных middleware
+    "requestdataapp.middlewares.PerformanceMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
+    # До CsrfViewMiddleware: обработчики загрузки ставятся до разбора тела запроса
+    "requestdataapp.middlewares.UploadLimitMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
@@ -94,8 +102,7 @@ MIDDLEWARE = [
     "django.contrib.admindocs.middleware.XViewMiddleware",
     # Мидлвар проекта
     "requestdataapp.middlewares.set_useragent_on_request_middleware",
-    "requestdataapp.middlewares.CountRequestMiddleware",
-    "requestdataapp.middlewares.ThrottlingRequestMiddleware",
+    "requestdataapp.middlewares.RateLimitMiddleware",
     # "debug_toolbar.middleware.DebugToolbarMiddleware",
     # "django.middleware.cache.FetchFromCacheMiddleware",  # Это нужно писать в конце, что бы
     # отработали все middleware
@@ -121,6 +128,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "mysite.wsgi.application"
 
+# Тесты не зависят от Redis и не делят файловый кэш с запущенным сервером
+TEST_RUNNER = "mysite.test_runner.TestRunner"
+
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
@@ -131,21 +141,59 @@ DATABASES = {
     }
 }
 
-CACHES = {
-    "default": {
-        "BACKEND": "django.core.cache.backends.dummy.DummyCache",  # Использовать при
-        # создании приложения, она позволяет обращаться к кэшу в функциях но реально не
-        # кэширеут
-        # "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
-        # "LOCATION": "/var/tmp/django_cache",
-        # "LOCATION": "c:/foo/bar", # настройка для Windows
-        # "TIMEOUT": 60,
-        # "OPTIONS": {"MAX_ENTRIES": 300},
-    },
+# add и incr общего кэша должны быть атомарными: на них держатся версии кэша shopapp
+# и счетчики ограничителя частоты (см. mysite.cache.AtomicFileBasedCache)
+CACHE_L2_BACKENDS = {
+    "file": "mysite.cache.AtomicFileBasedCache",
+    "redis": "django.core.cache.backends.redis.RedisCache",
+    "locmem": "django.core.cache.backends.locmem.LocMemCache",
 }
+CACHE_BACKEND = settings.cache_backend
+
+if CACHE_BACKEND == "dummy":
+    # Позволяет обращаться к кэшу в функциях, но реально не кэширует
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+    }
+else:
+    # L1 в памяти процесса перед общим для всех воркеров L2, см. mysite.cache
+    CACHES = {
+        "default": {
+            "BACKEND": "mysite.cache.TieredCache",
+            "OPTIONS": {
+                "L2": "shared",
+                "L1_MAX_ENTRIES": settings.cache_l1_max_entries,
+                "L1_MAX_BYTES": settings.cache_l1_max_bytes,
+                "L1_TIMEOUT": settings.cache_l1_timeout,
+                # Версии ключей shopapp и счетчики ограничителя частоты должны быть общими
+                "L2_ONLY_PREFIXES": ["shopapp:version:", "ratelimit:"],
+            },
+        },
+        "shared": {
+            "BACKEND": CACHE_L2_BACKENDS[CACHE_BACKEND],
+            "LOCATION": settings.cache_location,
+            "TIMEOUT": 300,
+            # По умолчанию файловый и локальный кэши держат лишь 300 записей и при
+            # переполнении удаляют треть случайных, в том числе версии и счетчики
+            "OPTIONS": {"MAX_ENTRIES": settings.cache_max_entries},
+        },
+    }
 
 CACHE_MIDDLEWARE_SECONDS = 200  # Время кэширования в секундах
 
+# Ограничения частоты запросов по имени представления в формате "число/период", где
+# период s, m, h или d. "default" действует для остальных представлений, None снимает
+# ограничение. Счетчики хранятся в кэше RATE_LIMIT_CACHE (с DummyCache не работают).
+RATE_LIMIT_CACHE = "default"
+RATE_LIMITS = {
+    "default": "300/m",
+    "myauth:login": "10/m",
+    "myauth:register": "10/m",
+    "shopapp:product-upload-csv": "10/m",
+    "requestdataapp:file-upload": "20/m",
+    "requestdataapp:metrics": None,
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -199,7 +247,18 @@ STATIC_ROOT = BASE_DIR / "static"
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "uploads"
-# DEFAULT_FILE_STORAGE =
+# Временные файлы загрузок: вне MEDIA_ROOT, который nginx отдает как есть, но на том же
+# диске, чтобы принятый файл переносился в хранилище переименованием
+FILE_UPLOAD_TEMP_DIR = BASE_DIR / "uploads_tmp"
+FILE_UPLOAD_TEMP_DIR.mkdir(exist_ok=True)
+# Файлы фоновых задач (mysite.storage.PrivateStorage): вне MEDIA_ROOT, их отдает только
+# представление с проверкой прав
+PRIVATE_MEDIA_ROOT = BASE_DIR / "private"
+# Одинаковые загруженные файлы хранятся один раз, см. mysite/storage.py
+STORAGES = {
+    "default": {"BACKEND": "mysite.storage.ContentAddressedStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
@@ -0,0 +1,191 @@
+"""
+Хранилище медиафайлов с адресацией по содержимому.
+
+Файл сохраняется под именем из SHA-256 его содержимого в каталогах по первым
+символам хэша: ``blobs/3f/a2/3fa2...e1.jpg``. Одинаковые файлы, загруженные к разным
+товарам или профилям, занимают на диске одно место: повторная загрузка только
+проверяет, что файл уже есть, без записи. Имя, переданное в save (результат
+upload_to), нужно лишь для расширения файла.
+
+Один файл может принадлежать нескольким записям, поэтому delete его не удаляет.
+Файлы без ссылок удаляет команда ``manage.py collect_media_garbage``
+(:func:`collect_garbage`): она считает ссылки на каждый файл по всем полям FileField
+моделей и удаляет файлы без ссылок, которые не менялись дольше GARBAGE_GRACE.
+
+Файлы, сохраненные до подключения хранилища, лежат вне ``blobs/`` и ведут себя как
+в FileSystemStorage.
+
+Файлы, которые можно получить только через представление с проверкой прав (входные
+файлы и результаты фоновых задач), хранятся в :class:`PrivateStorage` вне MEDIA_ROOT:
+nginx отдает MEDIA_ROOT всем без проверок.
+
+Пример настройки::
+
+    STORAGES = {
+        "default": {"BACKEND": "mysite.storage.ContentAddressedStorage"},
+        ...
+    }
+"""
+
+import hashlib
+import os
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import timedelta
+from pathlib import Path, PurePosixPath
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import models
+from django.utils.functional import cached_property
+
+BLOB_PREFIX = "blobs/"
+# Сколько символов хэша в именах каталогов каждого уровня и сколько уровней
+SHARD_WIDTH = 2
+SHARD_DEPTH = 2
+MAX_EXTENSION_LENGTH = 10
+# Файл без ссылок моложе этого срока не удаляется: запись, которая на него сошлется,
+# может быть еще не зафиксирована
+GARBAGE_GRACE = timedelta(hours=1)
+
+
+def file_sha256(file: File) -> str:
+    """Считает SHA-256 содержимого файла, читая его кусками, если его не посчитали при приеме загрузки."""
+    if getattr(file, "sha256", None):
+        return file.sha256
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def blob_name(sha256: str, name: str) -> str:
+    """Имя файла с хэшем sha256 и расширением файла name."""
+    extension = PurePosixPath(name).suffix.lower()
+    if len(extension) > MAX_EXTENSION_LENGTH:
+        extension = ""
+    shards = [sha256[i * SHARD_WIDTH : (i + 1) * SHARD_WIDTH] for i in range(SHARD_DEPTH)]
+    return f"{BLOB_PREFIX}{'/'.join(shards)}/{sha256}{extension}"
+
+
+def is_blob(name: str) -> bool:
+    """Проверяет, что name - имя файла с адресацией по содержимому."""
+    return name.startswith(BLOB_PREFIX)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage, который хранит каждый уникальный файл один раз под именем из хэша."""
+
+    def _save(self, name: str, content: File) -> str:
+        """Сохраняет файл под именем из хэша, если файла с таким содержимым еще нет."""
+        # Загрузка, принятая UploadLimitHandler, приходит с уже посчитанным хэшем
+        name = blob_name(file_sha256(content), name)
+        try:
+            # Время изменения продлевает защиту файла от удаления на GARBAGE_GRACE
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            # Если тот же файл одновременно записывает другой процесс, FileSystemStorage
+            # сохранит копию под другим именем: место потеряется, но ссылки останутся верными
+            return super()._save(name, content)
+        return name
+
+    def delete(self, name: str) -> None:
+        """Удаляет файл, сохраненный до подключения хранилища: общие файлы удаляет только сборка мусора."""
+        if name and not is_blob(name):
+            super().delete(name)
+
+
+class PrivateStorage(FileSystemStorage):
+    """FileSystemStorage в каталоге PRIVATE_MEDIA_ROOT, файлы которого не имеют публичного URL."""
+
+    @cached_property
+    def base_location(self):
+        """Каталог хранилища: location или PRIVATE_MEDIA_ROOT."""
+        return self._value_or_setting(self._location, settings.PRIVATE_MEDIA_ROOT)
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        """Сбрасывает каталог при изменении PRIVATE_MEDIA_ROOT (в тестах)."""
+        super()._clear_cached_properties(setting, **kwargs)
+        if setting == "PRIVATE_MEDIA_ROOT":
+            self.__dict__.pop("base_location", None)
+            self.__dict__.pop("location", None)
+
+    def url(self, name):
+        """Файлы отдаются только представлениями с проверкой прав."""
+        raise ValueError("Private files have no public URL")
+
+
+_private_storage = PrivateStorage()
+
+
+def private_storage() -> PrivateStorage:
+    """Хранилище закрытых файлов для параметра storage полей FileField."""
+    return _private_storage
+
+
+def file_fields() -> list[tuple[type[models.Model], str]]:
+    """Поля FileField (и ImageField) всех моделей, файлы которых лежат в хранилище по умолчанию."""
+    return [
+        (model, field.name)
+        for model in apps.get_models()
+        for field in model._meta.concrete_fields
+        if isinstance(field, models.FileField) and field.storage is default_storage
+    ]
+
+
+def reference_counts() -> Counter:
+    """Считает, сколько записей ссылается на каждый файл с адресацией по содержимому."""
+    counts = Counter()
+    for model, field in file_fields():
+        names = model._base_manager.filter(**{f"{field}__startswith": BLOB_PREFIX}).values_list(field, flat=True)
+        counts.update(names.iterator())
+    return counts
+
+
+@dataclass
+class GarbageReport:
+    """Итог сборки мусора: число файлов со ссылками, удаленных файлов и освобожденных байт."""
+
+    referenced: int = 0
+    deleted: int = 0
+    freed: int = 0
+
+
+def collect_garbage(
+    storage: FileSystemStorage = default_storage, grace: timedelta = GARBAGE_GRACE, dry_run: bool = False
+) -> GarbageReport:
+    """
+    Удаляет файлы хранилища storage, на которые не ссылается ни одна запись.
+
+    Ссылки считаются до обхода каталогов, поэтому файл, сохраненный во время сборки,
+    защищен только сроком grace. dry_run только считает, что было бы удалено.
+    """
+    counts = reference_counts()
+    report = GarbageReport(referenced=len(counts))
+    root = storage.path(BLOB_PREFIX)
+    horizon = time.time() - grace.total_seconds()
+    for directory, _, filenames in os.walk(root, topdown=False):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            name = BLOB_PREFIX + Path(os.path.relpath(path, root)).as_posix()
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if counts[name] or stat.st_mtime > horizon:
+                continue
+            report.deleted += 1
+            report.freed += stat.st_size
+            if not dry_run:
+                os.remove(path)
+        if not dry_run and directory != root and not os.listdir(directory):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                # В каталог только что записали новый файл
+                pass
+    return report
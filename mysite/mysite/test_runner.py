@@ -0,0 +1,39 @@
+"""Запуск тестов проекта."""
+
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from mysite.cache import local_caches
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Запуск тестов с кэшами в памяти процесса.
+
+    Тесты не зависят от Redis и не делят с запущенным сервером файловый кэш, каталог
+    временных файлов загрузок и закрытые файлы, а структура кэшей (TieredCache перед
+    L2) остается как в settings.CACHES.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        """Подменяет кэши и каталоги временных файлов загрузок и закрытых файлов на время тестов."""
+        super().setup_test_environment(**kwargs)
+        self.upload_temp_dir = tempfile.mkdtemp()
+        self.private_media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            CACHES=local_caches(settings.CACHES, "tests"),
+            FILE_UPLOAD_TEMP_DIR=self.upload_temp_dir,
+            PRIVATE_MEDIA_ROOT=self.private_media_root,
+        )
+        self.settings_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        """Возвращает настройки и удаляет временные и закрытые файлы тестов."""
+        self.settings_override.disable()
+        shutil.rmtree(self.upload_temp_dir, ignore_errors=True)
+        shutil.rmtree(self.private_media_root, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
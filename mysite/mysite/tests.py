@@ -0,0 +1,184 @@
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, storages
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from mysite.cache import AtomicFileBasedCache
+from mysite.storage import collect_garbage, reference_counts
+from shopapp.models import Order
+
+TIERED_CACHES = {
+    "default": {
+        "BACKEND": "mysite.cache.TieredCache",
+        "LOCATION": "tiered-tests",
+        "OPTIONS": {
+            "L2": "shared",
+            "L1_MAX_ENTRIES": 2,
+            "L1_MAX_BYTES": 1024,
+            "L2_ONLY_PREFIXES": ["counter:"],
+        },
+    },
+    "shared": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "tiered-tests-l2"},
+}
+
+
+@override_settings(CACHES=TIERED_CACHES)
+class TieredCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        self.cache = caches["default"]
+        self.l2 = caches["shared"]
+        self.cache.clear()
+        self.cache.l1.stats.update(l1_hits=0, l2_hits=0, misses=0, evictions=0)
+
+    def test_reads_from_l1_then_l2(self):
+        self.cache.set("key", [1, 2])
+        self.assertEqual(self.l2.get("key"), [1, 2])
+        self.assertEqual(self.cache.get("key"), [1, 2])
+
+        self.cache.l1.clear()
+        self.assertEqual(self.cache.get("key"), [1, 2])
+        self.assertEqual(self.cache.get("key"), [1, 2])
+        self.assertIsNone(self.cache.get("missing"))
+
+        stats = self.cache.stats()
+        self.assertEqual((stats["l1_hits"], stats["l2_hits"], stats["misses"]), (2, 1, 1))
+
+    def test_l1_returns_copies(self):
+        self.cache.set("key", [1])
+        self.cache.get("key").append(2)
+
+        self.assertEqual(self.cache.get("key"), [1])
+
+    def test_lru_eviction(self):
+        for key in ("a", "b", "c"):
+            self.cache.set(key, key)
+
+        self.assertIsNone(self.cache.l1.get(self.cache.make_key("a")))
+        self.assertEqual(self.cache.stats()["l1_entries"], 2)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+        self.assertEqual(self.cache.get("a"), "a")
+
+        self.cache.set("large", "x" * 2048)
+        self.assertIsNone(self.cache.l1.get(self.cache.make_key("large")))
+        self.assertEqual(self.cache.get("large"), "x" * 2048)
+
+    def test_atomic_operations_use_l2(self):
+        self.assertTrue(self.cache.add("lock", 1))
+        self.assertFalse(self.cache.add("lock", 2))
+
+        self.cache.set("counter:views", 1)
+        self.assertEqual(self.cache.incr("counter:views"), 2)
+        self.l2.incr("counter:views")
+        self.assertEqual(self.cache.get("counter:views"), 3)
+
+    def test_delete_and_get_many(self):
+        self.cache.set_many({"a": 1, "b": 2})
+        self.cache.l1.clear()
+        self.cache.get("a")
+
+        self.assertEqual(self.cache.get_many(["a", "b", "c"]), {"a": 1, "b": 2})
+        self.cache.delete("a")
+        self.assertIsNone(self.cache.get("a"))
+        self.assertIsNone(self.l2.get("a"))
+
+    async def test_async_reads_hit_l1_without_l2(self):
+        self.cache.set_many({"a": 1, "b": 2})
+        self.cache.l1.delete(self.cache.make_key("b"))
+
+        with mock.patch.object(type(self.l2), "aget", side_effect=AssertionError("L2 read")):
+            self.assertEqual(await self.cache.aget("a"), 1)
+        self.assertEqual(await self.cache.aget_many(["a", "b", "c"]), {"a": 1, "b": 2})
+        self.assertEqual(await self.cache.aget("b"), 2)
+
+        stats = self.cache.stats()
+        self.assertEqual((stats["l1_hits"], stats["l2_hits"], stats["misses"]), (3, 1, 1))
+
+    async def test_async_incr_keeps_ttl(self):
+        self.cache.set("counter:views", 1, timeout=None)
+
+        self.assertEqual(await self.cache.aincr("counter:views"), 2)
+
+        self.assertIsNone(self.l2._expire_info[self.l2.make_key("counter:views")])
+
+
+class AtomicFileBasedCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        self.cache = AtomicFileBasedCache(location, {"TIMEOUT": 300})
+
+    def test_incr_keeps_ttl(self):
+        self.cache.set("version", 1, timeout=None)
+        self.cache.set("counter", 1, timeout=60)
+
+        self.cache.incr("version")
+        self.cache.incr("counter")
+
+        with mock.patch("time.time", return_value=time.time() + 3600):
+            self.assertEqual(self.cache.get("version"), 2)
+            self.assertIsNone(self.cache.get("counter"))
+        with self.assertRaises(ValueError):
+            self.cache.incr("missing")
+
+    def test_concurrent_add_and_incr(self):
+        added = []
+
+        def hit(_):
+            added.append(self.cache.add("counter", 0))
+            return self.cache.incr("counter")
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(hit, range(40)))
+
+        self.assertEqual(added.count(True), 1)
+        self.assertEqual(sorted(results), list(range(1, 41)))
+
+
+class ContentAddressedStorageTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.storage = storages["default"]
+
+    def test_identical_content_is_stored_once(self):
+        name = self.storage.save("products/product_1/images/photo.JPG", ContentFile(b"same bytes"))
+        self.assertRegex(name, r"^blobs/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$")
+
+        with mock.patch.object(FileSystemStorage, "_save") as write:
+            self.assertEqual(self.storage.save("products/product_2/images/copy.jpg", ContentFile(b"same bytes")), name)
+        write.assert_not_called()
+        self.assertNotEqual(self.storage.save("other.jpg", ContentFile(b"other bytes")), name)
+
+        self.storage.delete(name)
+        self.assertTrue(self.storage.exists(name))
+
+    def test_garbage_collection_keeps_referenced_files(self):
+        order = Order(user=User.objects.create_user(username="receipt-owner"))
+        order.receipt.save("receipt.txt", ContentFile(b"id\n"))
+        orphan = self.storage.save("orphan.csv", ContentFile(b"orphan"))
+
+        self.assertEqual(collect_garbage(self.storage).deleted, 0)
+        self.assertEqual(reference_counts()[order.receipt.name], 1)
+
+        report = collect_garbage(self.storage, grace=timedelta(0), dry_run=True)
+        self.assertEqual((report.deleted, report.freed), (1, len(b"orphan")))
+        self.assertTrue(self.storage.exists(orphan))
+
+        call_command("collect_media_garbage", "--grace-minutes", "0", stdout=StringIO())
+        self.assertFalse(self.storage.exists(orphan))
+        self.assertFalse(os.path.exists(os.path.dirname(self.storage.path(orphan))))
+        self.assertTrue(self.storage.exists(order.receipt.name))
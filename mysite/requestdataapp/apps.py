@@ -1,6 +1,7 @@
 """Модуль конфигурации приложения requestdataapp."""
 
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class RequestdataappConfig(AppConfig):
@@ -8,3 +9,9 @@ class RequestdataappConfig(AppConfig):
 
     default_auto_field = "django.db.models.BigAutoField"
     name = "requestdataapp"
+
+    def ready(self):
+        """Подключает подсчет SQL-запросов к соединениям с базой."""
+        from .metrics import install_query_counter
+
+        connection_created.connect(install_query_counter, dispatch_uid="requestdataapp.install_query_counter")
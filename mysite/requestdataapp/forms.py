@@ -4,6 +4,8 @@ from django import forms
 from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import InMemoryUploadedFile
 
+from .uploads import UploadLimit
+
 
 class UserBioForm(forms.Form):
     """Форма для ввода биографической информации пользователя."""
@@ -28,3 +30,5 @@ class UploadFileForm(forms.Form):
     """Форма для загрузки файлов с валидацией имени файла."""
 
     file = forms.FileField(validators=[validate_file_name])
+
+    upload_limit = UploadLimit(max_file_size=1 * 1024 * 1024)
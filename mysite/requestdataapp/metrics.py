@@ -0,0 +1,235 @@
+"""
+Метрики производительности запросов в памяти процесса.
+
+Middleware :class:`requestdataapp.middlewares.PerformanceMetricsMiddleware` складывает
+сюда время ответа, время и число SQL-запросов, обращения к кэшу и размер ответа по
+каждому представлению, а представление ``metrics_view`` отдает их в текстовом формате
+Prometheus. Метрики хранятся в каждом процессе отдельно: Prometheus опрашивает воркеры
+и суммирует их сам.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.cache import caches
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+@dataclass
+class RequestStats:
+    """Счетчики одного запроса, которые заполняются по ходу его обработки."""
+
+    db_time: float = 0.0
+    queries: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+
+
+current_request: ContextVar[RequestStats | None] = ContextVar("current_request", default=None)
+
+
+def record_cache_access(hit: bool) -> None:
+    """
+    Отмечает попадание или промах кэша в текущем запросе.
+
+    Вызывается кодом, который читает кэш. Вне запроса ничего не делает.
+    """
+    stats = current_request.get()
+    if stats is None:
+        return
+    if hit:
+        stats.cache_hits += 1
+    else:
+        stats.cache_misses += 1
+
+
+def count_query(execute, sql, params, many, context):
+    """
+    Обертка выполнения SQL-запроса, считающая запросы и время в базе текущего запроса.
+
+    Стоит на каждом соединении с базой (см. :func:`install_query_counter`), а счетчики
+    берет из контекста: асинхронный ORM выполняет запросы в потоке sync_to_async, куда
+    копируется контекст запроса. Вне запроса только выполняет SQL.
+    """
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_time += time.perf_counter() - start
+        stats.queries += 1
+
+
+def install_query_counter(sender, connection, **kwargs) -> None:
+    """Обработчик сигнала connection_created, ставящий count_query на соединение."""
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+@dataclass
+class Histogram:
+    """Гистограмма с фиксированными границами корзин, как в Prometheus."""
+
+    buckets: tuple[float, ...]
+    counts: list[int] = field(default_factory=list)
+    sum: float = 0.0
+    count: int = 0
+
+    def __post_init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, value: float) -> None:
+        """Добавляет наблюдение в гистограмму."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """Возвращает накопительные счетчики корзин с границей le."""
+        result = []
+        total = 0
+        for bound, count in zip((*map(format_value, self.buckets), "+Inf"), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class MetricsRegistry:
+    """Набор гистограмм и счетчиков процесса, безопасный для потоков."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms: dict[str, dict[Labels, Histogram]] = {}
+        self.counters: dict[str, dict[Labels, float]] = {}
+        self.help: dict[str, str] = {}
+
+    def describe(self, name: str, text: str) -> None:
+        """Задает описание метрики для строки # HELP."""
+        self.help[name] = text
+
+    def observe(self, name: str, value: float, buckets: tuple[float, ...], **labels: str) -> None:
+        """Добавляет наблюдение в гистограмму name с метками labels."""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(buckets)
+            series[key].observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        """Увеличивает счетчик name с метками labels."""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def clear(self) -> None:
+        """Сбрасывает все метрики."""
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def render(self) -> str:
+        """Возвращает метрики в текстовом формате Prometheus."""
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                self.render_header(lines, name, "counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+            for name, series in sorted(self.histograms.items()):
+                self.render_header(lines, name, "histogram")
+                for labels, histogram in sorted(series.items()):
+                    for bound, count in histogram.cumulative():
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {count}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {format_value(histogram.sum)}")
+                    lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def render_header(self, lines: list[str], name: str, kind: str) -> None:
+        """Добавляет строки # HELP и # TYPE метрики."""
+        if name in self.help:
+            lines.append(f"# HELP {name} {self.help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+def format_value(value: float) -> str:
+    """Форматирует число без лишних нулей, как его ожидает Prometheus."""
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def format_labels(labels: Labels) -> str:
+    """Форматирует метки метрики в виде {name="value",...}."""
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+registry = MetricsRegistry()
+registry.describe("django_http_requests_total", "Responses by view, method and status code.")
+registry.describe("django_http_request_duration_seconds", "Wall time of a request by view.")
+registry.describe("django_http_request_db_seconds", "Time spent in SQL queries per request by view.")
+registry.describe("django_http_request_queries", "SQL queries per request by view.")
+registry.describe("django_http_response_size_bytes", "Response body size by view.")
+registry.describe("django_cache_requests_total", "Cache reads by view and result (hit or miss).")
+
+
+def record_request(view: str, method: str, status: int, duration: float, stats: RequestStats) -> None:
+    """Записывает метрики завершенного запроса."""
+    registry.inc("django_http_requests_total", view=view, method=method, status=str(status))
+    registry.observe("django_http_request_duration_seconds", duration, DURATION_BUCKETS, view=view)
+    registry.observe("django_http_request_db_seconds", stats.db_time, DURATION_BUCKETS, view=view)
+    registry.observe("django_http_request_queries", stats.queries, QUERY_BUCKETS, view=view)
+    if stats.cache_hits:
+        registry.inc("django_cache_requests_total", stats.cache_hits, view=view, result="hit")
+    if stats.cache_misses:
+        registry.inc("django_cache_requests_total", stats.cache_misses, view=view, result="miss")
+
+
+def record_response_size(view: str, size: int) -> None:
+    """Записывает размер тела ответа."""
+    registry.observe("django_http_response_size_bytes", size, SIZE_BUCKETS, view=view)
+
+
+def render_cache_stats() -> str:
+    """Возвращает статистику кэшей с методом stats() (см. mysite.cache) в формате Prometheus."""
+    counters = []
+    gauges = []
+    for alias in settings.CACHES:
+        stats_method = getattr(caches[alias], "stats", None)
+        if stats_method is None:
+            continue
+        stats = stats_method()
+        labels = (("cache", alias),)
+        for result in ("l1_hits", "l2_hits", "misses", "evictions"):
+            counters.append(f"django_cache_tier_total{format_labels(labels + (('result', result),))} {stats[result]}")
+        gauges.append(f"django_cache_l1_entries{format_labels(labels)} {stats['l1_entries']}")
+        gauges.append(f"django_cache_l1_bytes{format_labels(labels)} {stats['l1_bytes']}")
+    if not counters:
+        return ""
+    return "\n".join(
+        [
+            "# HELP django_cache_tier_total Tiered cache reads by result and evictions from L1.",
+            "# TYPE django_cache_tier_total counter",
+            *counters,
+            "# TYPE django_cache_l1_entries gauge",
+            *gauges[::2],
+            "# TYPE django_cache_l1_bytes gauge",
+            *gauges[1::2],
+        ]
+    ) + "\n"
@@ -1,83 +1,361 @@
 """Модуль для определения middleware в приложении requestdataapp."""
 
+import ipaddress
 import time
+from functools import lru_cache
+from math import ceil
 
-from django.http import HttpRequest, JsonResponse
-from django.shortcuts import render
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.http import HttpRequest, HttpResponse
+from django.utils.decorators import sync_and_async_middleware
 
+from .metrics import RequestStats, current_request, record_request, record_response_size
+from .uploads import UploadLimitHandler
 
+
+class HybridMiddleware:
+    """
+    Базовый класс middleware, работающего и в синхронном (WSGI), и в асинхронном (ASGI) стеке.
+
+    Django передает в get_response функцию или корутинную функцию в зависимости от
+    режима. В асинхронном режиме запрос обрабатывает __acall__, а process_view
+    заменяется на aprocess_view: синхронный process_view Django обернул бы в
+    sync_to_async, и каждый запрос переключался бы в поток.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init_subclass__(cls, **kwargs):
+        """Помечает aprocess_view подкласса корутинной функцией."""
+        super().__init_subclass__(**kwargs)
+        # Sentry оборачивает методы middleware синхронной функцией через functools.wraps.
+        # Метка из __dict__ переходит к обертке, и Django ждет ее результат, а не
+        # вызывает ее в sync_to_async (флаг async def обертке не передается)
+        if "aprocess_view" in cls.__dict__:
+            markcoroutinefunction(cls.aprocess_view)
+
+    def __init__(self, get_response):
+        """Инициализирует middleware в режиме get_response."""
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            if hasattr(self, "aprocess_view"):
+                self.process_view = self.aprocess_view
+
+    def __call__(self, request: HttpRequest):
+        """Пропускает запрос дальше, в асинхронном режиме возвращает корутину."""
+        if self.is_async:
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request: HttpRequest):
+        """Пропускает запрос дальше в асинхронном режиме."""
+        return await self.get_response(request)
+
+
+@sync_and_async_middleware
 def set_useragent_on_request_middleware(get_response):
     """Middleware для установки пользовательского агента на запрос."""
-    # print("Initial call")
+    if iscoroutinefunction(get_response):
 
-    def middleware(request: HttpRequest):
-        """Обрабатывает входящий запрос и устанавливает пользовательский агент."""
-        # print("before get response")
-        request.user_agent = request.META.get("HTTP_USER_AGENT", "test-agent")
-        response = get_response(request)
-        # print("after get response")
+        async def middleware(request: HttpRequest):
+            """Обрабатывает входящий запрос и устанавливает пользовательский агент."""
+            request.user_agent = request.META.get("HTTP_USER_AGENT", "test-agent")
+            return await get_response(request)
 
-        return response
+    else:
+
+        def middleware(request: HttpRequest):
+            """Обрабатывает входящий запрос и устанавливает пользовательский агент."""
+            request.user_agent = request.META.get("HTTP_USER_AGENT", "test-agent")
+            return get_response(request)
 
     return middleware
 
 
-class CountRequestMiddleware:
-    """Middleware для подсчета количества запросов, ответов и исключений."""
+class PerformanceMetricsMiddleware(HybridMiddleware):
+    """
+    Middleware для сбора метрик производительности запросов.
 
-    def __init__(self, get_response):
-        """Инициализирует middleware."""
-        self.get_response = get_response
-        self.requests_count = 0
-        self.responses_count = 0
-        self.exceptions_count = 0
+    По каждому запросу записывает имя представления, время ответа, время и число
+    SQL-запросов, обращения к кэшу и размер ответа в гистограммы
+    :mod:`requestdataapp.metrics`. SQL-запросы считает обертка
+    :func:`requestdataapp.metrics.count_query` на каждом соединении: асинхронный ORM
+    выполняет запросы в другом потоке, но с контекстом запроса.
+    """
 
     def __call__(self, request: HttpRequest):
-        """Обрабатывает входящий запрос и увеличивает счетчик запросов."""
-        self.requests_count += 1
-        # print(f"requests count {self.requests_count}")
-        response = self.get_response(request)
-        self.responses_count += 1
-        # print(f"responses count {self.responses_count}")
+        """Обрабатывает запрос и записывает его метрики."""
+        if self.is_async:
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.record(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request: HttpRequest):
+        """Обрабатывает запрос в асинхронном режиме и записывает его метрики."""
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.record(request, response, stats, time.perf_counter() - start)
+
+    def record(self, request: HttpRequest, response: HttpResponse, stats: RequestStats, duration: float):
+        """Записывает метрики запроса, размер потокового ответа - после его отправки."""
+        match = request.resolver_match
+        view = match.view_name if match else "<unresolved>"
+        record_request(view, request.method, response.status_code, duration, stats)
+        if not response.streaming:
+            record_response_size(view, len(response.content))
+        elif response.is_async:
+            response.streaming_content = self.acount_streaming_size(view, response.streaming_content)
+        else:
+            response.streaming_content = self.count_streaming_size(view, response.streaming_content)
         return response
 
-    def process_exception(self, request: HttpRequest, exception: Exception):
+    @staticmethod
+    def count_streaming_size(view: str, content):
+        """Пропускает потоковый ответ и записывает его размер после отправки."""
+        size = 0
+        for chunk in content:
+            size += len(chunk)
+            yield chunk
+        record_response_size(view, size)
+
+    @staticmethod
+    async def acount_streaming_size(view: str, content):
+        """Пропускает асинхронный потоковый ответ и записывает его размер после отправки."""
+        size = 0
+        async for chunk in content:
+            size += len(chunk)
+            yield chunk
+        record_response_size(view, size)
+
+
+RATE_PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_rate(rate: str) -> tuple[int, int]:
+    """Разбирает ограничение вида "100/m" в пару (число запросов, период в секундах)."""
+    count, period = rate.split("/")
+    return int(count), RATE_PERIODS[period[0]]
+
+
+class SlidingWindowRateLimiter:
+    """
+    Ограничитель частоты запросов со скользящим окном.
+
+    На каждого клиента в кэше хранятся два счетчика: текущего и предыдущего окна.
+    Число запросов за последние period секунд оценивается как счетчик текущего окна
+    плюс доля предыдущего, еще попадающая в скользящее окно. Счетчики живут два
+    периода и удаляются кэшем сами. Отклоненный запрос не учитывается: иначе клиент,
+    повторяющий запросы, не дождался бы конца ограничения.
+    """
+
+    def __init__(self, cache, prefix: str = "ratelimit"):
+        """Инициализирует ограничитель поверх кэша cache."""
+        self.cache = cache
+        self.prefix = prefix
+
+    def hit(self, key: str, limit: int, period: int, now: float | None = None) -> float | None:
         """
-        Обрабатывает исключения и увеличивает счетчик исключений.
+        Учитывает запрос клиента key.
 
-        Увеличивает счетчик исключений при возникновении ошибки.
+        Возвращает None, если запрос укладывается в limit запросов за period секунд,
+        иначе число секунд, через которое стоит повторить запрос.
         """
-        self.exceptions_count += 1
-        # print(f"exceptions count {self.exceptions_count}")
+        now = time.time() if now is None else now
+        window, elapsed = divmod(now, period)
+        current_key = f"{self.prefix}:{key}:{int(window)}"
+        previous_key = f"{self.prefix}:{key}:{int(window) - 1}"
 
+        self.cache.add(current_key, 0, timeout=2 * period)
+        try:
+            current = self.cache.incr(current_key)
+        except ValueError:
+            # Ключ успел удалиться или кэш ничего не хранит (DummyCache): не ограничиваем
+            return None
+        previous = self.cache.get(previous_key, 0)
+        retry_after = self.retry_after(previous, current, limit, period, elapsed)
+        if retry_after is not None:
+            self.uncount(current_key)
+        return retry_after
 
-class ThrottlingRequestMiddleware:
-    """Middleware для ограничения частоты запросов по IP-адресу."""
+    async def ahit(self, key: str, limit: int, period: int, now: float | None = None) -> float | None:
+        """Асинхронный вариант :meth:`hit` через асинхронный API кэша."""
+        now = time.time() if now is None else now
+        window, elapsed = divmod(now, period)
+        current_key = f"{self.prefix}:{key}:{int(window)}"
+        previous_key = f"{self.prefix}:{key}:{int(window) - 1}"
 
-    def __init__(self, get_response):
-        """Инициализирует middleware."""
-        self.get_response = get_response
-        self.last_request = {}
-        self.time_limit = 0.00001
+        await self.cache.aadd(current_key, 0, timeout=2 * period)
+        try:
+            current = await self.cache.aincr(current_key)
+        except ValueError:
+            return None
+        previous = await self.cache.aget(previous_key, 0)
+        retry_after = self.retry_after(previous, current, limit, period, elapsed)
+        if retry_after is not None:
+            await self.auncount(current_key)
+        return retry_after
 
-    def __call__(self, request: HttpRequest):
-        """Обрабатывает входящий запрос и применяет ограничения на частоту."""
-        ip = request.META["REMOTE_ADDR"]
+    def uncount(self, current_key: str) -> None:
+        """Возвращает счетчик отклоненного запроса назад."""
+        try:
+            self.cache.decr(current_key)
+        except ValueError:
+            pass
 
-        if ip not in self.last_request:
-            self.last_request[ip] = time.time()
-        else:
-            current_time_limit = time.time() - self.last_request[ip]
-            if current_time_limit < self.time_limit:
-                return render(
-                    request,
-                    "requestdataapp/base.html",
-                    {"error": "Limit rate requests"},
-                    status=429,
-                )
-            else:
-                self.last_request[ip] = time.time()
-
-        response = self.get_response(request)
+    async def auncount(self, current_key: str) -> None:
+        """Асинхронный вариант :meth:`uncount`."""
+        try:
+            await self.cache.adecr(current_key)
+        except ValueError:
+            pass
+
+    @staticmethod
+    def retry_after(previous: int, current: int, limit: int, period: int, elapsed: float) -> float | None:
+        """Оценивает число запросов в скользящем окне и возвращает время до повтора или None."""
+        if previous * (1 - elapsed / period) + current > limit:
+            return period - elapsed
+        return None
+
+
+class RateLimitMiddleware(HybridMiddleware):
+    """
+    Middleware для ограничения частоты запросов.
+
+    Ограничения задаются в settings.RATE_LIMITS по имени представления, ключ "default"
+    действует для остальных. Счетчики хранятся в кэше settings.RATE_LIMIT_CACHE, поэтому
+    общие для всех воркеров и серверов. Клиент определяется по IP-адресу (см.
+    :func:`client_ip`). Отказ
+    отдается без шаблона, со статусом 429 и заголовком Retry-After.
+    """
+
+    def process_view(self, request: HttpRequest, view_func, view_args, view_kwargs):
+        """Проверяет ограничение для представления, к которому идет запрос."""
+        rule = self.get_rule(request)
+        if rule is None:
+            return None
+        limiter, key, limit, period = rule
+        return self.reject(limiter.hit(key, limit, period))
 
+    async def aprocess_view(self, request: HttpRequest, view_func, view_args, view_kwargs):
+        """Проверяет ограничение в асинхронном режиме."""
+        rule = self.get_rule(request)
+        if rule is None:
+            return None
+        limiter, key, limit, period = rule
+        return self.reject(await limiter.ahit(key, limit, period))
+
+    def get_rule(self, request: HttpRequest) -> tuple[SlidingWindowRateLimiter, str, int, int] | None:
+        """Возвращает ограничитель, ключ клиента и ограничение представления или None, если его нет."""
+        limits = getattr(settings, "RATE_LIMITS", {})
+        view = request.resolver_match.view_name
+        rate = limits.get(view, limits.get("default"))
+        if not rate:
+            return None
+
+        limit, period = parse_rate(rate)
+        limiter = SlidingWindowRateLimiter(caches[getattr(settings, "RATE_LIMIT_CACHE", DEFAULT_CACHE_ALIAS)])
+        return limiter, f"{view}:ip:{self.client_key(request)}", limit, period
+
+    @staticmethod
+    def reject(retry_after: float | None) -> HttpResponse | None:
+        """Возвращает ответ 429, если запрос нужно повторить через retry_after секунд."""
+        if retry_after is None:
+            return None
+
+        response = HttpResponse("Too many requests", status=429, content_type="text/plain")
+        response["Retry-After"] = str(max(ceil(retry_after), 1))
         return response
+
+    @staticmethod
+    def client_key(request: HttpRequest) -> str:
+        """
+        Возвращает идентификатор клиента.
+
+        Используется IP-адрес, а не пользователь: проверка request.user загрузила бы
+        сессию и пользователя даже для представлений, которым они не нужны.
+        """
+        return client_ip(request)
+
+
+@lru_cache
+def trusted_networks(proxies: tuple[str, ...]) -> tuple[ipaddress.IPv4Network | ipaddress.IPv6Network, ...]:
+    """Разбирает адреса и сети из settings.TRUSTED_PROXIES."""
+    return tuple(ipaddress.ip_network(proxy, strict=False) for proxy in proxies)
+
+
+def is_trusted_proxy(address: str) -> bool:
+    """Проверяет, что запрос с адреса address пришел от доверенного обратного прокси."""
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted_networks(tuple(getattr(settings, "TRUSTED_PROXIES", ()))))
+
+
+def client_ip(request: HttpRequest) -> str:
+    """
+    Возвращает IP-адрес клиента.
+
+    За nginx REMOTE_ADDR у всех запросов - адрес nginx, поэтому для запросов от прокси
+    из settings.TRUSTED_PROXIES адрес берется из X-Real-IP, который nginx заменяет
+    своим $remote_addr, или из X-Forwarded-For: последний адрес справа, не
+    принадлежащий доверенному прокси. Остальным клиентам эти заголовки не доверяются,
+    иначе любой мог бы выдать себя за другого.
+    """
+    remote_addr = request.META.get("REMOTE_ADDR", "")
+    if not is_trusted_proxy(remote_addr):
+        return remote_addr
+    real_ip = request.META.get("HTTP_X_REAL_IP", "").strip()
+    if real_ip and not is_trusted_proxy(real_ip):
+        return real_ip
+    forwarded = [address.strip() for address in request.META.get("HTTP_X_FORWARDED_FOR", "").split(",")]
+    for address in reversed(forwarded):
+        if address and not is_trusted_proxy(address):
+            return address
+    return remote_addr
+
+
+class UploadLimitMiddleware(HybridMiddleware):
+    """
+    Middleware, ставящее обработчик загрузки с ограничением размера.
+
+    Ограничение берется из атрибута upload_limit представления или его класса (см.
+    :mod:`requestdataapp.uploads`). Обработчики загрузки можно менять только до
+    разбора тела запроса, поэтому middleware должно стоять до CsrfViewMiddleware:
+    его process_view читает request.POST.
+    """
+
+    def process_view(self, request: HttpRequest, view_func, view_args, view_kwargs):
+        """Ставит первым обработчик загрузки с ограничением представления."""
+        self.add_upload_handler(request, view_func)
+        return None
+
+    async def aprocess_view(self, request: HttpRequest, view_func, view_args, view_kwargs):
+        """Ставит обработчик загрузки в асинхронном режиме: обращений к базе и кэшу нет."""
+        self.add_upload_handler(request, view_func)
+        return None
+
+    @staticmethod
+    def add_upload_handler(request: HttpRequest, view_func) -> None:
+        """Ставит первым обработчик загрузки, если у представления есть ограничение."""
+        limit = getattr(view_func, "upload_limit", None) or getattr(
+            getattr(view_func, "view_class", None), "upload_limit", None
+        )
+        if limit is not None and request.method in ("POST", "PUT", "PATCH"):
+            request.upload_handlers.insert(0, UploadLimitHandler(request, limit))
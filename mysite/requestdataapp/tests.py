@@ -1,3 +1,318 @@
-from django.test import TestCase
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import translation
+
+from shopapp.models import Product
+from shopapp.views import ProductUpdateView
+
+from .forms import UploadFileForm
+from .metrics import Histogram, MetricsRegistry, registry
+from .middlewares import SlidingWindowRateLimiter, client_ip, parse_rate
+from .uploads import UploadLimit, UploadLimitHandler, collect_stale_uploads
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+class HistogramTestCase(TestCase):
+    def test_cumulative_buckets(self):
+        histogram = Histogram((1, 5, 10))
+        for value in (0, 1, 3, 7, 50):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.cumulative(), [("1", 2), ("5", 3), ("10", 4), ("+Inf", 5)])
+        self.assertEqual(histogram.sum, 61)
+        self.assertEqual(histogram.count, 5)
+
+    def test_render_prometheus_text(self):
+        metrics = MetricsRegistry()
+        metrics.describe("requests_total", "Requests.")
+        metrics.inc("requests_total", view='say "hi"')
+        metrics.observe("latency_seconds", 0.25, (0.1, 0.5), view="index")
+
+        text = metrics.render()
+
+        self.assertIn("# HELP requests_total Requests.\n# TYPE requests_total counter\n", text)
+        self.assertIn('requests_total{view="say \\"hi\\""} 1\n', text)
+        self.assertIn('latency_seconds_bucket{view="index",le="0.1"} 0\n', text)
+        self.assertIn('latency_seconds_bucket{view="index",le="0.5"} 1\n', text)
+        self.assertIn('latency_seconds_bucket{view="index",le="+Inf"} 1\n', text)
+        self.assertIn('latency_seconds_sum{view="index"} 0.25\n', text)
+
+
+class PerformanceMetricsMiddlewareTestCase(TestCase):
+    def setUp(self):
+        # LANGUAGE_CODE "en-us" нет в LANGUAGES, без явной активации reverse дает 404
+        translation.activate("en")
+        registry.clear()
+
+    def test_request_metrics_by_view(self):
+        Product.objects.create(name="Metrics product")
+        response = self.client.get(reverse("shopapp:products_export"))
+        self.assertEqual(response.status_code, 200)
+
+        text = registry.render()
+        view = 'view="shopapp:products_export"'
+        self.assertIn(f'django_http_requests_total{{method="GET",status="200",{view}}} 1\n', text)
+        self.assertIn(f'django_http_request_queries_bucket{{{view},le="1"}} 1\n', text)
+        self.assertIn(f'django_http_request_queries_bucket{{{view},le="0"}} 0\n', text)
+        self.assertIn(f'django_cache_requests_total{{result="miss",{view}}} 1\n', text)
+        self.assertIn(f"django_http_response_size_bytes_count{{{view}}} 1\n", text)
+        self.assertIn(f"django_http_request_db_seconds_count{{{view}}} 1\n", text)
+
+    async def test_async_request_metrics(self):
+        await Product.objects.acreate(name="Metrics product")
+        response = await self.async_client.get(reverse("shopapp:products_export"))
+        self.assertEqual(response.status_code, 200)
+
+        # Запрос асинхронного ORM выполняется в другом потоке, но учитывается в своем запросе
+        text = registry.render()
+        view = 'view="shopapp:products_export"'
+        self.assertIn(f'django_http_request_queries_bucket{{{view},le="1"}} 1\n', text)
+        self.assertIn(f'django_http_request_queries_bucket{{{view},le="0"}} 0\n', text)
+        self.assertIn(f"django_http_response_size_bytes_count{{{view}}} 1\n", text)
+
+    def test_unresolved_requests(self):
+        self.client.get("/req/missing/")
+
+        self.assertIn('status="404",view="<unresolved>"', registry.render())
+
+
+class MetricsViewTestCase(TestCase):
+    def test_metrics_for_internal_ips(self):
+        response = self.client.get(reverse("requestdataapp:metrics"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+
+    def test_metrics_forbidden_for_external_ips(self):
+        response = self.client.get(reverse("requestdataapp:metrics"), REMOTE_ADDR="203.0.113.5")
+
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(TRUSTED_PROXIES=["10.0.0.0/8"], INTERNAL_IPS=["192.0.2.10"])
+    def test_metrics_behind_proxy_check_client_address(self):
+        url = reverse("requestdataapp:metrics")
+
+        self.assertEqual(self.client.get(url, REMOTE_ADDR="10.0.0.2", HTTP_X_REAL_IP="192.0.2.10").status_code, 200)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR="10.0.0.2", HTTP_X_REAL_IP="203.0.113.5").status_code, 403)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR="203.0.113.5", HTTP_X_REAL_IP="192.0.2.10").status_code, 403)
+
+    def test_metrics_for_staff(self):
+        user = User.objects.create_user(username="metrics-staff", password="testpassword", is_staff=True)
+        self.client.force_login(user)
+
+        response = self.client.get(reverse("requestdataapp:metrics"), REMOTE_ADDR="203.0.113.5")
+
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SlidingWindowRateLimiterTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.limiter = SlidingWindowRateLimiter(cache)
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate("10/s"), (10, 1))
+        self.assertEqual(parse_rate("300/m"), (300, 60))
+        self.assertEqual(parse_rate("5/hour"), (5, 3600))
+
+    def test_limit_in_window(self):
+        for _ in range(3):
+            self.assertIsNone(self.limiter.hit("client", 3, 60, now=600))
+
+        self.assertEqual(self.limiter.hit("client", 3, 60, now=615), 45)
+        self.assertIsNone(self.limiter.hit("other", 3, 60, now=615))
+
+    def test_rejected_hits_are_not_counted(self):
+        for now in (600, 601, 602, 630, 631):
+            self.limiter.hit("client", 3, 60, now=now)
+
+        self.assertEqual(cache.get("ratelimit:client:10"), 3)
+        # Половина предыдущего окна: 1.5 запроса из 3, отказы его не раздули
+        self.assertIsNone(self.limiter.hit("client", 3, 60, now=690))
+
+    def test_previous_window_is_weighted(self):
+        for _ in range(4):
+            self.limiter.hit("client", 4, 60, now=600)
+
+        self.assertIsNotNone(self.limiter.hit("client", 4, 60, now=670))
+        # Через три четверти следующего окна из предыдущего учитывается только четверть
+        self.assertIsNone(self.limiter.hit("client", 4, 60, now=705))
+
+    async def test_async_hit_shares_counters(self):
+        self.assertIsNone(self.limiter.hit("client", 2, 60, now=600))
+        self.assertIsNone(await self.limiter.ahit("client", 2, 60, now=610))
+
+        self.assertEqual(await self.limiter.ahit("client", 2, 60, now=615), 45)
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}})
+    def test_dummy_cache_does_not_limit(self):
+        limiter = SlidingWindowRateLimiter(cache)
+
+        self.assertIsNone(limiter.hit("client", 0, 60))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, RATE_LIMITS={"myauth:hello": "2/m", "default": None})
+class RateLimitMiddlewareTestCase(TestCase):
+    def setUp(self):
+        # LANGUAGE_CODE "en-us" нет в LANGUAGES, без явной активации reverse дает 404
+        translation.activate("en")
+        cache.clear()
+
+    def test_rejects_over_limit(self):
+        url = reverse("myauth:hello")
+        for _ in range(2):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Content-Type"], "text/plain")
+        self.assertGreaterEqual(int(response["Retry-After"]), 1)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR="203.0.113.5").status_code, 200)
+
+    async def test_rejects_over_limit_in_async_mode(self):
+        url = reverse("myauth:hello")
+        for _ in range(2):
+            self.assertEqual((await self.async_client.get(url)).status_code, 200)
+
+        response = await self.async_client.get(url)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response["Retry-After"]), 1)
+
+    @override_settings(TRUSTED_PROXIES=["10.0.0.0/8"])
+    def test_clients_behind_trusted_proxy(self):
+        url = reverse("myauth:hello")
+        for _ in range(2):
+            self.client.get(url, REMOTE_ADDR="10.0.0.2", HTTP_X_REAL_IP="203.0.113.5")
+
+        self.assertEqual(self.client.get(url, REMOTE_ADDR="10.0.0.2", HTTP_X_REAL_IP="203.0.113.5").status_code, 429)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR="10.0.0.2", HTTP_X_REAL_IP="203.0.113.6").status_code, 200)
+
+    def test_views_without_limit(self):
+        url = reverse("myauth:foo-bar")
+        for _ in range(5):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+
+@override_settings(TRUSTED_PROXIES=["10.0.0.2"])
+class ClientIpTestCase(TestCase):
+    def ip(self, **meta):
+        request = RequestFactory().get("/", **meta)
+        return client_ip(request)
+
+    def test_forwarded_headers_from_trusted_proxy(self):
+        self.assertEqual(self.ip(REMOTE_ADDR="10.0.0.2", HTTP_X_REAL_IP="203.0.113.5"), "203.0.113.5")
+        self.assertEqual(
+            self.ip(REMOTE_ADDR="10.0.0.2", HTTP_X_FORWARDED_FOR="198.51.100.1, 203.0.113.5, 10.0.0.2"),
+            "203.0.113.5",
+        )
+        self.assertEqual(self.ip(REMOTE_ADDR="10.0.0.2"), "10.0.0.2")
+
+    def test_forwarded_headers_from_clients_are_ignored(self):
+        self.assertEqual(
+            self.ip(REMOTE_ADDR="203.0.113.5", HTTP_X_REAL_IP="198.51.100.1", HTTP_X_FORWARDED_FOR="198.51.100.1"),
+            "203.0.113.5",
+        )
+
+
+class UploadLimitTestCase(TestCase):
+    def setUp(self):
+        # LANGUAGE_CODE "en-us" нет в LANGUAGES, без явной активации reverse дает 404
+        translation.activate("en")
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def stored_files(self):
+        return [name for _, _, names in os.walk(self.media_root) for name in names]
+
+    def test_upload_within_limit(self):
+        content = b"x" * 1024
+        response = self.client.post(reverse("requestdataapp:file-upload"), {"file": SimpleUploadedFile("ok.txt", content)})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.stored_files(), ["ok.txt"])
+
+    def test_oversized_upload_is_aborted_while_streaming(self):
+        limit = UploadFileForm.upload_limit.max_file_size
+        received = []
+        receive = UploadLimitHandler.receive_data_chunk
+
+        def counting_receive(handler, raw_data, start):
+            received.append(len(raw_data))
+            return receive(handler, raw_data, start)
+
+        upload = SimpleUploadedFile("big.txt", b"x" * (limit * 4))
+        with mock.patch.object(UploadLimitHandler, "receive_data_chunk", counting_receive):
+            response = self.client.post(reverse("requestdataapp:file-upload"), {"file": upload})
+
+        self.assertEqual(response.status_code, 413)
+        self.assertContains(response, "The file is larger than 1.0", status_code=413)
+        # Прием остановлен на первом куске сверх ограничения
+        self.assertLessEqual(sum(received), limit + UploadLimitHandler.chunk_size)
+        self.assertEqual(self.stored_files(), [])
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0)
+    def test_default_handlers_do_not_open_files(self):
+        upload = SimpleUploadedFile("ok.txt", b"x" * 1024)
+        with mock.patch("django.core.files.uploadhandler.TemporaryUploadedFile") as temporary_file:
+            response = self.client.post(reverse("requestdataapp:file-upload"), {"file": upload})
+
+        self.assertEqual(response.status_code, 201)
+        temporary_file.assert_not_called()
+
+    async def test_oversized_upload_is_aborted_in_async_mode(self):
+        limit = UploadFileForm.upload_limit.max_file_size
+        upload = SimpleUploadedFile("big.txt", b"x" * (limit * 2))
+
+        response = await self.async_client.post(reverse("requestdataapp:file-upload"), {"file": upload})
+
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_stale_upload_files_are_collected(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir, ignore_errors=True)
+        for name in ("stale.upload.csv", "fresh.upload.csv", "other.txt"):
+            with open(os.path.join(temp_dir, name), "wb") as file:
+                file.write(b"x" * 10)
+        os.utime(os.path.join(temp_dir, "stale.upload.csv"), (0, 0))
+        os.utime(os.path.join(temp_dir, "other.txt"), (0, 0))
+
+        with override_settings(FILE_UPLOAD_TEMP_DIR=temp_dir):
+            self.assertEqual(collect_stale_uploads(), (1, 10))
+
+        self.assertEqual(sorted(os.listdir(temp_dir)), ["fresh.upload.csv", "other.txt"])
+
+    def test_request_size_limit_and_hash(self):
+        product = Product.objects.create(name="Upload limit product")
+        admin = User.objects.create_superuser(username="upload-limit-admin", password="testpassword")
+        self.client.force_login(admin)
+        url = reverse("shopapp:product_update", kwargs={"pk": product.pk})
+        data = {"name": "Upload limit product", "price": "1", "description": "", "discount": "0"}
+
+        with mock.patch.object(ProductUpdateView, "upload_limit", UploadLimit(max_file_size=100, max_request_size=1)):
+            response = self.client.post(url, {**data, "images": [SimpleUploadedFile("a.png", b"png")]})
+        self.assertEqual(response.status_code, 413)
+        self.assertContains(response, "The upload is larger than", status_code=413)
+        self.assertFalse(product.images.exists())
+
+        with mock.patch.object(ProductUpdateView, "upload_limit", UploadLimit(max_file_size=100)):
+            self.client.post(url, {**data, "images": [SimpleUploadedFile("a.png", b"png")]})
+        image = product.images.get()
+        self.assertEqual(image.sha256, hashlib.sha256(b"png").hexdigest())
+        self.assertIn(image.sha256, image.image.name)
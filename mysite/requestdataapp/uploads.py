@@ -0,0 +1,211 @@
+"""
+Ограничение размера загружаемых файлов во время приема тела запроса.
+
+Представление объявляет ограничение :class:`UploadLimit` (декоратором
+:func:`upload_limit` или атрибутом класса ``upload_limit``), а
+:class:`requestdataapp.middlewares.UploadLimitMiddleware` до разбора тела запроса
+ставит первым обработчиком загрузки :class:`UploadLimitHandler`. Обработчик считает
+байты по мере их поступления и прерывает прием, как только файл или запрос
+превысили ограничение: остаток тела не читается и на диск не пишется. Ошибки
+прерванных загрузок попадают в ``request.upload_errors``, а
+:func:`add_upload_errors` и :class:`UploadLimitMixin` показывают их в форме.
+
+Файл пишется во временный каталог FILE_UPLOAD_TEMP_DIR, и SHA-256 считается по ходу
+приема. Хранилище :class:`mysite.storage.ContentAddressedStorage` берет готовый хэш и
+переносит файл на место переименованием, без повторного чтения и копирования.
+Временные файлы, оставшиеся после аварийного завершения процесса, удаляет
+:func:`collect_stale_uploads`.
+
+Прием прерывается на лету только под WSGI. Обработчик ASGI в Django читает тело
+запроса целиком до middleware, и ограничение срабатывает уже после приема (см.
+mysite/asgi.py), поэтому при ASGI размер тела должен ограничивать nginx.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Callable
+
+from django import forms
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import StopFutureHandlers, StopUpload, TemporaryFileUploadHandler
+from django.http import HttpRequest, HttpResponse
+from django.template.defaultfilters import filesizeformat
+from django.utils.translation import gettext as _
+
+log = logging.getLogger(__name__)
+
+# Суффикс временных файлов загрузки, по нему их находит collect_stale_uploads
+UPLOAD_SUFFIX = ".upload"
+# Временный файл, который не менялся дольше этого срока, уже никто не принимает
+STALE_UPLOAD_AGE = timedelta(hours=1)
+
+
+@dataclass(frozen=True)
+class UploadLimit:
+    """Ограничения загрузки: размер одного файла и всего тела запроса в байтах."""
+
+    max_file_size: int
+    max_request_size: int | None = None
+
+
+def upload_limit(limit: UploadLimit) -> Callable:
+    """Декоратор представления-функции, задающий ограничение загрузки limit."""
+
+    def decorator(view: Callable) -> Callable:
+        view.upload_limit = limit
+        return view
+
+    return decorator
+
+
+def upload_temp_dir() -> str | None:
+    """Каталог временных файлов загрузки, None - системный каталог временных файлов."""
+    directory = settings.FILE_UPLOAD_TEMP_DIR
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def collect_stale_uploads(age: timedelta = STALE_UPLOAD_AGE, dry_run: bool = False) -> tuple[int, int]:
+    """
+    Удаляет временные файлы загрузок, не менявшиеся дольше age.
+
+    Обычно временный файл удаляется при закрытии, а остается, только если процесс
+    завершился посреди запроса. Возвращает число файлов и их размер в байтах.
+    """
+    directory = upload_temp_dir()
+    if directory is None:
+        return 0, 0
+    deleted = freed = 0
+    horizon = time.time() - age.total_seconds()
+    for entry in os.scandir(directory):
+        if not entry.is_file() or UPLOAD_SUFFIX not in entry.name:
+            continue
+        try:
+            stat = entry.stat()
+            if stat.st_mtime > horizon:
+                continue
+            if not dry_run:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            continue
+        deleted += 1
+        freed += stat.st_size
+    return deleted, freed
+
+
+class HashedUploadedFile(TemporaryUploadedFile):
+    """TemporaryUploadedFile в каталоге directory с SHA-256 содержимого в атрибуте sha256."""
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None, directory=None):
+        """Создает временный файл в каталоге directory."""
+        _, ext = os.path.splitext(name)
+        file = tempfile.NamedTemporaryFile(suffix=UPLOAD_SUFFIX + ext, dir=directory)
+        UploadedFile.__init__(self, file, name, content_type, size, charset, content_type_extra)
+        self.sha256 = None
+
+
+class UploadLimitHandler(TemporaryFileUploadHandler):
+    """Обработчик загрузки, прерывающий прием файла сверх ограничения и считающий его хэш."""
+
+    def __init__(self, request: HttpRequest, limit: UploadLimit):
+        """Инициализирует обработчик с ограничением limit."""
+        super().__init__(request)
+        self.limit = limit
+        self.received = 0
+        self.request_too_large = False
+        request.upload_errors = {}
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        """Запоминает, что тело запроса больше ограничения: файлы из него не принимаются."""
+        max_request_size = self.limit.max_request_size
+        self.request_too_large = max_request_size is not None and content_length > max_request_size
+
+    def new_file(self, *args, **kwargs):
+        """
+        Начинает прием файла во временный файл на диске хранилища.
+
+        Следующие обработчики (по умолчанию из FILE_UPLOAD_HANDLERS) для файла не
+        вызываются, иначе TemporaryFileUploadHandler открыл бы второй, пустой файл.
+        """
+        super(TemporaryFileUploadHandler, self).new_file(*args, **kwargs)
+        if self.request_too_large:
+            self.abort(_("The upload is larger than %(limit)s.") % {"limit": filesizeformat(self.limit.max_request_size)})
+        self.digest = hashlib.sha256()
+        self.file_size = 0
+        self.file = HashedUploadedFile(
+            self.file_name, self.content_type, 0, self.charset, self.content_type_extra, directory=upload_temp_dir()
+        )
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data: bytes, start: int) -> None:
+        """Пишет кусок файла, если файл и запрос укладываются в ограничения."""
+        self.file_size += len(raw_data)
+        self.received += len(raw_data)
+        if self.file_size > self.limit.max_file_size:
+            self.abort(_("The file is larger than %(limit)s.") % {"limit": filesizeformat(self.limit.max_file_size)})
+        if self.limit.max_request_size is not None and self.received > self.limit.max_request_size:
+            self.abort(_("The upload is larger than %(limit)s.") % {"limit": filesizeformat(self.limit.max_request_size)})
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size: int) -> HashedUploadedFile:
+        """Возвращает принятый файл с его хэшем."""
+        self.file.sha256 = self.digest.hexdigest()
+        return super().file_complete(file_size)
+
+    def abort(self, message: str) -> None:
+        """Запоминает ошибку поля и прерывает прием тела запроса без дочитывания."""
+        self.request.upload_errors[self.field_name] = message
+        log.warning("Upload of %r to %s aborted: %s", self.file_name, self.request.path, message)
+        raise StopUpload(connection_reset=True)
+
+
+def add_upload_errors(form: forms.BaseForm, request: HttpRequest) -> bool:
+    """
+    Добавляет в связанную форму form ошибки прерванных загрузок запроса.
+
+    Возвращает True, если загрузка была прервана.
+    """
+    errors = getattr(request, "upload_errors", None)
+    if not errors or not form.is_bound:
+        return False
+    # add_error работает только после проверки формы
+    form.full_clean()
+    for field, message in errors.items():
+        if field in form.fields:
+            # Ошибка "обязательное поле" для отброшенного файла ничего не объясняет
+            form.errors.pop(field, None)
+            form.add_error(field, message)
+        else:
+            form.add_error(None, message)
+    return True
+
+
+class UploadLimitMixin:
+    """
+    Миксин представления с формой: ограничение загрузки upload_limit и ошибки в форме.
+
+    Форма с прерванной загрузкой отображается с ответом 413 Content Too Large.
+    """
+
+    upload_limit: UploadLimit | None = None
+
+    def get_form(self, form_class=None) -> forms.BaseForm:
+        """Создает форму и добавляет в нее ошибки прерванных загрузок."""
+        form = super().get_form(form_class)
+        add_upload_errors(form, self.request)
+        return form
+
+    def form_invalid(self, form: forms.BaseForm) -> HttpResponse:
+        """Отображает форму с ошибками, для прерванной загрузки - со статусом 413."""
+        response = super().form_invalid(form)
+        if getattr(self.request, "upload_errors", None):
+            response.status_code = 413
+        return response
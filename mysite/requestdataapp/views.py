@@ -1,10 +1,19 @@
 """Модуль для обработки представлений приложения requestdataapp."""
 
+import logging
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
 from django.core.files.storage import FileSystemStorage
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import render
 
 from .forms import UserBioForm, UploadFileForm
+from .metrics import registry, render_cache_stats
+from .middlewares import client_ip
+from .uploads import add_upload_errors, upload_limit
+
+log = logging.getLogger(__name__)
 
 
 def process_get_view(request: HttpRequest) -> HttpResponse:
@@ -24,25 +33,25 @@ def user_form(request: HttpRequest) -> HttpResponse:
     return render(request, "requestdataapp/user-bio-form.html", context=context)
 
 
+@upload_limit(UploadFileForm.upload_limit)
 def handle_file_upload(request: HttpRequest) -> HttpResponse:
-    """Обрабатывает загрузку файлов через POST-запрос."""
+    """
+    Обрабатывает загрузку файлов через POST-запрос.
+
+    Размер файла ограничивает UploadLimitHandler еще во время приема: файл больше
+    ограничения не дочитывается и не сохраняется.
+    """
     if request.method == "POST":
         form = UploadFileForm(request.POST, request.FILES)
         http_status = 201
-        if form.is_valid():
+        if add_upload_errors(form, request):
+            http_status = 413
+        elif form.is_valid():
             # myfile = request.FILES["myfile"]
             myfile = form.cleaned_data["file"]
-            max_size: int = 1 * 1024 * 1024
-            if myfile.size > max_size:
-                return render(
-                    request,
-                    "requestdataapp/file-upload.html",
-                    {"error": "File size exceeds the limit of 1 MB"},
-                )
-
             fs = FileSystemStorage()
             filename = fs.save(myfile.name, myfile)
-            print(f"Saved file: {filename}")
+            log.info("Saved uploaded file %s", filename)
     else:
         form = UploadFileForm()
         http_status = 200
@@ -52,3 +61,19 @@ def handle_file_upload(request: HttpRequest) -> HttpResponse:
     }
 
     return render(request, "requestdataapp/file-upload.html", context=context, status=http_status)
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """
+    Отдает метрики производительности в текстовом формате Prometheus.
+
+    Доступно персоналу и адресам из INTERNAL_IPS, с которых метрики собирает Prometheus.
+    Адрес клиента за nginx определяется так же, как для ограничения частоты запросов
+    (см. :func:`requestdataapp.middlewares.client_ip`).
+    """
+    if not (request.user.is_staff or client_ip(request) in settings.INTERNAL_IPS):
+        raise PermissionDenied
+    return HttpResponse(
+        registry.render() + render_cache_stats(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
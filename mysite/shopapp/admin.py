@@ -4,13 +4,44 @@ from django.contrib import admin, messages
 from django.db.models import QuerySet
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import render, redirect
-from django.urls import path
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
 
+from requestdataapp.uploads import add_upload_errors, upload_limit
+
+from .cache import ORDERS, PRODUCTS, invalidate
+from .changes import record_tombstones
 from .common import save_csv, save_json
-from .models import Product, Order, ProductImage
-from .admin_mixins import ExportAsCSVMixin
-from .forms import CSVJSONImportForm
+from .jobs import enqueue
+from .models import Job, Product, Order, ProductImage, Tombstone
+from .totals import recompute_totals
+from .admin_mixins import ExportAsCSVMixin, ImportReportMixin
+from .forms import CSVJSONImportForm, ProductImportForm
+
+
+class OrderTotalsMixin:
+    """
+    Пересчитывает итоги заказов (см. shopapp.totals) после сохранения inline связей заказов и товаров.
+
+    Inline сохраняет и удаляет строки промежуточной таблицы как обычные модели, без m2m_changed.
+    """
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        order_ids = set()
+        for formset in formsets:
+            if formset.model is not Order.products.through:
+                continue
+            for inline_form in formset.forms:
+                if inline_form.has_changed() or inline_form in formset.deleted_forms:
+                    # Связь могла перейти к другому заказу: пересчитываются оба
+                    order_ids.update((inline_form.initial.get("order"), inline_form.instance.order_id))
+        order_ids.discard(None)
+        if order_ids:
+            recompute_totals(Order.objects.filter(pk__in=order_ids), updated_at=timezone.now())
+            invalidate(ORDERS)
 
 
 class OrderInline(admin.TabularInline):
@@ -31,17 +62,27 @@ class ProductImageInline(admin.StackedInline):
 @admin.action(description="Archived products")
 def mark_archived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
     """Помечает выбранные продукты как архивированные."""
-    queryset.update(archived=True)
+    archived_ids = list(queryset.filter(archived=False).values_list("pk", flat=True))
+    queryset.filter(pk__in=archived_ids).update(archived=True, updated_at=timezone.now())
+    # update() не отправляет post_save
+    invalidate(PRODUCTS)
+    record_tombstones(Tombstone.Kind.PRODUCT, Tombstone.Reason.ARCHIVED, archived_ids)
 
 
 @admin.action(description="Unarchived products")
 def mark_unarchived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
     """Снимает пометку архивирования с выбранных продуктов."""
-    queryset.update(archived=False)
+    restored_ids = list(queryset.filter(archived=True).values_list("pk", flat=True))
+    queryset.filter(pk__in=restored_ids).update(archived=False, updated_at=timezone.now())
+    # update() не отправляет post_save
+    invalidate(PRODUCTS)
+    Tombstone.objects.filter(
+        kind=Tombstone.Kind.PRODUCT, object_id__in=restored_ids, reason=Tombstone.Reason.ARCHIVED
+    ).delete()
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
+class ProductAdmin(OrderTotalsMixin, admin.ModelAdmin, ExportAsCSVMixin, ImportReportMixin):
     """Административный интерфейс для управления продуктами."""
 
     change_list_template = "shopapp/shopapp_changelist.html"
@@ -50,6 +91,7 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
         mark_archived,
         mark_unarchived,
         "export_csv",
+        "export_csv_background",
     ]
     inlines = [OrderInline, ProductImageInline]
     # list_display = "pk", "name", "description", "price", "discount"
@@ -63,12 +105,12 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
     )
     list_display_links = "pk", "name"
     ordering = "name", "pk"
-    search_fields = "name", "description"
+    search_fields = "name", "sku", "description"
     fieldsets = [
         (
             None,
             {
-                "fields": ("name", "description"),
+                "fields": ("name", "sku", "description"),
             },
         ),
         (
@@ -106,27 +148,45 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
 
     description_short.short_description = _("Description")
 
+    @upload_limit(ProductImportForm.upload_limit)
     def import_csv(self, request: HttpRequest) -> HttpResponse:
         if request.method == "GET":
-            form = CSVJSONImportForm()
+            form = ProductImportForm()
             context = {
                 "form": form,
                 "file_csv": True,
             }
             return render(request, "admin/csv_form.html", context)
-        form = CSVJSONImportForm(request.POST, request.FILES)
+        form = ProductImportForm(request.POST, request.FILES)
+        aborted = add_upload_errors(form, request)
         if not form.is_valid():
             context = {
                 "form": form,
             }
-            return render(request, "admin/csv_form.html", context, status=400)
+            return render(request, "admin/csv_form.html", context, status=413 if aborted else 400)
+
+        if form.cleaned_data["background"]:
+            job = enqueue(
+                Job.Kind.IMPORT_PRODUCTS,
+                user=request.user,
+                params={
+                    "encoding": request.encoding,
+                    "atomic": form.cleaned_data["atomic"],
+                    "mode": form.cleaned_data["mode"],
+                },
+                input_file=form.files["upload_file"],
+            )
+            self.message_job(request, job)
+            return redirect("..")
 
-        save_csv(
+        report = save_csv(
             obj=Product,
-            file=form.files["csv_file"].file,
+            file=form.files["upload_file"].file,
             encoding=request.encoding,
+            atomic=form.cleaned_data["atomic"],
+            mode=form.cleaned_data["mode"],
         )
-        self.message_user(request, _("Data from %s was imported.") % "CSV")
+        self.message_report(request, report, "CSV")
         return redirect("..")
 
     def get_urls(self):
@@ -134,7 +194,7 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
         new_urls = [
             path(
                 "import-products-csv/",
-                self.import_csv,
+                self.admin_site.admin_view(self.import_csv),
                 name="import_products_csv",
             ),
         ]
@@ -159,7 +219,7 @@ class ProductInline(admin.StackedInline):
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(OrderTotalsMixin, admin.ModelAdmin, ImportReportMixin):
     """Административный интерфейс для управления заказами."""
 
     change_list_template = "shopapp/shopapp_changelist.html"
@@ -172,12 +232,16 @@ class OrderAdmin(admin.ModelAdmin):
         "promocode",
         "created_at",
         "user",
+        "items_count",
+        "total",
+        "discounted_total",
     )
 
     def get_queryset(self, request):
         """Возвращает queryset для отображения в административном интерфейсе."""
         return Order.objects.select_related("user").prefetch_related("products")
 
+    @upload_limit(CSVJSONImportForm.upload_limit)
     def import_csv(self, request: HttpRequest) -> HttpResponse:
         if request.method == "GET":
             form = CSVJSONImportForm()
@@ -191,51 +255,61 @@ class OrderAdmin(admin.ModelAdmin):
             return render(request, "admin/csv_form.html", context)
 
         form = CSVJSONImportForm(request.POST, request.FILES)
+        aborted = add_upload_errors(form, request)
         if not form.is_valid():
             context = {
                 "form": form,
             }
-            return render(request, "admin/csv_form.html", context, status=400)
+            return render(request, "admin/csv_form.html", context, status=413 if aborted else 400)
 
         uploaded_file = form.files["upload_file"]
-        message_base = _("Data from %s was imported.")
-        redirect_dir = ".."
-        level = messages.SUCCESS
+
+        if uploaded_file.name.endswith((".csv", ".json")) and form.cleaned_data["background"]:
+            job = enqueue(
+                Job.Kind.IMPORT_ORDERS,
+                user=request.user,
+                params={"encoding": request.encoding, "atomic": form.cleaned_data["atomic"]},
+                input_file=uploaded_file,
+            )
+            self.message_job(request, job)
+            return redirect("..")
 
         if uploaded_file.name.endswith(".csv"):
-            save_csv(
+            report = save_csv(
                 obj=Order,
                 file=uploaded_file.file,
                 encoding=request.encoding,
                 key="products",
+                atomic=form.cleaned_data["atomic"],
             )
-            message_base %= "CSV"
+            file_format = "CSV"
         elif uploaded_file.name.endswith(".json"):
-            save_json(
+            report = save_json(
                 obj=Order,
                 file=uploaded_file.file,
                 encoding=request.encoding,
                 key="products",
+                atomic=form.cleaned_data["atomic"],
             )
-            message_base %= "JSON"
+            file_format = "JSON"
         else:
-            message_base = _("The file must have the extension CSV or JSON")
-            level = messages.ERROR
-            redirect_dir = "."
-        self.message_user(request, message_base, level=level)
-        return redirect(redirect_dir)
+            self.message_user(request, _("The file must have the extension CSV or JSON"), level=messages.ERROR)
+            return redirect(".")
+
+        self.message_report(request, report, file_format)
+        return redirect("..")
 
     def get_urls(self):
         urls = super().get_urls()
         new_urls = [
             path(
                 "import-orders-csv/",
-                self.import_csv,
+                self.admin_site.admin_view(self.import_csv),
                 name="import_orders_csv",
             ),
             path(
                 "import-orders-json/",
-                self.import_csv,
+                self.admin_site.admin_view(self.import_csv),
                 name="import_orders_json",
             ),
         ]
@@ -246,3 +320,60 @@ class OrderAdmin(admin.ModelAdmin):
         extra_context["url_import_csv"] = "admin:import_orders_csv"
         extra_context["url_import_json"] = "admin:import_orders_json"
         return super().changelist_view(request=request, extra_context=extra_context)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """Административный интерфейс для просмотра фоновых задач."""
+
+    list_display = (
+        "pk",
+        "kind",
+        "status",
+        "progress",
+        "created_by",
+        "created_at",
+        "finished_at",
+    )
+    list_filter = "kind", "status"
+    # У закрытых файлов задач нет URL, вместо полей FileField выводятся имя и ссылка
+    exclude = ("input_file", "result_file")
+    readonly_fields = (
+        "kind",
+        "status",
+        "params",
+        "input_file_name",
+        "result_link",
+        "progress",
+        "report",
+        "error",
+        "created_by",
+        "created_at",
+        "started_at",
+        "heartbeat_at",
+        "finished_at",
+    )
+
+    def get_queryset(self, request):
+        """Возвращает queryset для отображения в административном интерфейсе."""
+        return Job.objects.select_related("created_by")
+
+    def has_add_permission(self, request):
+        """Задачи создаются только импортом и экспортом."""
+        return False
+
+    def input_file_name(self, obj: Job) -> str | None:
+        """Имя входного файла задачи."""
+        return obj.input_file.name or None
+
+    input_file_name.short_description = _("input file")
+
+    def result_link(self, obj: Job) -> str | None:
+        """Ссылка на скачивание результата задачи через JobDownloadView."""
+        if not obj.result_file:
+            return None
+        return format_html(
+            '<a href="{}">{}</a>', reverse("shopapp:job_download", kwargs={"pk": obj.pk}), obj.result_file.name
+        )
+
+    result_link.short_description = _("result file")
@@ -2,12 +2,32 @@
 
 import csv
 
+from django.contrib import messages
 from django.db.models import QuerySet
 from django.db.models.options import Options
 from django.http import HttpRequest, HttpResponse
+from django.utils.html import format_html
+from django.utils.translation import gettext_lazy as _
 
+from .common import ImportReport
+from .jobs import enqueue, export_params
+from .models import Job
 
-class ExportAsCSVMixin:
+
+class JobMessageMixin:
+    """Миксин для сообщения о поставленной в очередь фоновой задаче."""
+
+    def message_job(self, request: HttpRequest, job: Job) -> None:
+        """Показывает ссылку, по которой можно следить за задачей."""
+        message = format_html(
+            _('{} was queued. Follow its progress <a href="{}">here</a>.'),
+            job,
+            job.get_absolute_url(),
+        )
+        self.message_user(request, message, level=messages.INFO)
+
+
+class ExportAsCSVMixin(JobMessageMixin):
     """Миксин для экспорта данных в формате CSV."""
 
     def export_csv(self, request: HttpRequest, queryset: QuerySet):
@@ -26,3 +46,52 @@ class ExportAsCSVMixin:
         return response
 
     export_csv.short_description = 'Export to CSV'
+
+    def export_csv_background(self, request: HttpRequest, queryset: QuerySet):
+        """Ставит экспорт выбранных объектов в CSV в очередь фоновых задач."""
+        select_across = request.POST.get("select_across") == "1"
+        job = enqueue(
+            Job.Kind.EXPORT_CSV,
+            user=request.user,
+            params=export_params(queryset, select_across, request.GET),
+        )
+        self.message_job(request, job)
+
+    export_csv_background.short_description = 'Export to CSV in background'
+
+
+class ImportReportMixin(JobMessageMixin):
+    """Миксин для вывода итогов импорта сообщениями админки."""
+
+    import_errors_shown = 10
+
+    def message_report(self, request: HttpRequest, report: ImportReport, file_format: str) -> None:
+        """Показывает итог импорта и первые отклоненные записи."""
+        if report.rolled_back:
+            message = _("Data from %(format)s was not imported: %(errors)d of %(processed)d records are invalid.")
+        elif report.updated or report.unchanged:
+            # Импорт с обновлением по ключу (ProductUpsertImporter)
+            message = _(
+                "Data from %(format)s was imported: of %(processed)d records %(created)d created, "
+                "%(updated)d updated, %(unchanged)d unchanged."
+            )
+        else:
+            message = _("Data from %(format)s was imported: %(created)d of %(processed)d records created.")
+        message %= {
+            "format": file_format,
+            "created": report.created,
+            "updated": report.updated,
+            "unchanged": report.unchanged,
+            "processed": report.processed,
+            "errors": len(report.errors),
+        }
+        level = messages.SUCCESS
+        if report.errors:
+            level = messages.ERROR if report.rolled_back else messages.WARNING
+        self.message_user(request, message, level=level)
+
+        for row, error in report.errors[: self.import_errors_shown]:
+            self.message_user(request, _("Record %(row)d: %(error)s") % {"row": row, "error": error}, messages.ERROR)
+        if len(report.errors) > self.import_errors_shown:
+            hidden = len(report.errors) - self.import_errors_shown
+            self.message_user(request, _("%d more records were rejected.") % hidden, messages.ERROR)
@@ -1,8 +1,11 @@
 """Конфигурация приложения магазина для управления настройками и метаданными."""
 
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 from django.utils.translation import gettext_lazy as _
 
+from mysite.fts import restore_search_index
+
 
 class ShopappConfig(AppConfig):
     """Конфигурация приложения для магазина."""
@@ -10,3 +13,12 @@ class ShopappConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "shopapp"
     verbose_name = _("shopapp")
+    # Индекс, триггеры которого восстанавливаются после миграций
+    search_index = "shopapp.search.SEARCH_INDEX"
+
+    def ready(self):
+        """Подключает сигналы приложения."""
+        from . import signals  # noqa: F401
+
+        post_migrate.connect(restore_search_index, sender=self)
+
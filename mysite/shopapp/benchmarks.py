@@ -0,0 +1,372 @@
+"""
+Бенчмарк и бюджеты SQL-запросов для представлений сайта.
+
+Модуль заполняет базу синтетическими данными (faker), вызывает каждый маршрут
+приложений shopapp, blogapp и myauth тестовым клиентом и замеряет число SQL-запросов,
+p50/p95 времени ответа и пиковый объем выделенной памяти. Маршрут, превысивший свой
+бюджет запросов, считается провалившим проверку.
+
+Используется командой ``manage.py bench_views`` и тестами shopapp.
+"""
+
+import random
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from decimal import Decimal
+from importlib import import_module
+from math import ceil
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Iterator
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, reverse
+from django.utils import timezone, translation
+
+from faker import Faker
+
+from mysite.cache import local_caches
+
+from blogapp.models import Article, Author, Category, Tag, make_excerpt
+from myauth.models import Profile
+
+from .changes import encode_cursor
+from .common import chunked
+from .models import Job, Order, Product, ProductImage
+from .reports import rollup_days
+from .totals import recompute_totals
+
+BENCHMARK_APPS = ("shopapp", "blogapp", "myauth")
+
+
+@dataclass
+class Dataset:
+    """Объекты синтетического набора данных, на которые ссылаются маршруты."""
+
+    admin: User
+    customer: User
+    product: Product
+    order: Order
+    article: Article
+    job: Job
+    sizes: dict[str, int] = field(default_factory=dict)
+
+
+@dataclass
+class Route:
+    """
+    Маршрут бенчмарка и его бюджет SQL-запросов.
+
+    kwargs и data получают набор данных и возвращают аргументы reverse() и тело запроса.
+    user - атрибут Dataset с пользователем, от имени которого выполняется запрос.
+    """
+
+    name: str
+    max_queries: int
+    kwargs: Callable[[Dataset], dict] | None = None
+    method: str = "get"
+    data: Callable[[Dataset], dict] | None = None
+    user: str | None = "admin"
+
+    def url(self, dataset: Dataset) -> str:
+        """Возвращает URL маршрута для набора данных."""
+        return reverse(self.name, kwargs=self.kwargs(dataset) if self.kwargs else None)
+
+
+def upload_csv_data(dataset: Dataset) -> dict:
+    """Небольшой CSV-файл для маршрута импорта товаров."""
+    content = b"name,description,price,discount\nBench product,Imported,10.00,0\n"
+    return {"file": SimpleUploadedFile("products.csv", content, content_type="text/csv")}
+
+
+product_pk = lambda dataset: {"pk": dataset.product.pk}  # noqa: E731
+order_pk = lambda dataset: {"pk": dataset.order.pk}  # noqa: E731
+customer_pk = lambda dataset: {"pk": dataset.customer.pk}  # noqa: E731
+customer_id = lambda dataset: {"user_id": dataset.customer.pk}  # noqa: E731
+# Лента изменений за последний час, как при регулярной синхронизации
+recent_changes = lambda dataset: {"since": encode_cursor(timezone.now() - timezone.timedelta(hours=1))}  # noqa: E731
+
+# Бюджеты рассчитаны на то, что число запросов не зависит от объема данных: списки
+# выбираются с prefetch_related/select_related, а не по запросу на объект. Для маршрутов
+# с авторизацией в бюджет входят загрузка сессии и пользователя.
+ROUTES: list[Route] = [
+    # shopapp
+    Route("shopapp:shop_index", 2),
+    Route("shopapp:api-root", 2),
+    Route("shopapp:product-list", 4),
+    Route("shopapp:product-detail", 3, kwargs=product_pk),
+    Route("shopapp:product-downloads-csv", 3),
+    Route("shopapp:product-upload-csv", 8, method="post", data=upload_csv_data),
+    Route("shopapp:order-list", 5),
+    Route("shopapp:order-detail", 4, kwargs=order_pk),
+    Route(
+        "shopapp:sales-list",
+        3,
+        data=lambda dataset: {"dimension": "product", "key": dataset.product.pk, "day__gte": timezone.localdate()},
+    ),
+    Route("shopapp:group_list", 4),
+    Route("shopapp:product_list", 4),
+    Route("shopapp:products_export", 1),
+    Route("shopapp:products_changes", 4, data=recent_changes),
+    Route("shopapp:product_create", 2),
+    Route("shopapp:product_details", 7, kwargs=product_pk),
+    Route("shopapp:product_update", 3, kwargs=product_pk),
+    Route("shopapp:product_delete", 3, kwargs=product_pk),
+    Route("shopapp:product_feed", 1, user=None),
+    Route("shopapp:orders_list", 4),
+    Route("shopapp:orders_export", 4),
+    Route("shopapp:orders_changes", 5, data=recent_changes),
+    Route("shopapp:order_create", 4),
+    Route("shopapp:order_details", 4, kwargs=order_pk),
+    Route("shopapp:order_update", 6, kwargs=order_pk),
+    Route("shopapp:order_delete", 3, kwargs=order_pk),
+    Route("shopapp:user_orders_list", 5, kwargs=customer_id),
+    Route("shopapp:user_orders_export", 3, kwargs=customer_id),
+    Route("shopapp:user_orders_changes", 6, kwargs=customer_id, data=recent_changes),
+    Route("shopapp:job_details", 3, kwargs=lambda dataset: {"pk": dataset.job.pk}),
+    Route("shopapp:job_download", 3, kwargs=lambda dataset: {"pk": dataset.job.pk}),
+    # blogapp
+    Route("blogapp:article", 2, user=None),
+    Route(
+        "blogapp:article_search",
+        4,
+        data=lambda dataset: {"q": dataset.article.title.split()[0]},
+        user=None,
+    ),
+    Route("blogapp:article_details", 1, kwargs=lambda dataset: {"pk": dataset.article.pk}, user=None),
+    Route("blogapp:articles-feed", 1, user=None),
+    # myauth
+    Route("myauth:login", 0, user=None),
+    Route("myauth:hello", 0, user=None),
+    Route("myauth:logout", 4, method="post"),
+    Route("myauth:about-me", 3, kwargs=customer_pk),
+    Route("myauth:profile-update", 5, kwargs=customer_pk),
+    Route("myauth:user-list", 3),
+    Route("myauth:user-detail", 4, kwargs=customer_pk),
+    Route("myauth:register", 0, user=None),
+    Route("myauth:get_cookie", 0, user=None),
+    Route("myauth:set_cookie", 2),
+    Route("myauth:set_session", 5),
+    Route("myauth:get_session", 2),
+    Route("myauth:foo-bar", 0, user=None),
+]
+
+
+def route_names(patterns: list, namespace: str) -> set[str]:
+    """Возвращает имена всех именованных маршрутов из списка patterns."""
+    names = set()
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            names |= route_names(pattern.url_patterns, namespace)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            names.add(f"{namespace}:{pattern.name}")
+    return names
+
+
+def uncovered_routes(routes: list[Route] = ROUTES) -> set[str]:
+    """Возвращает маршруты приложений BENCHMARK_APPS, для которых не объявлен бюджет."""
+    names = set()
+    for app in BENCHMARK_APPS:
+        names |= route_names(import_module(f"{app}.urls").urlpatterns, app)
+    return names - {route.name for route in routes}
+
+
+def seed_dataset(products: int = 1000, orders: int = 500, articles: int = 200, seed: int = 0) -> Dataset:
+    """Заполняет базу синтетическими товарами, заказами и статьями."""
+    fake = Faker("ru_RU")
+    fake.seed_instance(seed)
+    rnd = random.Random(seed)
+
+    admin = User.objects.create_superuser("bench-admin", "admin@example.com", "bench-password")
+    customer = User.objects.create_user("bench-customer", "customer@example.com", "bench-password")
+    Profile.objects.bulk_create([Profile(user=admin), Profile(user=customer)])
+
+    Product.objects.bulk_create(
+        Product(
+            name=fake.catch_phrase()[:100],
+            description=fake.text(max_nb_chars=200),
+            price=Decimal(rnd.randint(100, 100000)) / 100,
+            discount=rnd.choice((0, 0, 5, 10, 25)),
+            created_by=admin,
+        )
+        for _ in range(products)
+    )
+    product_ids = list(Product.objects.filter(created_by=admin).values_list("pk", flat=True))
+
+    new_orders = Order.objects.bulk_create(
+        Order(
+            user=customer,
+            delivery_address=fake.address(),
+            promocode=rnd.choice(("", "", "SALE10")),
+        )
+        for _ in range(orders)
+    )
+    if connection.features.can_return_rows_from_bulk_insert:
+        order_ids = [order.pk for order in new_orders]
+    else:
+        order_ids = list(Order.objects.filter(user=customer).values_list("pk", flat=True))
+    Through = Order.products.through
+    for batch in chunked(order_ids, 500):
+        Through.objects.bulk_create(
+            Through(order_id=order_id, product_id=product_id)
+            for order_id in batch
+            for product_id in rnd.sample(product_ids, k=min(len(product_ids), rnd.randint(1, 5)))
+        )
+        recompute_totals(Order.objects.filter(pk__in=batch))
+    # Заказы набора созданы сегодня: сворачивается текущий день, чтобы у отчетов были данные
+    today = timezone.localdate()
+    rollup_days(today, today + timezone.timedelta(days=1))
+
+    authors = Author.objects.bulk_create(Author(name=fake.name(), bio=fake.text()) for _ in range(10))
+    categories = Category.objects.bulk_create(Category(name=fake.word()[:40]) for _ in range(5))
+    tags = Tag.objects.bulk_create(Tag(name=fake.word()[:20]) for _ in range(20))
+    now = timezone.now()
+    contents = [fake.text(max_nb_chars=2000) for _ in range(articles)]
+    new_articles = Article.objects.bulk_create(
+        Article(
+            title=fake.sentence()[:200],
+            content=content,
+            excerpt=make_excerpt(content),
+            pub_date=now - timezone.timedelta(hours=i),
+            author=rnd.choice(authors),
+            category=rnd.choice(categories),
+        )
+        for i, content in enumerate(contents)
+    )
+    ArticleTags = Article.tags.through
+    ArticleTags.objects.bulk_create(
+        ArticleTags(article_id=article.pk, tag_id=tag.pk)
+        for article in new_articles
+        for tag in rnd.sample(tags, k=3)
+    )
+
+    # Копии изображений выбираются через GenericRelation. На работающем сервере кэш
+    # ContentType заполнен после первого запроса, его запрос не входит в бюджеты
+    ContentType.objects.get_for_models(Product, ProductImage)
+
+    job = Job(kind=Job.Kind.EXPORT_CSV, status=Job.Status.DONE, created_by=admin, report={"exported": 0})
+    job.result_file.save("bench-export.csv", ContentFile(b"id,name\n"), save=False)
+    job.save()
+
+    return Dataset(
+        admin=admin,
+        customer=customer,
+        product=Product.objects.get(pk=product_ids[0]),
+        order=Order.objects.get(pk=order_ids[0]),
+        article=new_articles[0],
+        job=job,
+        sizes={"products": products, "orders": orders, "articles": articles},
+    )
+
+
+def percentile(values: list[float], percent: int) -> float:
+    """Возвращает перцентиль percent списка values методом ближайшего ранга."""
+    ordered = sorted(values)
+    return ordered[max(ceil(len(ordered) * percent / 100) - 1, 0)]
+
+
+def request_route(route: Route, dataset: Dataset) -> tuple[Any, float, int]:
+    """Выполняет запрос маршрута и возвращает ответ, время в секундах и число SQL-запросов."""
+    client = Client()
+    if route.user:
+        client.force_login(getattr(dataset, route.user))
+    for alias in settings.CACHES:
+        caches[alias].clear()
+    url = route.url(dataset)
+    data = route.data(dataset) if route.data else None
+
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        response = getattr(client, route.method)(url, data)
+        # Потоковые ответы формируются при чтении, поэтому читаем тело внутри замера
+        response.getvalue()
+        elapsed = time.perf_counter() - start
+    return response, elapsed, len(queries)
+
+
+def measure_route(route: Route, dataset: Dataset, repeat: int) -> dict:
+    """Замеряет маршрут repeat раз и возвращает результат для отчета."""
+    # Память замеряется отдельным прогоном: tracemalloc сильно замедляет выполнение
+    tracemalloc.start()
+    response, _, queries = request_route(route, dataset)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(repeat):
+        _, elapsed, run_queries = request_route(route, dataset)
+        timings.append(elapsed)
+        queries = max(queries, run_queries)
+
+    return {
+        "route": route.name,
+        "method": route.method.upper(),
+        "url": route.url(dataset),
+        "status": response.status_code,
+        "queries": queries,
+        "max_queries": route.max_queries,
+        "over_budget": queries > route.max_queries,
+        "p50_ms": round(percentile(timings, 50) * 1000, 3),
+        "p95_ms": round(percentile(timings, 95) * 1000, 3),
+        "peak_memory_kb": round(peak_memory / 1024, 1),
+    }
+
+
+@contextmanager
+def benchmark_environment() -> Iterator[None]:
+    """
+    Окружение бенчмарка: отдельные кэши в памяти процесса и временные MEDIA_ROOT и
+    PRIVATE_MEDIA_ROOT.
+
+    Перед каждым запросом кэши очищаются, чтобы замерить запрос без кэша, поэтому
+    общий L2 работающего сайта не используется. Файлы, созданные представлениями,
+    удаляются после выхода. База данных не изолируется: команда bench_views запускает
+    бенчмарк во временной базе, тесты - в тестовой.
+    """
+    local_caches_override = override_settings(CACHES=local_caches(settings.CACHES, "benchmark"))
+    # Маршруты объявлены через i18n_patterns, а LANGUAGE_CODE может отсутствовать в LANGUAGES
+    language = translation.override(settings.LANGUAGES[0][0])
+    with TemporaryDirectory() as media_root, TemporaryDirectory() as private_media_root:
+        with override_settings(MEDIA_ROOT=media_root, PRIVATE_MEDIA_ROOT=private_media_root), local_caches_override:
+            with language:
+                yield
+
+
+def run_benchmarks(
+    routes: list[Route] = ROUTES,
+    repeat: int = 10,
+    products: int = 1000,
+    orders: int = 500,
+    articles: int = 200,
+    seed: int = 0,
+) -> dict:
+    """Заполняет базу, замеряет маршруты routes и возвращает отчет."""
+    with benchmark_environment():
+        # Данные записываются одной короткой транзакцией, а запросы идут как на сервере,
+        # без транзакции вокруг всего прогона
+        with transaction.atomic():
+            dataset = seed_dataset(products=products, orders=orders, articles=articles, seed=seed)
+        results = [measure_route(route, dataset, repeat) for route in routes]
+
+    return {
+        "created_at": timezone.now().isoformat(),
+        "database": connection.vendor,
+        "repeat": repeat,
+        "dataset": dataset.sizes,
+        "uncovered_routes": sorted(uncovered_routes(routes)),
+        "results": results,
+    }
+
+
+def over_budget(report: dict) -> list[dict]:
+    """Возвращает результаты маршрутов, превысивших бюджет запросов."""
+    return [result for result in report["results"] if result["over_budget"]]
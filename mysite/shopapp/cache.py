@@ -0,0 +1,122 @@
+"""
+Версионированный кэш данных shopapp.
+
+Ключ кэша включает версии пространств имен (products, orders, articles), от которых
+зависят данные. Сигналы моделей (см. :mod:`shopapp.signals` и :mod:`blogapp.signals`)
+увеличивают версию при любом изменении, и старые записи просто перестают читаться, поэтому данные можно хранить
+долго и не бояться отдать устаревшие.
+
+:func:`get_or_compute` защищает от лавины пересчетов: после смены версии значение
+пересчитывает только один запрос, остальные получают предыдущее значение или ждут.
+"""
+
+import time
+from functools import partial
+from typing import Any, Callable
+
+from django.core.cache import cache
+from django.db import transaction
+
+from requestdataapp.metrics import record_cache_access
+
+PRODUCTS = "products"
+ORDERS = "orders"
+ARTICLES = "articles"
+
+DEFAULT_TIMEOUT = 24 * 60 * 60
+LOCK_TIMEOUT = 30
+WAIT_TIMEOUT = 5.0
+WAIT_INTERVAL = 0.05
+
+
+def version_key(namespace: str) -> str:
+    """Возвращает ключ кэша, в котором хранится версия пространства имен."""
+    return f"shopapp:version:{namespace}"
+
+
+def get_versions(*namespaces: str) -> list[int]:
+    """
+    Возвращает текущие версии пространств имен.
+
+    Версия, которой еще нет в кэше (или которую кэш вытеснил), начинается с текущего
+    времени в наносекундах, чтобы не совпасть ни с одной из прежних.
+    """
+    keys = [version_key(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key, 0)
+    return [versions[key] for key in keys]
+
+
+def bump_version(namespace: str) -> None:
+    """Увеличивает версию пространства имен, делая его записи в кэше устаревшими."""
+    try:
+        cache.incr(version_key(namespace))
+    except ValueError:
+        cache.set(version_key(namespace), time.time_ns(), timeout=None)
+
+
+def invalidate(*namespaces: str) -> None:
+    """
+    Делает устаревшими записи пространств имен сразу и еще раз после фиксации транзакции.
+
+    Параллельный запрос, прочитавший данные до фиксации, успеет закэшировать их под
+    промежуточной версией, поэтому внутри транзакции версия увеличивается повторно
+    в on_commit.
+    """
+    for namespace in namespaces:
+        bump_version(namespace)
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(partial(bump_version, namespace))
+
+
+def versioned_key(name: str, namespaces: tuple[str, ...], *parts: Any) -> str:
+    """Возвращает ключ данных name, зависящих от namespaces, с учетом их версий."""
+    versions = ".".join(map(str, get_versions(*namespaces)))
+    return ":".join(("shopapp", name, *map(str, parts), versions))
+
+
+def get_or_compute(
+    name: str,
+    namespaces: tuple[str, ...],
+    compute: Callable[[], Any],
+    *parts: Any,
+    timeout: int = DEFAULT_TIMEOUT,
+) -> Any:
+    """
+    Возвращает данные name из кэша, вычисляя их через compute при промахе.
+
+    Пересчет выполняет только запрос, захвативший блокировку ключа. Остальные получают
+    последнее вычисленное значение любой версии, а если его нет, ждут до WAIT_TIMEOUT
+    секунд и в крайнем случае вычисляют данные сами, не сохраняя их.
+    """
+    key = versioned_key(name, namespaces, *parts)
+    stale_key = ":".join(("shopapp", name, *map(str, parts), "stale"))
+
+    value = cache.get(key)
+    record_cache_access(value is not None)
+    if value is not None:
+        return value
+
+    lock_key = f"{key}:lock"
+    if cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+        try:
+            value = compute()
+            cache.set_many({key: value, stale_key: value}, timeout=timeout)
+        finally:
+            cache.delete(lock_key)
+        return value
+
+    value = cache.get(stale_key)
+    if value is not None:
+        return value
+
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value
+    return compute()
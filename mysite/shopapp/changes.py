@@ -0,0 +1,203 @@
+"""
+Ленты изменений товаров и заказов для инкрементальной синхронизации.
+
+Клиент передает курсор ``since`` из предыдущего ответа и получает только записи,
+измененные после него (по индексу ``(updated_at, id)``), и надгробия удаленных или
+архивированных записей (:class:`shopapp.models.Tombstone`). Стоимость выгрузки растет
+с числом изменений, а не с размером таблицы.
+
+Курсор - момент времени, до которого включительно выгрузка полная. Он отстает от
+текущего времени на SETTLE_TIME: изменение, которое транзакция записала с меткой
+времени до курсора, но зафиксировала позже, иначе было бы пропущено. Этого запаса
+хватает только коротким транзакциям, поэтому долгие (импорт с atomic=True) после
+фиксации переносят свои метки на момент фиксации (restamp_on_commit). Надгробия
+хранятся TOMBSTONE_RETENTION, курсор старше этого срока отклоняется, и клиенту
+нужна полная выгрузка.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import partial
+from typing import Any, Iterator
+
+from django.db import transaction
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from .models import Order, Product, Tombstone
+
+SETTLE_TIME = timedelta(seconds=5)
+TOMBSTONE_RETENTION = timedelta(days=30)
+# Сколько записей выбирается за один шаг ленты: id пачки передаются в IN (...)
+CHANGES_CHUNK_SIZE = 500
+
+PRODUCT_FIELDS = ("id", "name", "sku", "price", "discount", "archived", "updated_at")
+ORDER_FIELDS = ("id", "delivery_address", "promocode", "user_id", "created_at", "updated_at")
+
+
+class CursorError(ValueError):
+    """Курсор ленты испорчен."""
+
+
+class CursorExpired(CursorError):
+    """Курсор старше срока хранения надгробий, нужна полная выгрузка."""
+
+
+def encode_cursor(moment: datetime) -> str:
+    """Кодирует момент времени в курсор: число микросекунд от начала эпохи."""
+    delta = moment - datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+    return str(delta // timedelta(microseconds=1))
+
+
+def decode_cursor(cursor: str | None) -> datetime | None:
+    """
+    Разбирает курсор из запроса, None означает полную выгрузку.
+
+    Выбрасывает CursorError, если курсор испорчен, и CursorExpired, если он старше срока
+    хранения надгробий.
+    """
+    if not cursor:
+        return None
+    try:
+        moment = datetime(1970, 1, 1, tzinfo=dt_timezone.utc) + timedelta(microseconds=int(cursor))
+    except (ValueError, OverflowError):
+        raise CursorError("Invalid cursor")
+    if moment < timezone.now() - TOMBSTONE_RETENTION:
+        raise CursorExpired("Cursor is too old, a full export is required")
+    return moment
+
+
+def feed_window(since: datetime | None) -> tuple[datetime | None, datetime]:
+    """Возвращает границы выгрузки (since, until] и проверяет их порядок."""
+    until = timezone.now() - SETTLE_TIME
+    if since is not None and since > until:
+        # Повторный запрос раньше SETTLE_TIME: новых завершенных изменений еще нет
+        until = since
+    return since, until
+
+
+def iter_changed(
+    queryset: QuerySet,
+    since: datetime | None,
+    until: datetime,
+    fields: tuple[str, ...],
+    chunk_size: int = CHANGES_CHUNK_SIZE,
+) -> Iterator[list[dict[str, Any]]]:
+    """
+    Лениво выбирает записи queryset, измененные в (since, until], пачками по chunk_size.
+
+    Пачки идут в порядке (updated_at, id) по условию "после последней записи пачки",
+    поэтому каждый шаг - один запрос по индексу без OFFSET.
+    """
+    queryset = queryset.filter(updated_at__lte=until).order_by("updated_at", "pk").values(*fields)
+    if since is not None:
+        queryset = queryset.filter(updated_at__gt=since)
+    position = Q()
+    while chunk := list(queryset.filter(position)[:chunk_size]):
+        yield chunk
+        if len(chunk) < chunk_size:
+            break
+        last = chunk[-1]
+        position = Q(updated_at__gt=last["updated_at"]) | Q(updated_at=last["updated_at"], pk__gt=last["id"])
+
+
+def iter_tombstones(
+    kind: str,
+    since: datetime | None,
+    until: datetime,
+    chunk_size: int = CHANGES_CHUNK_SIZE,
+    **filters: Any,
+) -> Iterator[list[dict[str, Any]]]:
+    """Лениво выбирает надгробия kind, созданные в (since, until], пачками по chunk_size."""
+    if since is None:
+        # Полная выгрузка и так не содержит удаленных записей
+        return
+    tombstones = (
+        Tombstone.objects.filter(kind=kind, created_at__gt=since, created_at__lte=until, **filters)
+        .order_by("pk")
+        .values("id", "object_id", "reason", "created_at")
+    )
+    last_pk = 0
+    while chunk := list(tombstones.filter(pk__gt=last_pk)[:chunk_size]):
+        last_pk = chunk[-1]["id"]
+        yield [
+            {"op": "delete", "id": tombstone["object_id"], "reason": tombstone["reason"], "at": tombstone["created_at"]}
+            for tombstone in chunk
+        ]
+        if len(chunk) < chunk_size:
+            break
+
+
+def as_upserts(chunks: Iterator[list[dict[str, Any]]]) -> Iterator[list[dict[str, Any]]]:
+    """Помечает измененные записи операцией upsert."""
+    for chunk in chunks:
+        yield [{"op": "upsert", **row} for row in chunk]
+
+
+def with_order_products(chunks: Iterator[list[dict[str, Any]]]) -> Iterator[list[dict[str, Any]]]:
+    """Добавляет к пачкам заказов id их товаров одним запросом к промежуточной таблице на пачку."""
+    Through = Order.products.through
+    for chunk in chunks:
+        products = defaultdict(list)
+        links = (
+            Through.objects.filter(order_id__in=[order["id"] for order in chunk])
+            .order_by("order_id", "product_id")
+            .values_list("order_id", "product_id")
+        )
+        for order_id, product_id in links:
+            products[order_id].append(product_id)
+        for order in chunk:
+            order["products"] = products[order["id"]]
+        yield chunk
+
+
+def product_changes(since: datetime | None, until: datetime) -> Iterator[list[dict[str, Any]]]:
+    """Пачки изменений товаров: измененные записи, затем надгробия."""
+    yield from as_upserts(iter_changed(Product.objects.all(), since, until, PRODUCT_FIELDS))
+    yield from iter_tombstones(Tombstone.Kind.PRODUCT, since, until)
+
+
+def order_changes(since: datetime | None, until: datetime, user_id: int | None = None) -> Iterator[list[dict[str, Any]]]:
+    """Пачки изменений заказов всех пользователей или пользователя user_id."""
+    orders = Order.objects.all()
+    tombstone_filters = {}
+    if user_id is not None:
+        orders = orders.filter(user_id=user_id)
+        tombstone_filters["owner_id"] = user_id
+    yield from as_upserts(with_order_products(iter_changed(orders, since, until, ORDER_FIELDS)))
+    yield from iter_tombstones(Tombstone.Kind.ORDER, since, until, **tombstone_filters)
+
+
+def record_tombstones(kind: str, reason: str, object_ids: list[int], owner_id: int | None = None) -> None:
+    """Создает надгробия для записей object_ids одним запросом."""
+    Tombstone.objects.bulk_create(
+        Tombstone(kind=kind, object_id=object_id, owner_id=owner_id, reason=reason) for object_id in object_ids
+    )
+
+
+def restamp_changes(since: datetime) -> None:
+    """Переносит метки изменений товаров, заказов и надгробий начиная с since на текущий момент."""
+    now = timezone.now()
+    with transaction.atomic():
+        for model in (Product, Order):
+            model.objects.filter(updated_at__gte=since).update(updated_at=now)
+        Tombstone.objects.filter(kind__in=Tombstone.Kind.values, created_at__gte=since).update(created_at=now)
+
+
+def restamp_on_commit(since: datetime) -> None:
+    """
+    Переносит метки изменений текущей транзакции на момент ее фиксации.
+
+    Метки записей, измененных в транзакции, старше ее фиксации на время самой
+    транзакции, и клиент мог получить курсор позже них, пока записи были еще не видны.
+    Вместе с ними переносятся метки чужих изменений после since, такие записи ленты
+    просто отдадут повторно.
+    """
+    transaction.on_commit(partial(restamp_changes, since))
+
+
+def prune_tombstones(now: datetime | None = None) -> int:
+    """Удаляет надгробия старше TOMBSTONE_RETENTION и возвращает их число."""
+    horizon = (now or timezone.now()) - TOMBSTONE_RETENTION
+    deleted, _ = Tombstone.objects.filter(created_at__lt=horizon).delete()
+    return deleted
@@ -1,57 +1,491 @@
 import json
-from csv import DictReader
-from io import TextIOWrapper
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from contextlib import nullcontext
+from csv import DictReader, writer as csv_writer
+from dataclasses import dataclass, field
+from io import StringIO, TextIOWrapper
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, Sequence
 
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import DatabaseError, connection, models, transaction
+from django.db.models import QuerySet
+from django.utils import timezone
 
-from .models import Product, Order
+from .cache import ORDERS, PRODUCTS, invalidate
+from .changes import record_tombstones, restamp_on_commit
+from .models import Product, Order, Tombstone
+from .totals import orders_with_products, recompute_totals
 
+# Сколько строк забирается из базы и пишется в CSV за один шаг потоковой выгрузки
+EXPORT_CHUNK_SIZE = 2000
+# Сколько записей импорт держит в памяти и сохраняет одним bulk_create
+IMPORT_CHUNK_SIZE = 500
 
-def filter_dict(row, key):
-    if key is None:
-        return row
 
-    dict_orders = {}
+def chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    """Разбивает итерируемый объект на списки длиной не более size."""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
 
-    for k, v in row.items():
-        if k == "user":
-            dict_orders[k] = User.objects.get(username=v)
-        elif k != key:
-            dict_orders[k] = v
 
-    return dict_orders
+def stream_csv(rows: Iterable[Sequence], header: Sequence[str], chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Лениво превращает строки в CSV.
 
+    Каждый шаг отдает готовый кусок CSV из chunk_size строк, поэтому в памяти никогда
+    не лежит больше одного куска, сколько бы строк ни было в выгрузке.
+    """
+    buffer = StringIO()
+    writer = csv_writer(buffer)
+    writer.writerow(header)
+    for chunk in chunked(rows, chunk_size):
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        # Заголовок для пустой выгрузки
+        yield buffer.getvalue()
 
-def save_csv(obj, file, encoding, key=None):
+
+def iter_order_chunks(chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[list[dict[str, Any]]]:
+    """
+    Лениво выбирает заказы для выгрузки пачками по chunk_size в порядке pk.
+
+    Пачка выбирается по условию pk > последнего pk предыдущей пачки, а id товаров всех
+    заказов пачки - одним запросом к промежуточной таблице, поэтому на пачку приходится
+    два запроса, а в памяти лежит только одна пачка.
+    """
+    Through = Order.products.through
+    orders = Order.objects.order_by("pk").values("id", "delivery_address", "promocode", "user_id")
+    last_pk = 0
+    while chunk := list(orders.filter(pk__gt=last_pk)[:chunk_size]):
+        last_pk = chunk[-1]["id"]
+        products = defaultdict(list)
+        links = (
+            Through.objects.filter(order_id__gte=chunk[0]["id"], order_id__lte=last_pk)
+            .order_by("order_id", "product_id")
+            .values_list("order_id", "product_id")
+        )
+        for order_id, product_id in links:
+            products[order_id].append(product_id)
+        for order in chunk:
+            order["products"] = products[order["id"]]
+        yield chunk
+        if len(chunk) < chunk_size:
+            # Неполная пачка - последняя, лишний запрос за пустой пачкой не нужен
+            break
+
+
+def stream_json(chunks: Iterable[list], key: str, header: dict[str, Any] | None = None) -> Iterator[str]:
+    """
+    Лениво превращает пачки объектов в документ JSON вида {**header, key: [...]}.
+
+    Каждый шаг отдает одну пачку, как :func:`stream_csv`.
+    """
+    encoder = DjangoJSONEncoder()
+    fields = "".join(f"{json.dumps(name)}: {encoder.encode(value)}, " for name, value in (header or {}).items())
+    yield "{%s%s: [" % (fields, json.dumps(key))
+    separator = ""
+    for chunk in chunks:
+        if chunk:
+            yield separator + ", ".join(map(encoder.encode, chunk))
+            separator = ", "
+    yield "]}"
+
+
+def stream_ndjson(chunks: Iterable[list]) -> Iterator[str]:
+    """Лениво превращает пачки объектов в NDJSON: по объекту JSON на строку."""
+    encoder = DjangoJSONEncoder()
+    for chunk in chunks:
+        yield "".join(encoder.encode(item) + "\n" for item in chunk)
+
+
+@dataclass
+class ImportReport:
+    """Итог импорта: сколько записей обработано, создано и какие записи отклонены."""
+
+    processed: int = 0
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    rolled_back: bool = False
+    errors: list[tuple[int, str]] = field(default_factory=list)
+
+    def add_error(self, row_number: int, message: str) -> None:
+        """Запоминает ошибку для записи с номером row_number (нумерация с 1)."""
+        self.errors.append((row_number, message))
+
+    def as_dict(self) -> dict[str, Any]:
+        """Возвращает отчет в виде, пригодном для JSON."""
+        return {
+            "processed": self.processed,
+            "created": self.created,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "rolled_back": self.rolled_back,
+            "errors": [{"row": row, "message": message} for row, message in self.errors],
+        }
+
+
+def lookup_values(queryset: QuerySet, key_field: str, values: Iterable[str]) -> Iterator[tuple]:
+    """
+    Достает пары (key_field, pk) для всех values.
+
+    Обычно это один запрос. Если значений больше, чем база принимает параметров в одном
+    запросе, они делятся на пачки, как это делает QuerySet.in_bulk.
+    """
+    values = {value for value in values if value}
+    batch_size = connection.features.max_query_params or len(values) or 1
+    for batch in chunked(values, batch_size):
+        yield from queryset.filter(**{f"{key_field}__in": batch}).values_list(key_field, "pk")
+
+
+def split_names(value: str | list[str] | None) -> list[str]:
+    """Разбирает список товаров: строку через запятую из CSV или список из JSON."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [name.strip() for name in value if name.strip()]
+
+
+def convert_row(model: type[models.Model], row: dict[str, Any], exclude: Sequence[str] = ()) -> dict[str, Any]:
+    """
+    Превращает строковые значения записи в типизированные значения полей модели.
+
+    Пустые значения полей со значением по умолчанию пропускаются. Внешние ключи
+    приводятся к типу первичного ключа без запроса к базе. При неизвестной колонке или
+    неверном значении выбрасывается ValidationError.
+    """
+    values = {}
+    for name, raw in row.items():
+        if name in exclude:
+            continue
+        if name is None:
+            raise ValidationError("The record has more values than columns")
+        try:
+            model_field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise ValidationError(f"Unknown column {name!r}")
+        if model_field.primary_key or not model_field.concrete or model_field.many_to_many:
+            raise ValidationError(f"Column {name!r} cannot be imported")
+        if raw in ("", None) and model_field.has_default():
+            continue
+        try:
+            if model_field.is_relation:
+                values[model_field.attname] = model_field.target_field.to_python(raw) if raw not in ("", None) else None
+            else:
+                values[name] = model_field.clean(raw, None)
+        except ValidationError as exc:
+            raise ValidationError(f"{name}: {'; '.join(exc.messages)}")
+    return values
+
+
+class ChunkedImporter(ABC):
+    """
+    Потоковый импорт записей пачками.
+
+    Записи читаются из итератора по chunk_size штук, проверяются и сохраняются одним
+    bulk_create на пачку, поэтому в памяти одновременно лежит не больше одной пачки.
+    При atomic=True импорт выполняется по принципу "все или ничего": любая ошибка
+    откатывает все пачки, а оставшиеся записи только проверяются. При atomic=False каждая
+    пачка фиксируется в своей транзакции, а ошибочные записи пропускаются.
+    """
+
+    # Пространства имен shopapp.cache, которые устаревают после сохранения пачки
+    cache_namespaces: tuple[str, ...] = ()
+
+    def __init__(
+        self,
+        chunk_size: int = IMPORT_CHUNK_SIZE,
+        atomic: bool = True,
+        progress: Callable[[ImportReport], None] | None = None,
+    ):
+        """Настраивает размер пачки, режим транзакций и обработчик прогресса."""
+        self.chunk_size = chunk_size
+        self.atomic = atomic
+        self.progress = progress
+        self.report = ImportReport()
+
+    @abstractmethod
+    def prepare(self, chunk: list[tuple[int, dict[str, Any]]]) -> list:
+        """Проверяет пачку записей и возвращает объекты для сохранения."""
+
+    @abstractmethod
+    def save(self, prepared: list) -> int:
+        """Сохраняет подготовленные объекты и возвращает количество созданных записей."""
+
+    def run(self, rows: Iterable[dict[str, Any]]) -> ImportReport:
+        """Импортирует записи и возвращает отчет."""
+        started = timezone.now()
+        with transaction.atomic() if self.atomic else nullcontext():
+            if self.atomic:
+                # Транзакция импорта может идти минутами, дольше запаса лент изменений
+                restamp_on_commit(started)
+            for chunk in chunked(enumerate(rows, start=1), self.chunk_size):
+                prepared = self.prepare(chunk)
+                self.report.processed += len(chunk)
+                # В режиме "все или ничего" после первой ошибки записи только проверяются
+                if prepared and not (self.atomic and self.report.errors):
+                    self.save_chunk(chunk, prepared)
+                if self.progress is not None:
+                    self.progress(self.report)
+
+            if self.atomic and self.report.errors:
+                transaction.set_rollback(True)
+                self.report.created = self.report.updated = self.report.unchanged = 0
+                self.report.rolled_back = True
+
+        return self.report
+
+    def save_chunk(self, chunk: list[tuple[int, dict[str, Any]]], prepared: list) -> None:
+        """Сохраняет пачку в отдельной транзакции (точке сохранения в режиме atomic)."""
+        first, last = chunk[0][0], chunk[-1][0]
+        try:
+            with transaction.atomic():
+                self.report.created += self.save(prepared)
+                # bulk_create не отправляет сигналы моделей
+                invalidate(*self.cache_namespaces)
+        except DatabaseError as exc:
+            self.report.add_error(first, f"Records {first}-{last} were not saved: {exc}")
+
+
+class ProductImporter(ChunkedImporter):
+    """Импорт товаров."""
+
+    cache_namespaces = (PRODUCTS,)
+
+    def prepare(self, chunk):
+        """Превращает записи в несохраненные объекты Product."""
+        products = []
+        for number, row in chunk:
+            try:
+                products.append(Product(**convert_row(Product, row)))
+            except ValidationError as exc:
+                self.report.add_error(number, "; ".join(exc.messages))
+        return products
+
+    def save(self, prepared):
+        """Создает товары одним bulk_create."""
+        return len(Product.objects.bulk_create(prepared, batch_size=self.chunk_size))
+
+
+class ProductUpsertImporter(ProductImporter):
+    """
+    Импорт товаров с обновлением существующих по естественному ключу.
+
+    На каждую пачку выполняется один запрос за текущими значениями товаров с теми же
+    ключами и один INSERT ... ON CONFLICT DO UPDATE для новых и измененных товаров.
+    Товары, у которых ни одно импортируемое поле не изменилось, не записываются.
+    """
+
+    key_field = "sku"
+
+    def prepare(self, chunk):
+        """Превращает записи в товары и оставляет последнюю запись для каждого ключа."""
+        products: dict[str, tuple[Product, Iterable[str]]] = {}
+        for number, row in chunk:
+            try:
+                values = convert_row(Product, row)
+            except ValidationError as exc:
+                self.report.add_error(number, "; ".join(exc.messages))
+                continue
+            key = values.get(self.key_field)
+            if not key:
+                self.report.add_error(number, f"Column {self.key_field!r} is required for upsert")
+                continue
+            # Повтор ключа в одной пачке недопустим для INSERT ... ON CONFLICT,
+            # поэтому более поздняя запись заменяет предыдущую
+            products[key] = (Product(**values), values.keys())
+        return list(products.values())
+
+    def save(self, prepared):
+        """Создает новые и обновляет измененные товары, возвращает количество новых."""
+        keys = [getattr(product, self.key_field) for product, _ in prepared]
+        columns = {name for _, fields in prepared for name in fields}
+        existing = {
+            values[self.key_field]: values
+            for values in Product.objects.filter(**{f"{self.key_field}__in": keys}).values(
+                self.key_field, "pk", *columns
+            )
+        }
+
+        inserted = updated = unchanged = 0
+        archived_ids, restored_ids, repriced_ids = [], [], []
+        groups: dict[frozenset, list[Product]] = defaultdict(list)
+        for product, fields in prepared:
+            current = existing.get(getattr(product, self.key_field))
+            if current is None:
+                inserted += 1
+            elif all(current[name] == getattr(product, name) for name in fields):
+                unchanged += 1
+                continue
+            else:
+                updated += 1
+                if "archived" in fields and current["archived"] != product.archived:
+                    (archived_ids if product.archived else restored_ids).append(current["pk"])
+                if any(name in fields and current[name] != getattr(product, name) for name in ("price", "discount")):
+                    repriced_ids.append(current["pk"])
+            groups[frozenset(fields)].append(product)
+
+        # Записи с разным набором колонок обновляют только свои колонки
+        for fields, products in groups.items():
+            Product.objects.bulk_create(
+                products,
+                batch_size=self.chunk_size,
+                update_conflicts=True,
+                unique_fields=[self.key_field],
+                # bulk_create заполняет updated_at (auto_now), но при конфликте обновляет
+                # только перечисленные поля
+                update_fields=sorted(fields - {self.key_field} | {"updated_at"}),
+            )
+
+        # bulk_create не отправляет сигналы, надгробия ведутся здесь, как в shopapp.signals
+        record_tombstones(Tombstone.Kind.PRODUCT, Tombstone.Reason.ARCHIVED, archived_ids)
+        Tombstone.objects.filter(
+            kind=Tombstone.Kind.PRODUCT, object_id__in=restored_ids, reason=Tombstone.Reason.ARCHIVED
+        ).delete()
+        if repriced_ids:
+            # Новые цены меняют итоги заказов с этими товарами
+            recompute_totals(orders_with_products(repriced_ids))
+            invalidate(ORDERS)
+
+        self.report.updated += updated
+        self.report.unchanged += unchanged
+        return inserted
+
+
+class OrderImporter(ChunkedImporter):
+    """
+    Импорт заказов.
+
+    Пользователи и товары каждой пачки ищутся одним запросом на каждую сущность, а
+    найденные значения запоминаются, так что повторяющиеся имена не запрашиваются снова.
+    Заказы и строки Order.products.through создаются через bulk_create.
+    """
+
+    cache_namespaces = (ORDERS,)
+
+    def __init__(self, key: str = "products", **options):
+        """Запоминает колонку со списком товаров и готовит словари поиска."""
+        super().__init__(**options)
+        self.key = key
+        self.user_ids: dict[str, int | None] = {}
+        self.product_ids: dict[str, list[int]] = {}
+
+    def resolve(self, rows: list[tuple[int, dict[str, Any], list[str]]]) -> None:
+        """Дополняет словари поиска пользователями и товарами, которых в них еще нет."""
+        usernames = {row.get("user") for _, row, _ in rows} - self.user_ids.keys()
+        self.user_ids.update(dict.fromkeys(usernames))
+        self.user_ids.update(lookup_values(User.objects, "username", usernames))
+
+        names = {name for _, _, row_names in rows for name in row_names} - self.product_ids.keys()
+        found: dict[str, list[int]] = defaultdict(list)
+        for name, pk in lookup_values(Product.objects, "name", names):
+            found[name].append(pk)
+        self.product_ids.update({name: found[name] for name in names})
+
+    def prepare(self, chunk):
+        """Превращает записи в пары (заказ, первичные ключи товаров)."""
+        rows = [(number, row, split_names(row.get(self.key))) for number, row in chunk]
+        self.resolve(rows)
+
+        prepared: list[tuple[Order, list[int]]] = []
+        for number, row, row_names in rows:
+            user_id = self.user_ids.get(row.get("user"))
+            if user_id is None:
+                self.report.add_error(number, f"Unknown user {row.get('user')!r}")
+                continue
+            unknown = [name for name in row_names if not self.product_ids[name]]
+            if unknown:
+                self.report.add_error(number, f"Unknown products: {', '.join(unknown)}")
+                continue
+            try:
+                order = Order(user_id=user_id, **convert_row(Order, row, exclude=("user", self.key)))
+            except ValidationError as exc:
+                self.report.add_error(number, "; ".join(exc.messages))
+                continue
+            pks = {pk for name in row_names for pk in self.product_ids[name]}
+            prepared.append((order, sorted(pks)))
+        return prepared
+
+    def save(self, prepared):
+        """Создает заказы и их связи с товарами двумя bulk_create."""
+        through = Order.products.through
+        orders = Order.objects.bulk_create([order for order, _ in prepared], batch_size=self.chunk_size)
+        through.objects.bulk_create(
+            [
+                through(order_id=order.pk, product_id=product_id)
+                for order, (_, pks) in zip(orders, prepared)
+                for product_id in pks
+            ],
+            batch_size=self.chunk_size,
+        )
+        # bulk_create не отправляет m2m_changed, итоги новых заказов считаются здесь
+        recompute_totals(Order.objects.filter(pk__in=[order.pk for order in orders]))
+        return len(orders)
+
+
+PRODUCT_IMPORT_MODES = {
+    "insert": ProductImporter,
+    "upsert": ProductUpsertImporter,
+}
+
+
+def import_products(rows: Iterable[dict[str, Any]], mode: str = "insert", **options) -> ImportReport:
+    """
+    Импортирует товары, параметры options описаны в ChunkedImporter.
+
+    В режиме insert все записи создают новые товары, в режиме upsert товары с уже
+    известным SKU обновляются.
+    """
+    try:
+        importer_class = PRODUCT_IMPORT_MODES[mode]
+    except KeyError:
+        raise ValueError(f"Unknown import mode {mode!r}")
+    return importer_class(**options).run(rows)
+
+
+def import_orders(rows: Iterable[dict[str, Any]], key: str = "products", **options) -> ImportReport:
+    """Импортирует заказы, параметры options описаны в ChunkedImporter."""
+    return OrderImporter(key=key, **options).run(rows)
+
+
+def save_csv(obj, file, encoding, key=None, **options) -> ImportReport:
+    """
+    Импортирует товары или заказы из CSV.
+
+    Файл читается лениво, по строке, так что размер файла не влияет на память.
+    """
     csv_file = TextIOWrapper(
         file,
         encoding=encoding,
     )
     reader = DictReader(csv_file)
-    rows = list(reader)
-
-    objects_list: list[Product | Order] = [obj(**filter_dict(row, key)) for row in rows]
-    obj.objects.bulk_create(objects_list)
 
-    if isinstance(obj, type(Order)):
-        for idx, row in enumerate(rows):
-            if row[key]:
-                product = Product.objects.filter(name__in=[prod.strip() for prod in row[key].split(",")])
-                objects_list[idx].products.add(*product)
+    if obj is Order:
+        return import_orders(reader, key=key, **options)
+    return import_products(reader, **options)
 
-    return objects_list
 
+def save_json(obj: Product | Order, file, encoding, key=None, **options) -> ImportReport:
+    """
+    Импортирует товары или заказы из JSON.
 
-def save_json(obj: Product | Order, file, encoding, key=None) -> None:
+    JSON разбирается целиком, дальше записи сохраняются теми же пачками, что и для CSV.
+    """
     json_file = TextIOWrapper(
         file,
         encoding=encoding,
     )
     data_json: dict[str, dict[str, str | list[str]]] = json.load(json_file)
-    for data in data_json.values():
-        filtered_dict = filter_dict(data, key)
-        created_object = obj.objects.create(**filtered_dict)
 
-        if isinstance(obj, type(Order)):
-            products_list = [Product.objects.get(name=name) for name in data[key]]
-            created_object.products.add(*products_list)
+    if obj is Order:
+        return import_orders(data_json.values(), key=key, **options)
+    return import_products(data_json.values(), **options)
@@ -0,0 +1,69 @@
+"""
+Условные GET-запросы (ETag) для представлений только для чтения.
+
+ETag строится из версий пространств имен :mod:`shopapp.cache`, поэтому вычисляется
+одним чтением кэша, без запросов к базе и без рендеринга. Если клиент прислал тот же
+ETag в If-None-Match, представление сразу отвечает 304 Not Modified без тела.
+Проверка выполняется после проверок доступа: миксины авторизации должны стоять левее
+в списке базовых классов.
+"""
+
+import hashlib
+from typing import Any, Callable
+
+from django.http import HttpRequest, HttpResponse
+from django.utils import translation
+from django.views.decorators.http import condition
+
+from .cache import get_versions
+
+
+def make_etag(*parts: Any) -> str:
+    """Возвращает ETag по частям, от которых зависит ответ."""
+    return hashlib.md5(":".join(map(str, parts)).encode(), usedforsecurity=False).hexdigest()
+
+
+class ConditionalGetMixin:
+    """
+    Отвечает 304 Not Modified, если данные представления не изменились.
+
+    etag_namespaces - пространства имен кэша, от которых зависит ответ. Для HTML-страниц
+    etag_vary_on_user добавляет в ETag пользователя: в шапке страницы выводится его имя
+    и форма входа или выхода.
+    """
+
+    etag_namespaces: tuple[str, ...] = ()
+    etag_vary_on_user: bool = False
+
+    def get_etag_parts(self, request: HttpRequest, *args, **kwargs) -> list[Any]:
+        """Возвращает части ETag: имя представления, аргументы и параметры URL, версии данных и язык."""
+        parts = [type(self).__name__, *args, *sorted(kwargs.items()), request.GET.urlencode()]
+        parts.extend(get_versions(*self.etag_namespaces))
+        parts.append(translation.get_language())
+        if self.etag_vary_on_user:
+            parts.append(request.user.pk)
+        return parts
+
+    def get_etag(self, request: HttpRequest, *args, **kwargs) -> str:
+        """Вычисляет ETag ответа без обращения к базе данных."""
+        return make_etag(*self.get_etag_parts(request, *args, **kwargs))
+
+    def conditional_response(self, handler: Callable, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        """Вызывает handler, если ETag клиента устарел, иначе отвечает 304."""
+        return condition(etag_func=self.get_etag)(handler)(request, *args, **kwargs)
+
+    def dispatch(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        """Обрабатывает запрос с проверкой If-None-Match."""
+        return self.conditional_response(super().dispatch, request, *args, **kwargs)
+
+
+class ConditionalFeedMixin(ConditionalGetMixin):
+    """ConditionalGetMixin для RSS-лент: у Feed нет dispatch, запрос обрабатывает __call__."""
+
+    def get_etag_parts(self, request: HttpRequest, *args, **kwargs) -> list[Any]:
+        """Добавляет к частям ETag домен: ссылки в ленте абсолютные."""
+        return [*super().get_etag_parts(request, *args, **kwargs), request.get_host()]
+
+    def __call__(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        """Отдает ленту с проверкой If-None-Match."""
+        return self.conditional_response(super().__call__, request, *args, **kwargs)
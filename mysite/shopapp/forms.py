@@ -6,6 +6,8 @@ from django.contrib.auth.models import Group
 from django.core import validators
 from django.utils.translation import gettext_lazy as _, pgettext_lazy
 
+from requestdataapp.uploads import UploadLimit
+
 from .models import Product, Order
 
 
@@ -123,6 +125,33 @@ class ProductForm(forms.ModelForm):
     # )
     images = MultipleFileField(required=False, label=_("Images"))
 
+    # Ограничение проверяется при приеме тела запроса, см. requestdataapp.uploads
+    upload_limit = UploadLimit(max_file_size=10 * 1024 * 1024, max_request_size=256 * 1024 * 1024)
+
 
 class CSVJSONImportForm(forms.Form):
     upload_file = forms.FileField(label=_("File"))
+    atomic = forms.BooleanField(
+        required=False,
+        initial=True,
+        label=_("All or nothing"),
+        help_text=_("Roll back the whole import if any record is invalid. Otherwise every chunk is saved separately."),
+    )
+    background = forms.BooleanField(
+        required=False,
+        label=_("Run in background"),
+        help_text=_("Queue the import and process it outside of this request."),
+    )
+
+    upload_limit = UploadLimit(max_file_size=100 * 1024 * 1024)
+
+
+class ProductImportForm(CSVJSONImportForm):
+    mode = forms.ChoiceField(
+        choices=[
+            ("insert", _("Create new products")),
+            ("upsert", _("Create or update products by SKU")),
+        ],
+        initial="insert",
+        label=_("Mode"),
+    )
@@ -0,0 +1,149 @@
+"""
+Уменьшенные копии изображений товаров.
+
+Превью товара и дополнительные изображения хранятся в том виде, в каком их
+загрузили. После загрузки сигнал ставит в очередь задачу render_images, и воркер
+``manage.py run_jobs`` в своем пуле процессов строит из исходника копии размеров
+RENDITIONS в форматах WebP и JPEG, записывая их размеры в
+:class:`shopapp.models.ImageRendition`. Тег ``{% picture %}`` из shopapp_images
+выводит <picture> с srcset из этих копий, а пока их нет - исходное изображение.
+"""
+
+from dataclasses import dataclass
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Model
+
+from PIL import Image, ImageOps
+
+from .models import ImageRendition
+
+
+@dataclass(frozen=True)
+class RenditionSize:
+    """Рамка копии, crop - обрезать изображение по рамке, а не вписывать в нее."""
+
+    width: int
+    height: int
+    crop: bool = False
+
+
+RENDITIONS = {
+    "thumb": RenditionSize(100, 100, crop=True),
+    "list": RenditionSize(200, 200),
+    "detail": RenditionSize(800, 800),
+}
+
+# Формат Pillow, MIME-тип и параметры сохранения. Порядок важен: браузер берет первый
+# поддерживаемый <source>, а последний формат идет в <img> для остальных браузеров
+FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 85, "optimize": True, "progressive": True}),
+}
+FALLBACK_FORMAT = "jpeg"
+
+# Поле исходного изображения каждой модели
+IMAGE_FIELDS = {
+    "shopapp.product": "preview",
+    "shopapp.productimage": "image",
+}
+
+
+def open_source(file) -> Image.Image:
+    """
+    Открывает исходное изображение и поворачивает его по EXIF.
+
+    JPEG сразу декодируется в уменьшенном масштабе (draft), не меньше самой большой
+    копии: полный декод многомегапиксельной фотографии для копии в 800 px не нужен.
+    """
+    image = Image.open(file)
+    largest = max(RENDITIONS.values(), key=lambda size: size.width * size.height)
+    image.draft("RGB", (largest.width, largest.height))
+    return ImageOps.exif_transpose(image)
+
+
+def resize(image: Image.Image, size: RenditionSize) -> Image.Image:
+    """Уменьшает изображение до рамки size, не увеличивая маленькие изображения."""
+    if size.crop:
+        return ImageOps.fit(image, (min(size.width, image.width), min(size.height, image.height)), Image.LANCZOS)
+    resized = image.copy()
+    resized.thumbnail((size.width, size.height), Image.LANCZOS)
+    return resized
+
+
+def encode(image: Image.Image, image_format: str, options: dict) -> bytes:
+    """Сохраняет изображение в байты формата image_format, прозрачность в JPEG заменяет белым фоном."""
+    if image_format == "JPEG" and image.mode != "RGB":
+        if image.has_transparency_data:
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        else:
+            image = image.convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def render_renditions(instance: Model, field: str) -> int:
+    """
+    Строит копии изображения из поля field объекта instance и возвращает их число.
+
+    Копии предыдущего изображения удаляются. Если изображение заменили, пока строились
+    копии, результат отбрасывается: новые копии построит задача нового изображения.
+    """
+    source = getattr(instance, field)
+    content_type = ContentType.objects.get_for_model(instance)
+    renditions = []
+    if source:
+        with source.open("rb") as file:
+            image = open_source(file)
+            stem = PurePosixPath(source.name).stem
+            for size_name, size in RENDITIONS.items():
+                resized = resize(image, size)
+                for format_name, (image_format, _, options) in FORMATS.items():
+                    rendition = ImageRendition(
+                        content_type=content_type,
+                        object_id=instance.pk,
+                        field=field,
+                        source=source.name,
+                        size=size_name,
+                        format=format_name,
+                        width=resized.width,
+                        height=resized.height,
+                    )
+                    content = ContentFile(encode(resized, image_format, options))
+                    rendition.file.save(f"{stem}-{size_name}.{format_name}", content, save=False)
+                    renditions.append(rendition)
+
+    with transaction.atomic():
+        current = type(instance).objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+        if (current or "") != (source.name or ""):
+            for rendition in renditions:
+                rendition.file.delete(save=False)
+            return 0
+        # Файлы старых копий удаляет сигнал post_delete после фиксации транзакции
+        ImageRendition.objects.filter(content_type=content_type, object_id=instance.pk, field=field).delete()
+        ImageRendition.objects.bulk_create(renditions)
+    return len(renditions)
+
+
+def current_renditions(image) -> list[ImageRendition]:
+    """
+    Копии, построенные с текущего файла изображения image (FieldFile).
+
+    Берутся из instance.renditions.all(), поэтому в списках копии подгружаются
+    prefetch_related("renditions") одним запросом на страницу.
+    """
+    if not image:
+        return []
+    return [
+        rendition
+        for rendition in image.instance.renditions.all()
+        if rendition.field == image.field.name and rendition.source == image.name
+    ]
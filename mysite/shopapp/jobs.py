@@ -0,0 +1,258 @@
+"""
+Фоновые задачи импорта, экспорта и обработки изображений.
+
+Задачи хранятся в таблице :model:`shopapp.Job`. Запрос только ставит задачу в очередь,
+а выполняет ее команда ``manage.py run_jobs``, поэтому брокер сообщений не нужен.
+"""
+
+import logging
+from datetime import timedelta
+from tempfile import TemporaryFile
+from typing import Callable, Iterable, Iterator
+
+from django.apps import apps
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.files.uploadedfile import UploadedFile
+from django.db.models import Model, Q, QuerySet
+from django.http import HttpRequest, QueryDict
+from django.utils import timezone
+
+from .cache import PRODUCTS, invalidate
+from .common import EXPORT_CHUNK_SIZE, ImportReport, save_csv, save_json, stream_csv
+from .images import IMAGE_FIELDS, render_renditions
+from .models import Job, Order, Product
+
+log = logging.getLogger(__name__)
+
+JobHandler = Callable[[Job], dict | None]
+
+# Как часто воркер отмечает выполняемые задачи и через сколько без отметки задача
+# считается брошенной: воркер убили или он завис вместе с пулом
+HEARTBEAT_INTERVAL = timedelta(seconds=30)
+STALE_AFTER = timedelta(minutes=5)
+
+JOB_HANDLERS: dict[str, JobHandler] = {}
+
+
+def job_handler(kind: str) -> Callable[[JobHandler], JobHandler]:
+    """Регистрирует функцию, выполняющую задачи вида kind."""
+
+    def decorator(func: JobHandler) -> JobHandler:
+        JOB_HANDLERS[kind] = func
+        return func
+
+    return decorator
+
+
+def enqueue(
+    kind: str,
+    user: User | None = None,
+    params: dict | None = None,
+    input_file: UploadedFile | None = None,
+) -> Job:
+    """Ставит задачу в очередь и возвращает ее."""
+    job = Job(kind=kind, params=params or {}, created_by=user)
+    if input_file is not None:
+        job.input_file.save(input_file.name, input_file, save=False)
+    job.save()
+    return job
+
+
+def claim_jobs(limit: int) -> list[int]:
+    """
+    Забирает до limit ожидающих задач и возвращает их первичные ключи.
+
+    Задача переводится в состояние running условным UPDATE, поэтому одну задачу не
+    возьмут два воркера, даже если их запущено несколько.
+    """
+    claimed = []
+    pending = Job.objects.filter(status=Job.Status.PENDING).order_by("created_at").values_list("pk", flat=True)
+    for pk in pending[:limit]:
+        now = timezone.now()
+        updated = Job.objects.filter(pk=pk, status=Job.Status.PENDING).update(
+            status=Job.Status.RUNNING,
+            started_at=now,
+            heartbeat_at=now,
+        )
+        if updated:
+            claimed.append(pk)
+    return claimed
+
+
+def run_job(pk: int) -> str:
+    """Выполняет задачу, уже переведенную в состояние running, и возвращает итоговое состояние."""
+    job = Job.objects.get(pk=pk)
+    handler = JOB_HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise ValueError(f"Unknown job kind {job.kind!r}")
+        job.report = handler(job)
+        job.status = Job.Status.DONE
+    except Exception as exc:
+        log.exception("Job %s failed", pk)
+        job.status = Job.Status.FAILED
+        job.error = str(exc)
+    job.finished_at = timezone.now()
+    # Входной файл больше не нужен: без ссылки на него его удалит сборка мусора хранилища
+    job.input_file.delete(save=False)
+    job.save(update_fields=["report", "input_file", "result_file", "status", "error", "progress", "finished_at"])
+    return job.status
+
+
+def fail_job(pk: int, error: str) -> None:
+    """Помечает задачу упавшей, если процесс, выполнявший ее, завершился аварийно."""
+    fail_running(Job.objects.filter(pk=pk), error)
+
+
+def heartbeat(pks: Iterable[int]) -> None:
+    """Отмечает, что задачи pks еще выполняются."""
+    Job.objects.filter(pk__in=list(pks), status=Job.Status.RUNNING).update(heartbeat_at=timezone.now())
+
+
+def reap_stale_jobs(stale_after: timedelta = STALE_AFTER) -> int:
+    """
+    Помечает упавшими задачи running без отметки воркера дольше stale_after и возвращает их число.
+
+    Такие задачи остаются от воркера, убитого вместе с пулом: fail_job для них уже
+    никто не вызовет. Задачи не перезапускаются, импорт без atomic мог успеть
+    сохранить часть записей.
+    """
+    horizon = timezone.now() - stale_after
+    stale = Job.objects.filter(Q(heartbeat_at__lt=horizon) | Q(heartbeat_at__isnull=True, started_at__lt=horizon))
+    return fail_running(stale, "The worker stopped responding")
+
+
+def fail_running(jobs: QuerySet, error: str) -> int:
+    """Помечает упавшими задачи jobs в состоянии running и освобождает их входные файлы."""
+    return jobs.filter(status=Job.Status.RUNNING).update(
+        status=Job.Status.FAILED,
+        error=error,
+        input_file="",
+        finished_at=timezone.now(),
+    )
+
+
+def progress_updater(job: Job) -> Callable[[ImportReport], None]:
+    """Возвращает обработчик прогресса импорта, сохраняющий число обработанных записей."""
+
+    def update(report: ImportReport) -> None:
+        job.progress = report.processed
+        Job.objects.filter(pk=job.pk).update(progress=report.processed)
+
+    return update
+
+
+def run_import(job: Job, model: type[Product] | type[Order], **options) -> dict:
+    """Импортирует входной файл задачи в model и возвращает отчет."""
+    save = save_json if job.input_file.name.endswith(".json") else save_csv
+    with job.input_file.open("rb") as file:
+        report = save(
+            model,
+            file,
+            encoding=job.params.get("encoding") or "utf-8",
+            atomic=job.params.get("atomic", True),
+            progress=progress_updater(job),
+            **options,
+        )
+    return report.as_dict()
+
+
+@job_handler(Job.Kind.IMPORT_PRODUCTS)
+def import_products_job(job: Job) -> dict:
+    """Импорт товаров из CSV или JSON."""
+    return run_import(job, Product, mode=job.params.get("mode", "insert"))
+
+
+@job_handler(Job.Kind.IMPORT_ORDERS)
+def import_orders_job(job: Job) -> dict:
+    """Импорт заказов из CSV или JSON."""
+    return run_import(job, Order, key="products")
+
+
+def export_params(queryset: QuerySet, select_across: bool, changelist_filters: QueryDict) -> dict:
+    """
+    Параметры задачи экспорта объектов queryset, выбранных действием админки.
+
+    Если выбраны все объекты списка, сохраняются фильтры списка (changelist_filters),
+    а не первичные ключи: их могут быть миллионы. Отмеченных вручную объектов не больше
+    страницы списка, их ключи сохраняются как есть.
+    """
+    params = {"model": queryset.model._meta.label_lower}
+    if select_across:
+        params["changelist_filters"] = changelist_filters.urlencode()
+    else:
+        params["pks"] = list(queryset.order_by("pk").values_list("pk", flat=True))
+    return params
+
+
+def export_queryset(job: Job) -> QuerySet:
+    """Восстанавливает объекты экспорта по параметрам из export_params."""
+    model = apps.get_model(job.params["model"])
+    if "pks" in job.params:
+        return model.objects.filter(pk__in=job.params["pks"])
+
+    # Список админки строится так же, как для пользователя, поставившего задачу
+    if job.created_by is None:
+        raise ValueError("The user who queued the export was deleted")
+    request = HttpRequest()
+    request.method = "GET"
+    request.GET = QueryDict(job.params["changelist_filters"])
+    request.user = job.created_by
+    model_admin = admin.site._registry[model]
+    return model_admin.get_changelist_instance(request).get_queryset(request)
+
+
+def export_rows(job: Job, queryset: QuerySet, field_names: list[str]) -> Iterator[list]:
+    """
+    Отдает значения полей объектов queryset по первичному ключу пачками и считает их в job.progress.
+
+    Прогресс сохраняется в базу после каждой пачки, как при импорте (progress_updater).
+    """
+    for obj in queryset.order_by("pk").iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        job.progress += 1
+        if job.progress % EXPORT_CHUNK_SIZE == 0:
+            Job.objects.filter(pk=job.pk).update(progress=job.progress)
+        yield [getattr(obj, field) for field in field_names]
+
+
+@job_handler(Job.Kind.EXPORT_CSV)
+def export_csv_job(job: Job) -> dict:
+    """Экспорт выбранных в админке объектов в CSV-файл результата."""
+    queryset = export_queryset(job)
+    meta = queryset.model._meta
+    field_names = [field.name for field in meta.fields]
+
+    with TemporaryFile("w+b") as file:
+        for chunk in stream_csv(export_rows(job, queryset, field_names), header=field_names):
+            file.write(chunk.encode("utf-8"))
+        file.seek(0)
+        job.result_file.save(f"{meta.model_name}-export.csv", File(file), save=False)
+
+    return {"exported": job.progress}
+
+
+def enqueue_renditions(*instances: Model) -> list[Job]:
+    """Ставит в очередь построение копий изображений объектов instances одним INSERT."""
+    jobs = []
+    for instance in instances:
+        label = instance._meta.label_lower
+        params = {"model": label, "pk": instance.pk, "field": IMAGE_FIELDS[label]}
+        jobs.append(Job(kind=Job.Kind.RENDER_IMAGES, params=params))
+    return Job.objects.bulk_create(jobs)
+
+
+@job_handler(Job.Kind.RENDER_IMAGES)
+def render_images_job(job: Job) -> dict:
+    """Строит уменьшенные копии изображения товара."""
+    model = apps.get_model(job.params["model"])
+    instance = model.objects.filter(pk=job.params["pk"]).first()
+    if instance is None:
+        # Объект удалили раньше, чем до него дошла очередь
+        return {"renditions": 0}
+    renditions = render_renditions(instance, job.params["field"])
+    # bulk_create копий не отправляет сигналы, а страницы товаров их показывают
+    invalidate(PRODUCTS)
+    job.progress = 1
+    return {"renditions": renditions}
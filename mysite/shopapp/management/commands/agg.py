@@ -2,7 +2,7 @@ from email.policy import default
 
 from django.contrib.auth.models import User
 from django.core.management import BaseCommand
-from django.db.models import Avg, Max, Min, Count, Sum
+from django.db.models import Avg, Max, Min
 
 from shopapp.models import Product, Order
 
@@ -19,11 +19,12 @@ class Command(BaseCommand):
         # )
         # print(result)
 
-        orders = Order.objects.annotate(
-            total=Sum("products__price", default=0),
-            products_count=Count("products"),
-        )
+        # Итоги хранятся в заказе (см. shopapp.totals), соединение с товарами не нужно
+        orders = Order.objects.order_by("-total", "pk").only("total", "discounted_total", "items_count")
         for order in orders:
-            print(f"Order #{order.id} with {order.products_count} products worth {order.total}")
+            self.stdout.write(
+                f"Order #{order.id} with {order.items_count} products worth {order.total}"
+                f" ({order.discounted_total} with discounts)"
+            )
 
         self.stdout.write("Done")
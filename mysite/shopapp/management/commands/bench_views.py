@@ -0,0 +1,70 @@
+"""
+Бенчмарк представлений с бюджетами SQL-запросов.
+
+Создает временную базу данных, как manage.py test, заполняет ее синтетическими данными,
+замеряет все маршруты shopapp, blogapp и myauth и сохраняет результаты в JSON, чтобы
+сравнивать прогоны между собой. Рабочая база и кэши сайта не затрагиваются.
+"""
+
+import json
+
+from django.core.management import BaseCommand, CommandError
+from django.core.management.base import CommandParser
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+
+class Command(BaseCommand):
+    """Замеряет представления и проверяет бюджеты запросов."""
+
+    help = "Benchmark shopapp, blogapp and myauth views against their query budgets"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Добавляет аргументы для команды."""
+        parser.add_argument("--products", type=int, default=1000, help="Number of synthetic products")
+        parser.add_argument("--orders", type=int, default=500, help="Number of synthetic orders")
+        parser.add_argument("--articles", type=int, default=200, help="Number of synthetic articles")
+        parser.add_argument("--repeat", type=int, default=10, help="Timed requests per route")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed for the dataset")
+        parser.add_argument("--output", default="benchmark.json", help="Path to the JSON report")
+
+    def handle(self, *args, **options) -> None:
+        """Запускает бенчмарк и сохраняет отчет."""
+        from shopapp.benchmarks import over_budget, run_benchmarks
+
+        # Тестовое окружение разрешает хост testserver тестового клиента
+        setup_test_environment()
+        databases = setup_databases(verbosity=0, interactive=False)
+        try:
+            report = run_benchmarks(
+                repeat=options["repeat"],
+                products=options["products"],
+                orders=options["orders"],
+                articles=options["articles"],
+                seed=options["seed"],
+            )
+        finally:
+            teardown_databases(databases, verbosity=0)
+            teardown_test_environment()
+
+        with open(options["output"], "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+        for result in report["results"]:
+            line = (
+                f"{result['route']:<36} {result['status']} queries {result['queries']}/{result['max_queries']}"
+                f" p50 {result['p50_ms']} ms p95 {result['p95_ms']} ms mem {result['peak_memory_kb']} KiB"
+            )
+            self.stdout.write(self.style.ERROR(line) if result["over_budget"] else line)
+        self.stdout.write(f"Report saved to {options['output']}")
+
+        if report["uncovered_routes"]:
+            raise CommandError(f"Routes without a budget: {', '.join(report['uncovered_routes'])}")
+        failed = over_budget(report)
+        if failed:
+            raise CommandError(f"{len(failed)} routes are over their query budget")
+        self.stdout.write(self.style.SUCCESS("All routes are within their query budgets"))
@@ -1,16 +1,21 @@
 from django.contrib.auth.models import User
 from django.core.management import BaseCommand
+from django.utils import timezone
 
+from shopapp.cache import ORDERS, PRODUCTS, invalidate
 from shopapp.models import Product
+from shopapp.totals import orders_with_products, recompute_totals
 
 
 class Command(BaseCommand):
     def handle(self, *args, **options):
         self.stdout.write("Start demo bulk actions")
 
-        result = Product.objects.filter(
-            name__contains="Smartphone",
-        ).update(discount=10)
+        products = Product.objects.filter(name__contains="Smartphone")
+        result = products.update(discount=10, updated_at=timezone.now())
+        # update() не отправляет сигналы, итоги заказов со скидочными товарами пересчитываются здесь
+        recompute_totals(orders_with_products(products.values("pk")))
+        invalidate(PRODUCTS, ORDERS)
 
         print(result)
 
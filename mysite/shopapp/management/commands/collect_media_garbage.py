@@ -0,0 +1,40 @@
+"""Команда удаления медиафайлов, на которые не ссылается ни одна запись, и брошенных временных файлов загрузок."""
+
+from datetime import timedelta
+
+from django.core.files.storage import storages
+from django.core.management import BaseCommand, CommandError, CommandParser
+
+from mysite.storage import GARBAGE_GRACE, ContentAddressedStorage, collect_garbage
+from requestdataapp.uploads import collect_stale_uploads
+
+
+class Command(BaseCommand):
+    """Собирает мусор хранилища с адресацией по содержимому: его delete файлы не удаляет."""
+
+    help = "Delete content-addressed media files that no record references"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Добавляет аргументы для команды."""
+        parser.add_argument(
+            "--grace-minutes",
+            type=int,
+            default=int(GARBAGE_GRACE.total_seconds() // 60),
+            help="Keep unreferenced files modified within this many minutes",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted")
+
+    def handle(self, *args, **options) -> None:
+        """Обрабатывает выполнение команды."""
+        storage = storages["default"]
+        if not isinstance(storage, ContentAddressedStorage):
+            raise CommandError("The default storage is not content-addressed")
+        report = collect_garbage(storage, grace=timedelta(minutes=options["grace_minutes"]), dry_run=options["dry_run"])
+        uploads, uploads_size = collect_stale_uploads(dry_run=options["dry_run"])
+        verb = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{verb} {report.deleted} files ({report.freed} bytes), {report.referenced} files are referenced"
+            )
+        )
+        self.stdout.write(self.style.SUCCESS(f"{verb} {uploads} stale upload files ({uploads_size} bytes)"))
@@ -0,0 +1,16 @@
+"""Команда удаления устаревших надгробий лент изменений."""
+
+from django.core.management import BaseCommand
+
+from shopapp.changes import prune_tombstones
+
+
+class Command(BaseCommand):
+    """Удаляет надгробия старше срока хранения, курсоры старше него все равно отклоняются."""
+
+    help = "Delete change feed tombstones older than the retention period"
+
+    def handle(self, *args, **options) -> None:
+        """Обрабатывает выполнение команды."""
+        deleted = prune_tombstones()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} tombstones"))
@@ -0,0 +1,24 @@
+"""Команда пересчета итогов всех заказов."""
+
+from django.core.management import BaseCommand, CommandParser
+
+from shopapp.cache import ORDERS, invalidate
+from shopapp.totals import RECOMPUTE_BATCH_SIZE, recompute_all_totals
+
+
+class Command(BaseCommand):
+    """Пересчитывает итоги заказов по их товарам, например после изменения цен в обход моделей."""
+
+    help = "Recompute stored totals of all orders"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Добавляет аргументы для команды."""
+        parser.add_argument(
+            "--batch-size", type=int, default=RECOMPUTE_BATCH_SIZE, help="Number of orders updated by one query"
+        )
+
+    def handle(self, *args, **options) -> None:
+        """Обрабатывает выполнение команды."""
+        updated = recompute_all_totals(batch_size=options["batch_size"])
+        invalidate(ORDERS)
+        self.stdout.write(self.style.SUCCESS(f"Recomputed totals of {updated} orders"))
@@ -0,0 +1,36 @@
+"""Команда постановки в очередь построения копий уже загруженных изображений."""
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import BaseCommand, CommandParser
+from django.db.models import Exists, OuterRef
+
+from shopapp.jobs import enqueue_renditions
+from shopapp.models import ImageRendition, Product, ProductImage
+
+
+class Command(BaseCommand):
+    """Ставит задачи render_images для изображений, загруженных до появления копий."""
+
+    help = "Queue rendition jobs for product images that have no renditions yet"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Добавляет аргументы для команды."""
+        parser.add_argument("--all", action="store_true", help="Rebuild renditions of every image")
+
+    def handle(self, *args, **options) -> None:
+        """Обрабатывает выполнение команды."""
+        queued = 0
+        for model, field in ((Product, "preview"), (ProductImage, "image")):
+            objects = model.objects.exclude(**{field: ""}).exclude(**{f"{field}__isnull": True})
+            if not options["all"]:
+                renditions = ImageRendition.objects.filter(
+                    content_type=ContentType.objects.get_for_model(model),
+                    object_id=OuterRef("pk"),
+                    field=field,
+                    source=OuterRef(field),
+                )
+                objects = objects.exclude(Exists(renditions))
+            for instance in objects.only("pk", field).iterator():
+                enqueue_renditions(instance)
+                queued += 1
+        self.stdout.write(self.style.SUCCESS(f"Queued {queued} rendition jobs"))
@@ -0,0 +1,25 @@
+"""Команда свертки заказов в дневные итоги продаж."""
+
+from datetime import date
+
+from django.core.management import BaseCommand, CommandParser
+
+from shopapp.reports import rollup_sales
+
+
+class Command(BaseCommand):
+    """Сворачивает заказы закрытых дней, которые еще не свернуты, в итоги для отчетов."""
+
+    help = "Roll up orders of completed days into daily sales reports"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Добавляет аргументы для команды."""
+        parser.add_argument(
+            "--since", type=date.fromisoformat, help="Recompute days starting from this date (YYYY-MM-DD)"
+        )
+        parser.add_argument("--until", type=date.fromisoformat, help="First day not to roll up, today by default")
+
+    def handle(self, *args, **options) -> None:
+        """Обрабатывает выполнение команды."""
+        days, rows = rollup_sales(since=options["since"], until=options["until"])
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {days} days into {rows} rows"))
@@ -0,0 +1,90 @@
+"""
+Воркер фоновых задач импорта, экспорта и обработки изображений.
+
+Забирает ожидающие задачи из таблицы :model:`shopapp.Job` и выполняет их в пуле
+процессов, так что долгий импорт и построение копий изображений не занимают
+воркеры gunicorn. Пока задача выполняется, воркер раз в HEARTBEAT_INTERVAL отмечает
+ее в базе, а задачи, брошенные убитым воркером, помечает упавшими
+(см. :func:`shopapp.jobs.reap_stale_jobs`).
+"""
+
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import get_context
+
+import django
+from django.core.management import BaseCommand
+from django.core.management.base import CommandParser
+from django.db import connections
+
+
+# Функции пула импортируют модели только внутри себя: дочерний процесс загружает этот
+# модуль до django.setup()
+def init_worker() -> None:
+    """Настраивает Django в дочернем процессе пула."""
+    django.setup()
+
+
+def execute_job(pk: int) -> str:
+    """Выполняет задачу в дочернем процессе пула."""
+    from shopapp.jobs import run_job
+
+    return run_job(pk)
+
+
+class Command(BaseCommand):
+    """Выполняет фоновые задачи из очереди в базе данных."""
+
+    help = "Run queued import/export and image jobs in a process pool"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Добавляет аргументы для команды."""
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+        parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between queue polls")
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+
+    def handle(self, *args, **options) -> None:
+        """Опрашивает очередь и раздает задачи процессам пула."""
+        from shopapp.jobs import HEARTBEAT_INTERVAL, claim_jobs, heartbeat, reap_stale_jobs
+
+        workers = options["workers"]
+        self.stdout.write(f"Start job worker with {workers} processes")
+
+        # spawn вместо fork: дочерние процессы не наследуют соединения с базой
+        context = get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker) as pool:
+            running: dict[Future, int] = {}
+            last_heartbeat = 0.0
+            while True:
+                for future in [future for future in running if future.done()]:
+                    self.report(running.pop(future), future)
+
+                if time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL.total_seconds():
+                    heartbeat(running.values())
+                    if reaped := reap_stale_jobs():
+                        self.stdout.write(self.style.WARNING(f"{reaped} stale jobs marked as failed"))
+                    last_heartbeat = time.monotonic()
+
+                claimed = claim_jobs(workers - len(running)) if len(running) < workers else []
+                for pk in claimed:
+                    self.stdout.write(f"Job #{pk} started")
+                    running[pool.submit(execute_job, pk)] = pk
+
+                if options["once"] and not claimed and not running:
+                    break
+                if not claimed:
+                    connections.close_all()
+                    time.sleep(options["poll_interval"])
+
+        self.stdout.write(self.style.SUCCESS("Job worker stopped"))
+
+    def report(self, pk: int, future: Future) -> None:
+        """Выводит итог выполнения задачи."""
+        from shopapp.jobs import fail_job
+
+        if future.exception() is not None:
+            fail_job(pk, str(future.exception()))
+            self.stdout.write(self.style.ERROR(f"Job #{pk} crashed: {future.exception()}"))
+        else:
+            self.stdout.write(f"Job #{pk} {future.result()}")
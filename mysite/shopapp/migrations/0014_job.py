@@ -0,0 +1,40 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0013_product_sku'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('import_products', 'Import products'), ('import_orders', 'Import orders'), ('export_csv', 'Export to CSV')], max_length=32, verbose_name='kind')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16, verbose_name='status')),
+                ('params', models.JSONField(blank=True, default=dict, verbose_name='parameters')),
+                ('input_file', models.FileField(blank=True, null=True, upload_to='jobs/input/', verbose_name='input file')),
+                ('result_file', models.FileField(blank=True, null=True, upload_to='jobs/results/', verbose_name='result file')),
+                ('progress', models.PositiveIntegerField(default=0, verbose_name='processed records')),
+                ('report', models.JSONField(blank=True, null=True, verbose_name='report')),
+                ('error', models.TextField(blank=True, verbose_name='error')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='started at')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='finished at')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to=settings.AUTH_USER_MODEL, verbose_name='created by')),
+            ],
+            options={
+                'verbose_name': 'job',
+                'verbose_name_plural': 'jobs',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='shopapp_job_status_b6230a_idx')],
+            },
+        ),
+    ]
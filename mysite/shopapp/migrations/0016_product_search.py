@@ -0,0 +1,41 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:53
+
+from django.contrib.postgres.indexes import GinIndex
+from django.db import migrations, models
+
+from shopapp.search import POSTGRES_INDEX, SEARCH_INDEX, SEARCH_VECTOR
+
+
+def create_search_index(apps, schema_editor):
+    """Создает полнотекстовый индекс товаров для текущей СУБД."""
+    Product = apps.get_model("shopapp", "Product")
+    if schema_editor.connection.vendor == "sqlite":
+        SEARCH_INDEX.install(schema_editor)
+        SEARCH_INDEX.rebuild(schema_editor)
+    elif schema_editor.connection.vendor == "postgresql":
+        schema_editor.add_index(Product, GinIndex(SEARCH_VECTOR, name=POSTGRES_INDEX))
+
+
+def drop_search_index(apps, schema_editor):
+    """Удаляет полнотекстовый индекс товаров."""
+    Product = apps.get_model("shopapp", "Product")
+    if schema_editor.connection.vendor == "sqlite":
+        SEARCH_INDEX.uninstall(schema_editor)
+    elif schema_editor.connection.vendor == "postgresql":
+        schema_editor.remove_index(Product, GinIndex(SEARCH_VECTOR, name=POSTGRES_INDEX))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0015_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='description',
+            field=models.TextField(blank=True, verbose_name='description'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.1 on 2026-10-18 21:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+from shopapp.totals import recompute_all_totals
+
+
+def backfill_totals(apps, schema_editor):
+    """Считает итоги существующих заказов."""
+    recompute_all_totals(apps.get_model("shopapp", "Order"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0017_change_feeds'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='discounted_total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='discounted total'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='items count'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='total'),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['total', 'id'], name='shopapp_ord_total_59db89_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['discounted_total', 'id'], name='shopapp_ord_discoun_4c0efa_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.1 on 2026-10-18 21:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0018_order_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='day')),
+                ('dimension', models.CharField(choices=[('total', 'Total'), ('product', 'Product'), ('promocode', 'Promocode'), ('user', 'User')], max_length=16, verbose_name='dimension')),
+                ('key', models.CharField(blank=True, max_length=20, verbose_name='key')),
+                ('orders', models.PositiveIntegerField(default=0, verbose_name='orders')),
+                ('units', models.PositiveIntegerField(default=0, verbose_name='units')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='revenue')),
+                ('discounted_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='discounted revenue')),
+            ],
+            options={
+                'verbose_name': 'daily sales',
+                'verbose_name_plural': 'daily sales',
+                'indexes': [models.Index(fields=['dimension', 'day', 'key'], name='shopapp_dai_dimensi_800a5b_idx')],
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'key', 'day'), name='shopapp_dailysales_unique')],
+            },
+        ),
+    ]
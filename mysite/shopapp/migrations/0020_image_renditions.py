@@ -0,0 +1,41 @@
+# Generated by Django 5.1.1 on 2026-10-18 21:17
+
+import django.db.models.deletion
+import shopapp.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('shopapp', '0019_daily_sales'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('import_products', 'Import products'), ('import_orders', 'Import orders'), ('export_csv', 'Export to CSV'), ('render_images', 'Render images')], max_length=32, verbose_name='kind'),
+        ),
+        migrations.CreateModel(
+            name='ImageRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('field', models.CharField(max_length=32, verbose_name='field')),
+                ('source', models.CharField(max_length=255, verbose_name='source')),
+                ('size', models.CharField(max_length=16, verbose_name='size')),
+                ('format', models.CharField(max_length=8, verbose_name='format')),
+                ('file', models.ImageField(upload_to=shopapp.models.rendition_directory_path, verbose_name='file')),
+                ('width', models.PositiveIntegerField(verbose_name='width')),
+                ('height', models.PositiveIntegerField(verbose_name='height')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'verbose_name': 'image rendition',
+                'verbose_name_plural': 'image renditions',
+                'indexes': [models.Index(fields=['content_type', 'object_id'], name='shopapp_ima_content_0ac2f6_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.1 on 2026-10-18 21:21
+
+from django.db import migrations, models
+
+from shopapp.uploads import backfill_sha256
+
+
+def backfill_hashes(apps, schema_editor):
+    """Считает SHA-256 уже загруженных изображений товаров."""
+    backfill_sha256(apps.get_model("shopapp", "ProductImage"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0020_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='sha256',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='SHA-256'),
+        ),
+        migrations.RunPython(backfill_hashes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='productimage',
+            index=models.Index(fields=['product', 'sha256'], name='shopapp_pro_product_27974b_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.1 on 2026-10-18 22:06
+
+import django.db.models.deletion
+import mysite.fts
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0022_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchIndex',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='shopapp.product')),
+                ('document', mysite.fts.DocumentField(db_column='shopapp_product_fts')),
+            ],
+            options={
+                'db_table': 'shopapp_product_fts',
+                'managed': False,
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.1 on 2026-10-18 22:30
+
+import mysite.storage
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+
+def move_job_files(apps, schema_editor):
+    """
+    Переносит файлы задач из MEDIA_ROOT в закрытое хранилище.
+
+    Общие файлы с адресацией по содержимому остаются на месте, их удалит сборка мусора.
+    """
+    Job = apps.get_model("shopapp", "Job")
+    storage = mysite.storage.private_storage()
+    for field in ("input_file", "result_file"):
+        for job in Job.objects.exclude(**{f"{field}__isnull": True}).exclude(**{field: ""}):
+            name = getattr(job, field).name
+            if not default_storage.exists(name):
+                continue
+            with default_storage.open(name, "rb") as file:
+                Job.objects.filter(pk=job.pk).update(**{field: storage.save(name, file)})
+            default_storage.delete(name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0023_search_index_model'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='input_file',
+            field=models.FileField(blank=True, null=True, storage=mysite.storage.private_storage, upload_to='jobs/input/', verbose_name='input file'),
+        ),
+        migrations.AlterField(
+            model_name='job',
+            name='result_file',
+            field=models.FileField(blank=True, null=True, storage=mysite.storage.private_storage, upload_to='jobs/results/', verbose_name='result file'),
+        ),
+        migrations.RunPython(move_job_files, migrations.RunPython.noop),
+    ]
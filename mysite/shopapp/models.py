@@ -6,10 +6,15 @@
 """
 
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
+from django.contrib.contenttypes.models import ContentType
 from django.db import models
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _, pgettext_lazy
 
+from mysite.fts import DocumentField
+from mysite.storage import private_storage
+
 
 def product_preview_directory_path(instance: "Product", filename: str) -> str:
     """Генерирует путь к директории для предварительного просмотра продукта."""
@@ -24,10 +29,13 @@ class Product(models.Model):
     """
 
     name = models.CharField(max_length=100, verbose_name=pgettext_lazy("product name", "name"), db_index=True)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True, verbose_name=_("SKU"))
     price = models.DecimalField(default=0, max_digits=8, decimal_places=2, verbose_name=_("price"))
-    description = models.TextField(null=False, blank=True, verbose_name=_("description"), db_index=True)
+    description = models.TextField(null=False, blank=True, verbose_name=_("description"))
     discount = models.PositiveSmallIntegerField(default=0, verbose_name=_("discount"))
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("created at"))
+    # update() не обновляет auto_now, такие места задают updated_at явно
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_("updated at"))
     archived = models.BooleanField(default=False, verbose_name=_("archived"))
     created_by = models.ForeignKey(
         User,
@@ -42,6 +50,7 @@ class Product(models.Model):
         upload_to=product_preview_directory_path,
         verbose_name=_("preview"),
     )
+    renditions = GenericRelation("ImageRendition", related_query_name="product")
 
     # @property
     # def description_short(self)-> str:
@@ -53,6 +62,10 @@ class Product(models.Model):
         """Мета данные модели продукта."""
 
         ordering = ["name", "price"]
+        indexes = [
+            models.Index(fields=["name", "price", "id"]),
+            models.Index(fields=["updated_at", "id"]),
+        ]
         verbose_name = _("product")
         verbose_name_plural = _("products")
 
@@ -67,6 +80,30 @@ class Product(models.Model):
         return reverse("shopapp:product_details", kwargs={"pk": self.pk})
 
 
+class ProductSearchIndex(models.Model):
+    """
+    Строка полнотекстового индекса товаров (таблица FTS5 на SQLite, см. shopapp.search).
+
+    Таблицу создает и синхронизирует с товарами :class:`mysite.fts.FTSIndex`, модель
+    нужна только для соединения с ней в запросах поиска.
+    """
+
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column="rowid",
+        related_name="search_index",
+    )
+    document = DocumentField(db_column="shopapp_product_fts")
+
+    class Meta:
+        """Метаданные модели индекса."""
+
+        managed = False
+        db_table = "shopapp_product_fts"
+
+
 def product_images_directory_path(instance: "ProductImage", filename: str) -> str:
     """Генерирует путь к директории для изображений продукта."""
     return "products/product_{pk}/images/{filename}".format(
@@ -90,10 +127,16 @@ class ProductImage(models.Model):
     )
     image = models.ImageField(upload_to=product_images_directory_path, verbose_name=_("image"))
     description = models.CharField(max_length=200, null=False, blank=True, verbose_name=_("description"))
+    # SHA-256 содержимого файла: одинаковые изображения товара загружаются один раз
+    sha256 = models.CharField(max_length=64, blank=True, editable=False, verbose_name=_("SHA-256"))
+    renditions = GenericRelation("ImageRendition", related_query_name="product_image")
 
     class Meta:
         """Метаданные модели продукта."""
 
+        indexes = [
+            models.Index(fields=["product", "sha256"]),
+        ]
         verbose_name = _("product image")
         verbose_name_plural = _("product images")
 
@@ -102,6 +145,49 @@ class ProductImage(models.Model):
         return f"Image for {self.product}"
 
 
+def rendition_directory_path(instance: "ImageRendition", filename: str) -> str:
+    """Генерирует путь к уменьшенной копии рядом с остальными копиями того же объекта."""
+    return f"renditions/{instance.content_type.model}_{instance.object_id}/{filename}"
+
+
+class ImageRendition(models.Model):
+    """
+    Уменьшенная копия изображения товара фиксированного размера.
+
+    Копии строит фоновая задача (см. :mod:`shopapp.images`) после загрузки исходного
+    изображения, шаблоны выбирают из них подходящую через srcset.
+    """
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveBigIntegerField()
+    content_object = GenericForeignKey("content_type", "object_id")
+    # Поле объекта с исходным изображением и имя файла, с которого построена копия:
+    # после замены изображения копии старого файла не показываются
+    field = models.CharField(max_length=32, verbose_name=_("field"))
+    source = models.CharField(max_length=255, verbose_name=_("source"))
+    size = models.CharField(max_length=16, verbose_name=_("size"))
+    format = models.CharField(max_length=8, verbose_name=_("format"))
+    file = models.ImageField(upload_to=rendition_directory_path, verbose_name=_("file"))
+    # Размеры записываются при построении копии, чтобы шаблон задавал width и height у <img>
+    width = models.PositiveIntegerField(verbose_name=_("width"))
+    height = models.PositiveIntegerField(verbose_name=_("height"))
+
+    class Meta:
+        """Метаданные модели уменьшенной копии изображения."""
+
+        indexes = [models.Index(fields=["content_type", "object_id"])]
+        verbose_name = _("image rendition")
+        verbose_name_plural = _("image renditions")
+
+    def __str__(self) -> str:
+        """Возвращает строковое представление копии изображения."""
+        return f"{self.source} {self.size} {self.format} {self.width}x{self.height}"
+
+
+# Поля заказа с итогами по его товарам (см. shopapp.totals)
+TOTAL_FIELDS = ("total", "discounted_total", "items_count")
+
+
 class Order(models.Model):
     """
     Модель Order представляет заказы, которые оформлены в интернет-магазине.
@@ -118,11 +204,27 @@ class Order(models.Model):
     promocode = models.CharField(max_length=20, null=False, blank=True, verbose_name=_("promocode"))
     delivery_address = models.TextField(verbose_name=_("delivery address"))
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("created at"))
+    # Меняется и при изменении состава заказа (см. shopapp.signals)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_("updated at"))
     receipt = models.FileField(null=True, blank=True, upload_to="orders/receipts/", verbose_name=_("receipt"))
+    # Итоги по товарам заказа ведет shopapp.totals, save() их не перезаписывает
+    total = models.DecimalField(
+        default=0, max_digits=12, decimal_places=2, editable=False, verbose_name=_("total")
+    )
+    discounted_total = models.DecimalField(
+        default=0, max_digits=12, decimal_places=2, editable=False, verbose_name=_("discounted total")
+    )
+    items_count = models.PositiveIntegerField(default=0, editable=False, verbose_name=_("items count"))
 
     class Meta:
         """Метаданные модели заказа."""
 
+        indexes = [
+            models.Index(fields=["created_at", "id"]),
+            models.Index(fields=["updated_at", "id"]),
+            models.Index(fields=["total", "id"]),
+            models.Index(fields=["discounted_total", "id"]),
+        ]
         verbose_name = _("order")
         verbose_name_plural = _("orders")
 
@@ -130,5 +232,181 @@ class Order(models.Model):
         """Возвращает строковое представление заказа с его уникальным идентификатором."""
         return _("Order # %d") % (self.pk,)
 
+    def save(self, *args, **kwargs) -> None:
+        """
+        Сохраняет заказ, не трогая итоги по товарам.
+
+        Итоги пересчитываются в базе при изменении состава заказа и цен товаров, а
+        значения в экземпляре могли устареть с момента его загрузки.
+        """
+        if not self._state.adding and kwargs.get("update_fields") is None and not kwargs.get("force_insert"):
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in TOTAL_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
     def get_absolute_url(self) -> str:
         return reverse("shopapp:order_details", kwargs={"pk": self.pk})
+
+
+class Tombstone(models.Model):
+    """
+    Запись об удалении или архивировании товара или заказа.
+
+    Ленты изменений (см. :mod:`shopapp.changes`) отдают надгробия вместе с измененными
+    записями, чтобы клиент мог убрать у себя то, чего в выгрузке больше нет.
+    """
+
+    class Kind(models.TextChoices):
+        """Модели, для которых ведутся надгробия."""
+
+        PRODUCT = "product", _("Product")
+        ORDER = "order", _("Order")
+
+    class Reason(models.TextChoices):
+        """Причины, по которым запись пропала из выгрузки."""
+
+        DELETED = "deleted", _("Deleted")
+        ARCHIVED = "archived", _("Archived")
+
+    kind = models.CharField(max_length=16, choices=Kind.choices, verbose_name=_("kind"))
+    object_id = models.PositiveBigIntegerField(verbose_name=_("object id"))
+    # Владелец удаленного заказа для ленты заказов пользователя, без внешнего ключа:
+    # надгробие должно пережить и пользователя
+    owner_id = models.PositiveBigIntegerField(null=True, blank=True, verbose_name=_("owner id"))
+    reason = models.CharField(max_length=16, choices=Reason.choices, verbose_name=_("reason"))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("created at"))
+
+    class Meta:
+        """Метаданные модели надгробия."""
+
+        indexes = [models.Index(fields=["kind", "created_at", "id"])]
+        verbose_name = _("tombstone")
+        verbose_name_plural = _("tombstones")
+
+    def __str__(self) -> str:
+        """Возвращает строковое представление надгробия."""
+        return f"{self.kind} #{self.object_id} {self.reason}"
+
+
+class DailySales(models.Model):
+    """
+    Итоги продаж за день: по всему магазину, по товару, промокоду или покупателю.
+
+    Строки заполняет команда ``manage.py rollup_sales`` (см. :mod:`shopapp.reports`),
+    отчеты читают их вместо агрегирования всех заказов.
+    """
+
+    class Dimension(models.TextChoices):
+        """Разрезы итогов."""
+
+        TOTAL = "total", _("Total")
+        PRODUCT = "product", _("Product")
+        PROMOCODE = "promocode", _("Promocode")
+        USER = "user", _("User")
+
+    day = models.DateField(verbose_name=_("day"))
+    dimension = models.CharField(max_length=16, choices=Dimension.choices, verbose_name=_("dimension"))
+    # id товара или покупателя либо промокод, для TOTAL пустая строка. Без внешних
+    # ключей: итоги прошлых дней должны пережить удаление товара или пользователя
+    key = models.CharField(max_length=20, blank=True, verbose_name=_("key"))
+    orders = models.PositiveIntegerField(default=0, verbose_name=_("orders"))
+    units = models.PositiveIntegerField(default=0, verbose_name=_("units"))
+    revenue = models.DecimalField(default=0, max_digits=14, decimal_places=2, verbose_name=_("revenue"))
+    discounted_revenue = models.DecimalField(
+        default=0, max_digits=14, decimal_places=2, verbose_name=_("discounted revenue")
+    )
+
+    class Meta:
+        """Метаданные модели итогов продаж за день."""
+
+        constraints = [
+            # Этот же индекс обслуживает ряды одного ключа по дням
+            models.UniqueConstraint(fields=["dimension", "key", "day"], name="shopapp_dailysales_unique"),
+        ]
+        indexes = [models.Index(fields=["dimension", "day", "key"])]
+        verbose_name = _("daily sales")
+        verbose_name_plural = _("daily sales")
+
+    def __str__(self) -> str:
+        """Возвращает строковое представление итогов за день."""
+        return f"{self.day} {self.dimension} {self.key}".rstrip()
+
+
+class Job(models.Model):
+    """
+    Фоновая задача импорта, экспорта или обработки изображений.
+
+    Задачи ставятся в очередь из админки и сигналов моделей и выполняются командой ``manage.py run_jobs``,
+    поэтому большие файлы не обрабатываются внутри запроса.
+    """
+
+    class Kind(models.TextChoices):
+        """Виды фоновых задач."""
+
+        IMPORT_PRODUCTS = "import_products", _("Import products")
+        IMPORT_ORDERS = "import_orders", _("Import orders")
+        EXPORT_CSV = "export_csv", _("Export to CSV")
+        RENDER_IMAGES = "render_images", _("Render images")
+
+    class Status(models.TextChoices):
+        """Состояния фоновой задачи."""
+
+        PENDING = "pending", _("Pending")
+        RUNNING = "running", _("Running")
+        DONE = "done", _("Done")
+        FAILED = "failed", _("Failed")
+
+    kind = models.CharField(max_length=32, choices=Kind.choices, verbose_name=_("kind"))
+    status = models.CharField(
+        max_length=16,
+        choices=Status.choices,
+        default=Status.PENDING,
+        verbose_name=_("status"),
+    )
+    params = models.JSONField(default=dict, blank=True, verbose_name=_("parameters"))
+    # Выгрузки заказов и импортируемые файлы не должны попадать в MEDIA_ROOT, который
+    # отдается без проверки прав, их отдает JobDownloadView
+    input_file = models.FileField(
+        null=True, blank=True, upload_to="jobs/input/", storage=private_storage, verbose_name=_("input file")
+    )
+    result_file = models.FileField(
+        null=True, blank=True, upload_to="jobs/results/", storage=private_storage, verbose_name=_("result file")
+    )
+    progress = models.PositiveIntegerField(default=0, verbose_name=_("processed records"))
+    report = models.JSONField(null=True, blank=True, verbose_name=_("report"))
+    error = models.TextField(blank=True, verbose_name=_("error"))
+    created_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="jobs",
+        verbose_name=_("created by"),
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("created at"))
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name=_("started at"))
+    # Воркер обновляет отметку, пока выполняет задачу, см. shopapp.jobs.reap_stale_jobs
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name=_("heartbeat at"))
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name=_("finished at"))
+
+    class Meta:
+        """Метаданные модели фоновой задачи."""
+
+        ordering = ["-created_at"]
+        indexes = [models.Index(fields=["status", "created_at"])]
+        verbose_name = _("job")
+        verbose_name_plural = _("jobs")
+
+    def __str__(self) -> str:
+        """Возвращает строковое представление задачи с ее видом и состоянием."""
+        return _("Job #%(pk)d %(kind)s (%(status)s)") % {
+            "pk": self.pk,
+            "kind": self.get_kind_display(),
+            "status": self.get_status_display(),
+        }
+
+    def get_absolute_url(self) -> str:
+        return reverse("shopapp:job_details", kwargs={"pk": self.pk})
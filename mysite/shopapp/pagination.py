@@ -0,0 +1,247 @@
+"""
+Постраничный вывод для REST API приложения shopapp.
+
+По умолчанию используется обычная нумерация страниц. Параметр ``pagination=cursor``
+(или уже полученный ``cursor``) включает курсорную пагинацию: без COUNT(*) и OFFSET,
+поэтому время ответа не зависит от глубины страницы.
+"""
+
+import base64
+import binascii
+import json
+import operator
+from functools import reduce
+
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured, ValidationError
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Курсорная (keyset) пагинация по составному ключу сортировки.
+
+    Курсор хранит значения всех полей сортировки крайней записи страницы, и соседняя
+    страница выбирается лексикографическим условием (f1, f2, ..., pk) > (v1, v2, ..., pk),
+    как в blogapp.pagination. Сортировка берется из queryset (OrderingFilter,
+    релевантность поиска), а без нее - из ordering. Первичный ключ добавляется
+    последним, чтобы ключ был уникальным и записи с равными значениями не терялись.
+    Поля сортировки не должны содержать NULL.
+    """
+
+    cursor_query_param = "cursor"
+    page_size = api_settings.PAGE_SIZE
+    ordering: tuple[str, ...] = ("pk",)
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_ordering(self, queryset: QuerySet) -> list[str]:
+        """Возвращает поля сортировки queryset с первичным ключом в конце."""
+        ordering = list(queryset.query.order_by) or list(self.ordering)
+        if not all(isinstance(field, str) for field in ordering):
+            raise ImproperlyConfigured(f"{type(self).__name__} supports ordering by field names only.")
+        pk_name = queryset.model._meta.pk.name
+        if not any(field.lstrip("-") in ("pk", pk_name) for field in ordering):
+            ordering.append("-pk" if ordering[0].startswith("-") else "pk")
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Возвращает записи страницы после или перед позицией из курсора."""
+        self.base_url = request.build_absolute_uri()
+        self.ordering_fields = self.get_ordering(queryset)
+        self.next_position = self.previous_position = None
+        cursor = self.decode_cursor(request)
+        backwards = cursor is not None and cursor["reverse"]
+
+        ordering = self.ordering_fields
+        if backwards:
+            ordering = [field[1:] if field.startswith("-") else f"-{field}" for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if cursor is not None:
+            try:
+                queryset = queryset.filter(self.after(ordering, cursor["position"]))
+            except (ValidationError, ValueError, TypeError):
+                raise NotFound(self.invalid_cursor_message)
+
+        # Лишняя запись показывает, есть ли еще страница в направлении перехода
+        object_list = list(queryset[: self.page_size + 1])
+        has_more = len(object_list) > self.page_size
+        object_list = object_list[: self.page_size]
+        if backwards:
+            object_list.reverse()
+            has_previous, has_next = has_more, True
+        else:
+            has_previous, has_next = cursor is not None, has_more
+
+        if object_list:
+            if has_previous:
+                self.previous_position = self.position(queryset.model, object_list[0])
+            if has_next:
+                self.next_position = self.position(queryset.model, object_list[-1])
+        return object_list
+
+    @staticmethod
+    def after(ordering: list[str], position: list) -> Q:
+        """Условие "запись идет после position" для сортировки ordering."""
+        conditions = []
+        equal = {}
+        for field, value in zip(ordering, position):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            conditions.append(Q(**equal, **{f"{name}__{lookup}": value}))
+            equal[name] = value
+        return reduce(operator.or_, conditions)
+
+    def position(self, model, obj) -> list:
+        """Значения полей сортировки записи obj."""
+        values = []
+        for field in self.ordering_fields:
+            name = field.lstrip("-")
+            try:
+                # Для внешнего ключа нужен его id, а не связанный объект
+                attname = "pk" if name == "pk" else model._meta.get_field(name).attname
+            except FieldDoesNotExist:
+                # Аннотация, например релевантность поиска
+                attname = name
+            values.append(getattr(obj, attname))
+        return values
+
+    def decode_cursor(self, request) -> dict | None:
+        """Разбирает курсор из параметра запроса, для испорченного курсора отдает 404."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            position, reverse = cursor["p"], bool(cursor.get("r"))
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        # Курсор от другой сортировки (клиент сменил ordering) не подходит
+        if not isinstance(position, list) or len(position) != len(self.ordering_fields):
+            raise NotFound(self.invalid_cursor_message)
+        return {"position": position, "reverse": reverse}
+
+    def encode_cursor(self, position: list, reverse: bool) -> str:
+        """Кодирует позицию в ссылку на соседнюю страницу."""
+        # str сохраняет микросекунды дат и точность Decimal, в отличие от DjangoJSONEncoder
+        cursor = {"p": position, "r": 1} if reverse else {"p": position}
+        encoded = base64.urlsafe_b64encode(json.dumps(cursor, default=str).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self) -> str | None:
+        """Ссылка на следующую страницу."""
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, reverse=False)
+
+    def get_previous_link(self) -> str | None:
+        """Ссылка на предыдущую страницу, с первой страницы - без курсора."""
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+    def get_paginated_response(self, data):
+        """Возвращает страницу со ссылками на соседние страницы."""
+        return Response({"next": self.get_next_link(), "previous": self.get_previous_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        """Описывает ответ в схеме OpenAPI."""
+        link = {"type": "string", "nullable": True, "format": "uri"}
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {"next": link, "previous": link, "results": schema},
+        }
+
+    def get_schema_operation_parameters(self, view):
+        """Описывает параметр курсора в схеме OpenAPI."""
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "The pagination cursor value.",
+                "schema": {"type": "string"},
+            }
+        ]
+
+
+class ProductCursorPagination(KeysetPagination):
+    """Курсорная пагинация товаров в порядке Product.Meta.ordering."""
+
+    ordering = ("name", "price", "pk")
+
+
+class OrderCursorPagination(KeysetPagination):
+    """Курсорная пагинация заказов в порядке создания."""
+
+    ordering = ("created_at", "pk")
+
+
+class DailySalesPagination(KeysetPagination):
+    """Курсорная пагинация итогов продаж по дням: год ряда одного ключа на странице."""
+
+    ordering = ("day", "key", "pk")
+    page_size = 366
+
+
+class OptionalCursorPagination(BasePagination):
+    """
+    Пагинация, которая по запросу клиента переключается на курсорную.
+
+    Сортировка из OrderingFilter учитывается в обоих режимах.
+    """
+
+    mode_query_param = "pagination"
+    page_number_class = PageNumberPagination
+    cursor_class: type[KeysetPagination] = KeysetPagination
+
+    def get_paginator(self, request) -> BasePagination:
+        """Выбирает пагинатор по параметрам запроса."""
+        params = request.query_params
+        if params.get(self.mode_query_param) == "cursor" or self.cursor_class.cursor_query_param in params:
+            return self.cursor_class()
+        return self.page_number_class()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Делит queryset на страницы выбранным пагинатором."""
+        self.paginator = self.get_paginator(request)
+        return self.paginator.paginate_queryset(queryset, request, view=view)
+
+    def get_paginated_response(self, data):
+        """Возвращает ответ выбранного пагинатора."""
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        """Описывает ответ в схеме OpenAPI по режиму по умолчанию."""
+        return self.page_number_class().get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        """Описывает параметры обоих режимов в схеме OpenAPI."""
+        parameters = self.page_number_class().get_schema_operation_parameters(view)
+        parameters += self.cursor_class().get_schema_operation_parameters(view)
+        parameters.append(
+            {
+                "name": self.mode_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Set to 'cursor' to use keyset pagination without page counts.",
+                "schema": {"type": "string", "enum": ["cursor"]},
+            }
+        )
+        return parameters
+
+
+class ProductPagination(OptionalCursorPagination):
+    """Пагинация товаров."""
+
+    cursor_class = ProductCursorPagination
+
+
+class OrderPagination(OptionalCursorPagination):
+    """Пагинация заказов."""
+
+    cursor_class = OrderCursorPagination
@@ -0,0 +1,136 @@
+"""
+Отчеты о продажах по дневным итогам.
+
+Команда ``manage.py rollup_sales`` сворачивает заказы закрытых дней в строки
+:class:`shopapp.models.DailySales`: по всему магазину, по товарам, промокодам и
+покупателям. Каждый запуск обрабатывает только дни после последнего свернутого,
+поэтому отчет за любой период читает несколько сотен строк итогов, а не историю
+заказов целиком.
+
+День - сутки в часовом поясе TIME_ZONE. Текущий день не сворачивается, пока не
+закончится. Итоги заказа берутся из его полей (см. :mod:`shopapp.totals`), выручка
+по товарам - по ценам товаров на момент свертки: цены строк заказа не хранятся.
+Итоги уже свернутых дней не меняются вместе с заказами, их пересчитывает запуск
+с ``--since``.
+"""
+
+from datetime import date, datetime, time, timedelta
+from typing import Iterator
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailySales, Order
+from .totals import discounted_price_expression
+
+# Сколько дней сворачивается за один шаг: четыре запроса с группировкой на шаг
+ROLLUP_DAYS_PER_STEP = 31
+ROLLUP_BATCH_SIZE = 1000
+
+Dimension = DailySales.Dimension
+
+
+def day_start(day: date) -> datetime:
+    """Начало дня day в текущем часовом поясе."""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def last_rolled_up_day() -> date | None:
+    """Последний свернутый день: строки TOTAL пишутся за каждый день, даже без заказов."""
+    return DailySales.objects.filter(dimension=Dimension.TOTAL).aggregate(day=Max("day"))["day"]
+
+
+def first_order_day() -> date | None:
+    """День первого заказа."""
+    first = Order.objects.aggregate(created_at=Min("created_at"))["created_at"]
+    return timezone.localdate(first) if first else None
+
+
+def _totals(row: dict | None) -> dict:
+    """Выбирает из строки группировки значения итогов, пустые суммы заменяет нулями."""
+    row = row or {}
+    return {name: row.get(name) or 0 for name in ("orders", "units", "revenue", "discounted_revenue")}
+
+
+def iter_rollups(start: date, end: date) -> Iterator[DailySales]:
+    """
+    Строит итоги дней [start, end) четырьмя запросами с группировкой по дню.
+
+    Заказы группируются по уже посчитанным полям итогов, товары - по строкам
+    промежуточной таблицы.
+    """
+    tzinfo = timezone.get_current_timezone()
+    orders = (
+        Order.objects.filter(created_at__gte=day_start(start), created_at__lt=day_start(end))
+        .annotate(day=TruncDate("created_at", tzinfo=tzinfo))
+        .order_by()
+    )
+    order_totals = {
+        "orders": Count("pk"),
+        "units": Sum("items_count"),
+        "revenue": Sum("total"),
+        "discounted_revenue": Sum("discounted_total"),
+    }
+
+    days = {row["day"]: row for row in orders.values("day").annotate(**order_totals)}
+    current = start
+    while current < end:
+        # Пустые дни тоже сохраняются: по ним видно, что день уже свернут
+        yield DailySales(day=current, dimension=Dimension.TOTAL, key="", **_totals(days.get(current)))
+        current += timedelta(days=1)
+
+    for dimension, field in ((Dimension.PROMOCODE, "promocode"), (Dimension.USER, "user_id")):
+        for row in orders.values("day", field).annotate(**order_totals):
+            yield DailySales(day=row["day"], dimension=dimension, key=str(row[field]), **_totals(row))
+
+    lines = (
+        Order.products.through.objects.filter(
+            order__created_at__gte=day_start(start), order__created_at__lt=day_start(end)
+        )
+        .annotate(day=TruncDate("order__created_at", tzinfo=tzinfo))
+        .order_by()
+        .values("day", "product_id")
+        .annotate(
+            orders=Count("order_id"),
+            units=Count("pk"),
+            revenue=Sum("product__price"),
+            discounted_revenue=Sum(discounted_price_expression("product__")),
+        )
+    )
+    for row in lines:
+        yield DailySales(day=row["day"], dimension=Dimension.PRODUCT, key=str(row["product_id"]), **_totals(row))
+
+
+def rollup_days(start: date, end: date) -> int:
+    """Заменяет итоги дней [start, end) заново посчитанными и возвращает число строк."""
+    with transaction.atomic():
+        DailySales.objects.filter(day__gte=start, day__lt=end).delete()
+        rows = DailySales.objects.bulk_create(iter_rollups(start, end), batch_size=ROLLUP_BATCH_SIZE)
+    return len(rows)
+
+
+def rollup_sales(since: date | None = None, until: date | None = None) -> tuple[int, int]:
+    """
+    Сворачивает дни с since до until (не включая) и возвращает число дней и строк.
+
+    По умолчанию since - день после последнего свернутого (или день первого заказа),
+    until - сегодня. Дни обрабатываются шагами по ROLLUP_DAYS_PER_STEP, каждый шаг в
+    своей транзакции, так что прерванный запуск продолжается с места остановки.
+    """
+    until = until or timezone.localdate()
+    if since is None:
+        last = last_rolled_up_day()
+        since = last + timedelta(days=1) if last else first_order_day()
+    if since is None or since >= until:
+        return 0, 0
+
+    days = rows = 0
+    start = since
+    while start < until:
+        end = min(start + timedelta(days=ROLLUP_DAYS_PER_STEP), until)
+        rows += rollup_days(start, end)
+        days += (end - start).days
+        start = end
+    return days, rows
@@ -0,0 +1,67 @@
+"""
+Полнотекстовый поиск товаров.
+
+На SQLite поиск идет по индексу FTS5 ``shopapp_product_fts`` (см. :mod:`mysite.fts`)
+с внешним содержимым из ``shopapp_product``. На PostgreSQL используется GIN-индекс по
+``to_tsvector``. На остальных СУБД поиск сводится к обычному icontains.
+"""
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, QuerySet, Value
+from rest_framework.filters import SearchFilter
+
+from mysite.fts import FTSIndex, Rank, fts_query
+
+SEARCH_INDEX = FTSIndex("shopapp_product", ("name", "description"))
+FTS_TABLE = SEARCH_INDEX.table
+POSTGRES_INDEX = "shopapp_product_search"
+# Вес совпадения в названии относительно совпадения в описании
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+SEARCH_VECTOR = SearchVector("name", weight="A", config="simple") + SearchVector(
+    "description", weight="B", config="simple"
+)
+
+
+def search_products(queryset: QuerySet, terms: list[str]) -> QuerySet:
+    """
+    Отбирает товары по словам terms и добавляет релевантность search_rank.
+
+    Чем больше search_rank, тем выше товар в выдаче.
+    """
+    if connection.vendor == "postgresql":
+        query = SearchQuery(" ".join(terms), config="simple", search_type="websearch")
+        # Фильтр по тому же выражению, что и в GIN-индексе миграции, иначе индекс не используется
+        return (
+            queryset.annotate(search_vector=SEARCH_VECTOR)
+            .filter(search_vector=query)
+            .annotate(search_rank=SearchRank(F("search_vector"), query))
+        )
+
+    match = fts_query(terms)
+    if not match:
+        return queryset.none().annotate(search_rank=Value(0.0))
+    return queryset.filter(search_index__document__match=match).annotate(
+        search_rank=Rank("search_index__document", weights=(NAME_WEIGHT, DESCRIPTION_WEIGHT)),
+    )
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    Поиск товаров по полнотекстовому индексу с сортировкой по релевантности.
+
+    Параметр запроса тот же, что у SearchFilter. Если указан параметр ordering,
+    сортировку выполняет OrderingFilter. Без индекса работает как SearchFilter.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        """Отбирает товары по поисковому запросу."""
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        if not SEARCH_INDEX.available():
+            return super().filter_queryset(request, queryset, view)
+
+        return search_products(queryset, terms).order_by("-search_rank", "pk")
@@ -2,7 +2,7 @@
 
 from rest_framework import serializers
 
-from .models import Product, Order
+from .models import DailySales, Product, Order
 
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -15,6 +15,7 @@ class ProductSerializer(serializers.ModelSerializer):
         fields = (
             "pk",
             "name",
+            "sku",
             "description",
             "price",
             "discount",
@@ -39,4 +40,25 @@ class OrderSerializer(serializers.ModelSerializer):
             "delivery_address",
             "created_at",
             "receipt",
+            "items_count",
+            "total",
+            "discounted_total",
+        )
+
+
+class DailySalesSerializer(serializers.ModelSerializer):
+    """Cериализатор для модели DailySales: точка временного ряда отчета о продажах."""
+
+    class Meta:
+        """Метаданные для сериализатора DailySales."""
+
+        model = DailySales
+        fields = (
+            "day",
+            "dimension",
+            "key",
+            "orders",
+            "units",
+            "revenue",
+            "discounted_revenue",
         )
@@ -0,0 +1,175 @@
+"""
+Сигналы моделей shopapp.
+
+Любое изменение товаров и заказов делает устаревшими закэшированные данные
+соответствующих пространств имен :mod:`shopapp.cache`. Удаление и архивирование
+оставляют надгробия для лент изменений :mod:`shopapp.changes`. Изменение состава
+заказов и цен товаров пересчитывает итоги заказов :mod:`shopapp.totals`. Загрузка
+изображения товара ставит в очередь построение его копий :mod:`shopapp.images`.
+"""
+
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from mysite.storage import file_sha256
+
+from .cache import ORDERS, PRODUCTS, invalidate
+from .changes import record_tombstones
+from .images import IMAGE_FIELDS
+from .jobs import enqueue_renditions
+from .models import TOTAL_FIELDS, ImageRendition, Order, Product, ProductImage, Tombstone
+from .totals import as_price, orders_with_products, recompute_totals
+
+# Поля товара, при сохранении которых нужны его прежние значения
+TRACKED_FIELDS = {"archived", "price", "discount"}
+
+
+@receiver(pre_save, sender=Product)
+def product_changing(sender, instance: Product, raw: bool = False, update_fields=None, **kwargs) -> None:
+    """
+    Запоминает сохраненные значения полей товара, от которых зависят надгробия и итоги заказов.
+
+    Признак архивирования, цена и скидка читаются одним запросом.
+    """
+    instance._archive_changed = None
+    instance._prices_changed = False
+    # Фикстуры (raw) загружаются как есть, без надгробий и пересчета итогов
+    if raw or instance.pk is None or (update_fields is not None and not TRACKED_FIELDS & set(update_fields)):
+        return
+    saved = Product.objects.filter(pk=instance.pk).values_list("archived", "price", "discount").first()
+    if saved is None:
+        return
+    was_archived, price, discount = saved
+    saving = TRACKED_FIELDS if update_fields is None else TRACKED_FIELDS & set(update_fields)
+    if "archived" in saving and was_archived != instance.archived:
+        instance._archive_changed = instance.archived
+    # Поле, которое не сохраняется, остается прежним, даже если изменено в экземпляре
+    instance._prices_changed = ("price" in saving and price != as_price(instance.price)) or (
+        "discount" in saving and discount != instance.discount
+    )
+
+
+@receiver(post_save, sender=Product)
+def product_archived(sender, instance: Product, **kwargs) -> None:
+    """Оставляет надгробие архивированного товара или убирает его при возврате из архива."""
+    changed = getattr(instance, "_archive_changed", None)
+    if changed is True:
+        record_tombstones(Tombstone.Kind.PRODUCT, Tombstone.Reason.ARCHIVED, [instance.pk])
+    elif changed is False:
+        # Клиент, который не застал архивирование, получит только актуальную запись
+        Tombstone.objects.filter(
+            kind=Tombstone.Kind.PRODUCT, object_id=instance.pk, reason=Tombstone.Reason.ARCHIVED
+        ).delete()
+
+
+@receiver(post_save, sender=Product)
+def product_price_changed(sender, instance: Product, **kwargs) -> None:
+    """Пересчитывает итоги заказов с товаром после изменения его цены или скидки."""
+    if getattr(instance, "_prices_changed", False) and recompute_totals(orders_with_products([instance.pk])):
+        invalidate(ORDERS)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, **kwargs) -> None:
+    """Сбрасывает кэш товаров после сохранения товара."""
+    invalidate(PRODUCTS)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance: Product, **kwargs) -> None:
+    """
+    Сбрасывает кэш товаров и заказов после удаления товара.
+
+    Вместе с товаром каскадом удаляются его связи с заказами, а m2m_changed при этом
+    не отправляется, поэтому итоги заказов, в которых он был, пересчитываются здесь.
+    """
+    order_ids = getattr(instance, "_order_ids", None)
+    if order_ids:
+        recompute_totals(Order.objects.filter(pk__in=order_ids), updated_at=timezone.now())
+    invalidate(PRODUCTS, ORDERS)
+    record_tombstones(Tombstone.Kind.PRODUCT, Tombstone.Reason.DELETED, [instance.pk])
+
+
+@receiver(pre_delete, sender=Product)
+def product_deleting(sender, instance: Product, **kwargs) -> None:
+    """Запоминает заказы с товаром, пока их связи еще не удалены каскадом."""
+    instance._order_ids = list(orders_with_products([instance.pk]).values_list("pk", flat=True))
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=ProductImage)
+def image_uploading(sender, instance, raw: bool = False, **kwargs) -> None:
+    """
+    Запоминает, что в поле изображения новый файл: он сохраняется в хранилище вместе с объектом.
+
+    Изображению товара заодно считается SHA-256 для поиска повторов при пакетной загрузке.
+    """
+    image = getattr(instance, IMAGE_FIELDS[sender._meta.label_lower])
+    instance._image_uploaded = not raw and bool(image) and not image._committed
+    if instance._image_uploaded and sender is ProductImage:
+        instance.sha256 = file_sha256(image)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+def image_uploaded(sender, instance, **kwargs) -> None:
+    """Ставит в очередь построение копий нового изображения после фиксации транзакции."""
+    if getattr(instance, "_image_uploaded", False):
+        instance._image_uploaded = False
+        transaction.on_commit(partial(enqueue_renditions, instance))
+
+
+@receiver(post_delete, sender=ImageRendition)
+def rendition_deleted(sender, instance: ImageRendition, **kwargs) -> None:
+    """Удаляет файл копии изображения, когда удаление ее записи зафиксировано."""
+    transaction.on_commit(partial(instance.file.delete, save=False))
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_image_changed(sender, **kwargs) -> None:
+    """Сбрасывает кэш товаров после добавления или удаления изображения товара."""
+    invalidate(PRODUCTS)
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, **kwargs) -> None:
+    """Сбрасывает кэш заказов после сохранения заказа."""
+    invalidate(ORDERS)
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance: Order, **kwargs) -> None:
+    """Сбрасывает кэш заказов и оставляет надгробие удаленного заказа."""
+    invalidate(ORDERS)
+    record_tombstones(Tombstone.Kind.ORDER, Tombstone.Reason.DELETED, [instance.pk], owner_id=instance.user_id)
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def order_products_changed(sender, instance, action: str, reverse: bool, pk_set: set | None, **kwargs) -> None:
+    """
+    Пересчитывает итоги заказов после изменения их состава, отмечает их изменение и сбрасывает кэш.
+
+    При изменении со стороны товара (product.orders) заказы берутся из pk_set, а для
+    clear их список запоминается до удаления связей.
+    """
+    if reverse and action == "pre_clear":
+        instance._cleared_order_ids = list(instance.orders.values_list("pk", flat=True))
+    if not action.startswith("post_"):
+        return
+    invalidate(ORDERS)
+    if not reverse:
+        order_ids = [instance.pk]
+    elif action == "post_clear":
+        order_ids = getattr(instance, "_cleared_order_ids", [])
+    else:
+        order_ids = pk_set or []
+    if order_ids:
+        recompute_totals(Order.objects.filter(pk__in=order_ids), updated_at=timezone.now())
+    if not reverse:
+        # Итоги посчитаны в базе, экземпляр заказа должен их видеть до следующей загрузки
+        instance.refresh_from_db(fields=TOTAL_FIELDS)
@@ -0,0 +1,76 @@
+"""Теги шаблонов для вывода изображений товаров по их уменьшенным копиям."""
+
+from django import template
+from django.db.models.fields.files import FieldFile
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import SafeString
+
+from shopapp.images import FALLBACK_FORMAT, FORMATS, RENDITIONS, RenditionSize, current_renditions
+
+register = template.Library()
+
+
+def interchangeable(size: RenditionSize, other: RenditionSize) -> bool:
+    """
+    Проверяет, что копии размеров size и other показывают одно и то же кадрирование.
+
+    Обрезанная по квадрату копия (thumb) не должна попасть в srcset вписанной в рамку:
+    браузер выбирает копию только по ширине и показал бы другой кадр.
+    """
+    return size.crop == other.crop and size.width * other.height == size.height * other.width
+
+
+def srcset(renditions: list) -> str:
+    """Строит значение srcset из копий одного формата, копии одной ширины берутся один раз."""
+    widths = {}
+    for rendition in sorted(renditions, key=lambda rendition: rendition.width):
+        widths.setdefault(rendition.width, rendition.file.url)
+    return ", ".join(f"{url} {width}w" for width, url in widths.items())
+
+
+@register.simple_tag
+def picture(image: FieldFile, size: str = "list", alt: str = "") -> SafeString:
+    """
+    Выводит изображение размера size (см. shopapp.images.RENDITIONS) тегом <picture>.
+
+    В srcset попадают копии с тем же кадрированием и соотношением сторон рамки, и
+    браузер сам берет большую на экранах высокой плотности. Пока копии не построены,
+    выводится исходное изображение.
+    """
+    if not image:
+        return SafeString("")
+    box = RENDITIONS[size]
+    renditions = [
+        rendition
+        for rendition in current_renditions(image)
+        if rendition.size in RENDITIONS and interchangeable(RENDITIONS[rendition.size], box)
+    ]
+    fallback = next(
+        (rendition for rendition in renditions if rendition.size == size and rendition.format == FALLBACK_FORMAT),
+        None,
+    )
+    if fallback is None:
+        return format_html('<img style="max-width: {}px" src="{}" alt="{}" loading="lazy">', box.width, image.url, alt)
+
+    sizes = f"{fallback.width}px"
+    by_format = {name: [rendition for rendition in renditions if rendition.format == name] for name in FORMATS}
+    sources = format_html_join(
+        "",
+        '<source type="{}" srcset="{}" sizes="{}">',
+        (
+            (mime_type, srcset(by_format[name]), sizes)
+            for name, (_, mime_type, _) in FORMATS.items()
+            if name != FALLBACK_FORMAT and by_format[name]
+        ),
+    )
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}"'
+        ' loading="lazy" decoding="async"></picture>',
+        sources,
+        fallback.file.url,
+        srcset(by_format[FALLBACK_FORMAT]),
+        sizes,
+        fallback.width,
+        fallback.height,
+        alt,
+    )
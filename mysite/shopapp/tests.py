@@ -1,12 +1,46 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
 from string import ascii_letters
 from random import choices
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth.models import User, Permission
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone, translation
 
-from shopapp.models import Product, Order
+from PIL import Image
+
+from shopapp.benchmarks import ROUTES, over_budget, run_benchmarks, uncovered_routes
+from shopapp.cache import (
+    ORDERS,
+    PRODUCTS,
+    bump_version,
+    get_or_compute,
+    get_versions,
+    versioned_key,
+)
+from shopapp.common import import_products, iter_order_chunks, save_csv, save_json
+from shopapp.images import FORMATS, RENDITIONS, current_renditions, render_renditions
+from shopapp.jobs import claim_jobs, enqueue, export_rows, reap_stale_jobs, run_job
+from shopapp.changes import encode_cursor
+from shopapp.models import DailySales, Job, Product, ProductImage, Order, Tombstone
+from shopapp.reports import day_start, rollup_sales
+from shopapp.search import FTS_TABLE, search_products
+from shopapp.uploads import save_product_images
 from shopapp.utils import add_two_numbers
 
 
@@ -150,6 +184,17 @@ class ProductsExportViewTestCase(TestCase):
         )
 
 
+class EmptyProductsExportViewTestCase(TestCase):
+    def setUp(self):
+        # LANGUAGE_CODE "en-us" нет в LANGUAGES, без явной активации reverse дает 404
+        translation.activate("en")
+
+    def test_empty_catalog(self):
+        response = self.client.get(reverse("shopapp:products_export"))
+
+        self.assertEqual(response.json(), {"products": []})
+
+
 class OrderDetailViewTestCase(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -213,6 +258,8 @@ class OrdersExportViewTestCase(TestCase):
         cls.staff_user.delete()
 
     def setUp(self):
+        # LANGUAGE_CODE "en-us" нет в LANGUAGES, без явной активации reverse дает 404
+        translation.activate("en")
         self.client.force_login(self.staff_user)
 
     def test_orders_export_view(self):
@@ -221,7 +268,7 @@ class OrdersExportViewTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
 
         self.assertJSONEqual(
-            response.content.decode("utf-8"),
+            b"".join(response.streaming_content).decode("utf-8"),
             {
                 "orders": [
                     {
@@ -229,10 +276,1066 @@ class OrdersExportViewTestCase(TestCase):
                         "delivery_address": order.delivery_address,
                         "promocode": order.promocode,
                         "user_id": order.user.id,
-                        "products": [prod.pk for prod in order.products.all()],
+                        "products": [prod.pk for prod in order.products.order_by("pk")],
                         # "products": list(order.products.values_list("id", flat=True)),
                     }
-                    for order in Order.objects.all()
+                    for order in Order.objects.order_by("pk")
                 ]
             },
         )
+
+    def test_orders_export_ndjson(self):
+        response = self.client.get(reverse("shopapp:orders_export"), {"format": "ndjson"})
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode("utf-8").splitlines()
+        expected = list(Order.objects.order_by("pk").values_list("pk", flat=True))
+        self.assertEqual([json.loads(line)["id"] for line in lines], expected)
+
+    def test_order_chunks_take_two_queries_each(self):
+        orders_count = Order.objects.count()
+
+        with CaptureQueriesContext(connection) as queries:
+            chunks = list(iter_order_chunks(chunk_size=2))
+
+        self.assertEqual(sum(map(len, chunks)), orders_count)
+        # Две выборки на пачку, плюс пустая выборка, если последняя пачка полная
+        self.assertEqual(len(queries), 2 * len(chunks) + (orders_count % 2 == 0))
+
+
+class ProductsDownloadsCSVTestCase(TestCase):
+    fixtures = [
+        "auth_group.json",
+        "auth_user.json",
+        "products-fixture.json",
+    ]
+
+    def setUp(self):
+        # LANGUAGE_CODE "en-us" нет в LANGUAGES, без явной активации reverse дает 404
+        translation.activate("en")
+
+    def read_csv(self, response):
+        content = b"".join(response.streaming_content).decode("utf-8")
+        return list(csv.reader(StringIO(content)))
+
+    def test_downloads_csv_is_streamed(self):
+        response = self.client.get(reverse("shopapp:product-downloads-csv"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+        rows = self.read_csv(response)
+        self.assertEqual(rows[0], ["name", "description", "price", "discount"])
+        self.assertEqual(len(rows) - 1, Product.objects.count())
+
+    def test_downloads_csv_applies_filters(self):
+        product = Product.objects.order_by("pk").first()
+        response = self.client.get(
+            reverse("shopapp:product-downloads-csv"),
+            {"name": product.name},
+        )
+        rows = self.read_csv(response)
+        self.assertEqual(len(rows) - 1, Product.objects.filter(name=product.name).count())
+        self.assertEqual(rows[1][0], product.name)
+
+
+class ImportOrdersTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="buyer", password="testpassword")
+        cls.laptop = Product.objects.create(name="Laptop", price="1999")
+        cls.phone = Product.objects.create(name="Phone", price="999")
+
+    def make_csv(self, rows):
+        lines = ["user,products,promocode,delivery_address"]
+        lines.extend(rows)
+        return BytesIO("\n".join(lines).encode("utf-8"))
+
+    def test_import_orders_csv(self):
+        file = self.make_csv(
+            [
+                'buyer,"Laptop, Phone",SALE,Moscow',
+                "buyer,Phone,,Kazan",
+                "ghost,Phone,,Omsk",
+                "buyer,Tablet,,Tver",
+            ]
+        )
+        report = save_csv(Order, file, encoding="utf-8", key="products", atomic=False)
+
+        self.assertEqual(report.processed, 4)
+        self.assertEqual(report.created, 2)
+        self.assertEqual([row for row, _ in report.errors], [3, 4])
+        order = Order.objects.get(delivery_address="Moscow")
+        self.assertEqual(order.user, self.user)
+        self.assertEqual(order.promocode, "SALE")
+        self.assertQuerySetEqual(order.products.order_by("pk"), [self.laptop, self.phone])
+
+    def test_import_orders_json(self):
+        data = {
+            "1": {"user": "buyer", "products": ["Laptop"], "delivery_address": "Moscow"},
+            "2": {"user": "buyer", "products": ["Laptop", "Phone"], "delivery_address": "Kazan"},
+        }
+        file = BytesIO(json.dumps(data).encode("utf-8"))
+        report = save_json(Order, file, encoding="utf-8", key="products")
+
+        self.assertEqual(report.created, 2)
+        self.assertEqual(Order.products.through.objects.filter(order__user=self.user).count(), 3)
+
+    def test_query_count_does_not_depend_on_rows(self):
+        # SQLite ограничивает число параметров запроса 999: 100 заказов по 9 полей еще помещаются в один INSERT
+        with CaptureQueriesContext(connection) as few:
+            save_csv(Order, self.make_csv(['buyer,"Laptop, Phone",,Moscow'] * 2), encoding="utf-8", key="products")
+        with CaptureQueriesContext(connection) as many:
+            save_csv(Order, self.make_csv(['buyer,"Laptop, Phone",,Moscow'] * 100), encoding="utf-8", key="products")
+
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 102)
+
+
+class ImportProductsTestCase(TestCase):
+    def setUp(self):
+        translation.activate("en")
+
+    def make_csv(self, rows):
+        lines = ["name,description,price,discount"]
+        lines.extend(rows)
+        return BytesIO("\n".join(lines).encode("utf-8"))
+
+    def test_rows_are_converted_and_saved_in_chunks(self):
+        file = self.make_csv([f"Product {i},Description,{i}.50," for i in range(7)])
+        progress = []
+        report = save_csv(Product, file, encoding="utf-8", chunk_size=3, progress=lambda r: progress.append(r.processed))
+
+        self.assertEqual(report.created, 7)
+        self.assertEqual(progress, [3, 6, 7])
+        product = Product.objects.get(name="Product 2")
+        self.assertEqual(product.price, Decimal("2.50"))
+        self.assertEqual(product.discount, 0)
+
+    def test_all_or_nothing_rolls_back_every_chunk(self):
+        file = self.make_csv(["First,,10,", "Second,,10,", "Third,,ten,", "Fourth,,10,"])
+        report = save_csv(Product, file, encoding="utf-8", chunk_size=2)
+
+        self.assertTrue(report.rolled_back)
+        self.assertEqual(report.created, 0)
+        self.assertEqual([row for row, _ in report.errors], [3])
+        self.assertFalse(Product.objects.filter(name__in=["First", "Second", "Fourth"]).exists())
+
+    def test_commit_per_chunk_skips_invalid_rows(self):
+        file = self.make_csv(["First,,10,", "Second,,10,", "Third,,ten,", "Fourth,,10,"])
+        report = save_csv(Product, file, encoding="utf-8", chunk_size=2, atomic=False)
+
+        self.assertFalse(report.rolled_back)
+        self.assertEqual(report.created, 3)
+        self.assertEqual(Product.objects.filter(name__in=["First", "Second", "Fourth"]).count(), 3)
+
+    def test_upload_csv_returns_report(self):
+        file = self.make_csv(["First,,10,", "Second,,10,"])
+        file.name = "products.csv"
+        response = self.client.post(reverse("shopapp:product-upload-csv"), {"file": file})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["created"], 2)
+
+
+class UpsertProductsTestCase(TestCase):
+    def setUp(self):
+        translation.activate("en")
+        Product.objects.create(name="Laptop", sku="LT-1", price="1999.00", description="Old")
+        Product.objects.create(name="Phone", sku="PH-1", price="999.00")
+
+    def upload(self, rows, **params):
+        lines = ["sku,name,price"]
+        lines.extend(rows)
+        file = BytesIO("\n".join(lines).encode("utf-8"))
+        file.name = "products.csv"
+        url = reverse("shopapp:product-upload-csv") + "?" + "&".join(f"{k}={v}" for k, v in params.items())
+        return self.client.post(url, {"file": file})
+
+    def test_upsert_reports_inserted_updated_unchanged(self):
+        response = self.upload(["LT-1,Laptop,1899.00", "PH-1,Phone,999.00", "TB-1,Tablet,499.00"], mode="upsert")
+
+        self.assertEqual(response.status_code, 200)
+        report = response.json()
+        self.assertEqual((report["created"], report["updated"], report["unchanged"]), (1, 1, 1))
+        self.assertEqual(Product.objects.filter(sku__isnull=False).count(), 3)
+        laptop = Product.objects.get(sku="LT-1")
+        self.assertEqual(laptop.price, Decimal("1899.00"))
+        self.assertEqual(laptop.description, "Old")
+
+    def test_admin_upsert_reports_updated_and_unchanged(self):
+        self.client.force_login(User.objects.create_superuser(username="upsert-admin", password="testpassword"))
+        file = SimpleUploadedFile("products.csv", b"sku,name,price\nLT-1,Laptop,1899.00\nPH-1,Phone,999.00\nTB-1,Tablet,499.00\n")
+
+        response = self.client.post(
+            reverse("admin:import_products_csv"), {"upload_file": file, "mode": "upsert", "atomic": "on"}, follow=True
+        )
+
+        self.assertContains(response, "of 3 records 1 created, 1 updated, 1 unchanged.")
+
+    def test_upsert_requires_sku(self):
+        response = self.upload([",Netbook,1899.00"], mode="upsert")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Product.objects.filter(name="Netbook").exists())
+
+    def test_unknown_mode(self):
+        response = self.upload(["LT-1,Laptop,1899.00"], mode="merge")
+        self.assertEqual(response.status_code, 400)
+
+
+class JobsTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.settings_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        translation.activate("en")
+        self.staff = User.objects.create_user(username="staff", password="testpassword", is_staff=True)
+
+    def test_import_job_lifecycle(self):
+        upload = SimpleUploadedFile("products.csv", b"name,price\nJob product 1,10\nJob product 2,20\n")
+        job = enqueue(Job.Kind.IMPORT_PRODUCTS, user=self.staff, params={"atomic": True}, input_file=upload)
+        self.assertEqual(job.status, Job.Status.PENDING)
+
+        self.assertEqual(claim_jobs(5), [job.pk])
+        self.assertEqual(claim_jobs(5), [])
+        self.assertEqual(run_job(job.pk), Job.Status.DONE)
+
+        job.refresh_from_db()
+        self.assertEqual(job.progress, 2)
+        self.assertEqual(job.report["created"], 2)
+        self.assertFalse(job.input_file)
+        self.assertTrue(Product.objects.filter(name="Job product 2").exists())
+
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("shopapp:job_details", kwargs={"pk": job.pk}))
+        self.assertEqual(response.json()["status"], "done")
+        self.assertIsNone(response.json()["download_url"])
+
+    def test_export_job_result_download(self):
+        products = [Product.objects.create(name=f"Export {i}") for i in range(3)]
+        job = enqueue(
+            Job.Kind.EXPORT_CSV,
+            user=self.staff,
+            params={"model": "shopapp.product", "pks": [product.pk for product in products]},
+        )
+        claim_jobs(1)
+        run_job(job.pk)
+
+        self.client.force_login(self.staff)
+        status = self.client.get(reverse("shopapp:job_details", kwargs={"pk": job.pk})).json()
+        self.assertEqual(status["report"], {"exported": 3})
+        response = self.client.get(status["download_url"])
+        rows = list(csv.reader(StringIO(b"".join(response.streaming_content).decode("utf-8"))))
+        self.assertEqual([row[1] for row in rows[1:]], ["Export 0", "Export 1", "Export 2"])
+
+        job.refresh_from_db()
+        # Результат лежит вне MEDIA_ROOT, который nginx отдает без проверки прав
+        self.assertEqual([name for _, _, names in os.walk(self.media_root) for name in names], [])
+        self.assertTrue(os.path.isfile(os.path.join(settings.PRIVATE_MEDIA_ROOT, job.result_file.name)))
+        self.client.force_login(User.objects.create_superuser(username="job-admin", password="testpassword"))
+        response = self.client.get(reverse("admin:shopapp_job_change", args=[job.pk]))
+        self.assertContains(response, status["download_url"])
+
+    def test_export_progress_is_saved_while_running(self):
+        for i in range(3):
+            Product.objects.create(name=f"Progress {i}")
+        job = enqueue(Job.Kind.EXPORT_CSV, user=self.staff, params={})
+
+        with mock.patch("shopapp.jobs.EXPORT_CHUNK_SIZE", 2):
+            rows = export_rows(job, Product.objects.filter(name__startswith="Progress"), ["name"])
+            next(rows)
+            self.assertEqual(Job.objects.get(pk=job.pk).progress, 0)
+            next(rows)
+            self.assertEqual(Job.objects.get(pk=job.pk).progress, 2)
+
+    def test_export_job_keeps_changelist_filters(self):
+        for name in ("Filtered 1", "Filtered 2", "Other"):
+            Product.objects.create(name=name)
+        admin_user = User.objects.create_superuser(username="export-admin", password="testpassword")
+        self.client.force_login(admin_user)
+
+        self.client.post(
+            reverse("admin:shopapp_product_changelist") + "?q=Filtered",
+            {"action": "export_csv_background", "select_across": "1", "_selected_action": ["0"]},
+        )
+        job = Job.objects.get(kind=Job.Kind.EXPORT_CSV)
+        self.assertEqual(job.params, {"model": "shopapp.product", "changelist_filters": "q=Filtered"})
+
+        claim_jobs(1)
+        self.assertEqual(run_job(job.pk), Job.Status.DONE)
+        job.refresh_from_db()
+        self.assertEqual(job.report, {"exported": 2})
+
+    def test_stale_running_jobs_are_failed(self):
+        upload = SimpleUploadedFile("products.csv", b"name\nStale\n")
+        stale = enqueue(Job.Kind.IMPORT_PRODUCTS, user=self.staff, input_file=upload)
+        alive = enqueue(Job.Kind.IMPORT_PRODUCTS, user=self.staff)
+        claim_jobs(2)
+        Job.objects.filter(pk=stale.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(reap_stale_jobs(), 1)
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, Job.Status.FAILED)
+        self.assertFalse(stale.input_file)
+        self.assertEqual(Job.objects.get(pk=alive.pk).status, Job.Status.RUNNING)
+
+    def test_failed_job_and_access(self):
+        job = enqueue(Job.Kind.EXPORT_CSV, user=self.staff, params={})
+        claim_jobs(1)
+        self.assertEqual(run_job(job.pk), Job.Status.FAILED)
+
+        other = User.objects.create_user(username="other", password="testpassword")
+        self.client.force_login(other)
+        response = self.client.get(reverse("shopapp:job_details", kwargs={"pk": job.pk}))
+        self.assertEqual(response.status_code, 403)
+
+
+class CursorPaginationTestCase(TestCase):
+    def setUp(self):
+        translation.activate("en")
+        self.user = User.objects.create_user(username="crawler", password="testpassword")
+        for i in range(25):
+            product = Product.objects.create(name=f"Crawled {i % 5}", price=i)
+            order = Order.objects.create(user=self.user, delivery_address=f"Address {i}")
+            order.products.add(product)
+
+    def crawl(self, url):
+        pks = []
+        with CaptureQueriesContext(connection) as queries:
+            while url:
+                data = self.client.get(url).json()
+                self.assertNotIn("count", data)
+                pks.extend(item["pk"] for item in data["results"])
+                url = data["next"]
+        self.assertFalse([q for q in queries if "COUNT(" in q["sql"].upper()])
+        return pks
+
+    def test_products_cursor_pagination(self):
+        pks = self.crawl(reverse("shopapp:product-list") + "?pagination=cursor")
+        self.assertEqual(len(pks), len(set(pks)))
+        self.assertEqual(set(pks), set(Product.objects.values_list("pk", flat=True)))
+
+    def test_orders_cursor_pagination_with_ordering(self):
+        pks = self.crawl(reverse("shopapp:order-list") + "?pagination=cursor&ordering=-created_at")
+        self.assertEqual(pks, list(Order.objects.order_by("-created_at", "-pk").values_list("pk", flat=True)))
+
+    def test_ties_in_leading_field_are_not_skipped(self):
+        pks = self.crawl(reverse("shopapp:product-list") + "?pagination=cursor&ordering=name")
+        self.assertEqual(pks, list(Product.objects.order_by("name", "pk").values_list("pk", flat=True)))
+
+    def test_search_results_keep_rank_order(self):
+        for i in range(15):
+            Product.objects.create(name="Lamp " * (i % 3 + 1), description="lamp " * i)
+        url = reverse("shopapp:product-list") + "?pagination=cursor&search=lamp"
+
+        pks = self.crawl(url)
+
+        expected = search_products(Product.objects.all(), ["lamp"]).order_by("-search_rank", "pk")
+        self.assertEqual(pks, list(expected.values_list("pk", flat=True)))
+
+    def test_previous_link_returns_same_page(self):
+        first = self.client.get(reverse("shopapp:product-list") + "?pagination=cursor").json()
+        second = self.client.get(first["next"]).json()
+        self.assertIsNone(first["previous"])
+
+        back = self.client.get(second["previous"]).json()
+
+        self.assertEqual(back["results"], first["results"])
+        self.assertIsNone(back["previous"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("shopapp:product-list"), {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_number_pagination_is_default(self):
+        data = self.client.get(reverse("shopapp:order-list")).json()
+        self.assertEqual(data["count"], Order.objects.count())
+
+
+class OrderViewSetQueriesTestCase(TestCase):
+    def setUp(self):
+        translation.activate("en")
+        self.user = User.objects.create_user(username="buyer", password="testpassword")
+        self.products = [Product.objects.create(name=f"Bundle {i}") for i in range(3)]
+
+    def create_orders(self, count):
+        for i in range(count):
+            order = Order.objects.create(user=self.user, delivery_address=f"Address {i}")
+            order.products.set(self.products)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.create_orders(2)
+        with CaptureQueriesContext(connection) as small_page:
+            self.client.get(reverse("shopapp:order-list"), {"user": self.user.pk})
+
+        self.create_orders(8)
+        # проверка пользователя фильтром, COUNT(*), страница заказов и товары всех заказов страницы
+        with self.assertNumQueries(len(small_page)):
+            response = self.client.get(reverse("shopapp:order-list"), {"user": self.user.pk})
+
+        self.assertEqual(len(small_page), 4)
+        results = response.json()["results"]
+        self.assertEqual(len(results), 10)
+        self.assertEqual(results[0]["user"], self.user.pk)
+        self.assertEqual(sorted(results[0]["products"]), [product.pk for product in self.products])
+
+
+class ViewQueryBudgetsTestCase(TestCase):
+    def test_every_route_has_budget(self):
+        self.assertEqual(uncovered_routes(), set())
+
+    def test_views_within_query_budgets(self):
+        report = run_benchmarks(repeat=1, products=60, orders=40, articles=20)
+
+        self.assertEqual(len(report["results"]), len(ROUTES))
+        for result in report["results"]:
+            self.assertLess(result["status"], 400, result["route"])
+        self.assertEqual(over_budget(report), [])
+        json.dumps(report)
+
+    def test_benchmark_keeps_site_cache(self):
+        cache.set("site-key", "kept")
+
+        run_benchmarks(routes=ROUTES[:1], repeat=1, products=5, orders=5, articles=2)
+
+        self.assertEqual(cache.get("site-key"), "kept")
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class VersionedCacheTestCase(TestCase):
+    def setUp(self):
+        # LANGUAGE_CODE "en-us" нет в LANGUAGES, без явной активации reverse дает 404
+        translation.activate("en")
+        cache.clear()
+        self.user = User.objects.create_user(username="cached-buyer", password="testpassword")
+        self.product = Product.objects.create(name="Cached product")
+
+    def test_products_export_invalidated_on_save(self):
+        url = reverse("shopapp:products_export")
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = "Renamed product"
+            self.product.save()
+
+        names = [product["name"] for product in self.client.get(url).json()["products"]]
+        self.assertIn("Renamed product", names)
+        self.assertNotIn("Cached product", names)
+
+    def test_user_orders_export_invalidated_on_m2m_change(self):
+        order = Order.objects.create(user=self.user, delivery_address="Cache street")
+        url = reverse("shopapp:user_orders_export", kwargs={"user_id": self.user.pk})
+        self.assertEqual(self.client.get(url).json()["orders"]["cached-buyer_orders"][0]["products"], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.products.add(self.product)
+
+        orders = self.client.get(url).json()["orders"]["cached-buyer_orders"]
+        self.assertEqual(orders[0]["products"], [self.product.pk])
+
+    def test_import_invalidates_products(self):
+        products_version, orders_version = get_versions(PRODUCTS, ORDERS)
+        file = BytesIO(b"name,price\nImported cached,10\n")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            save_csv(Product, file, encoding="utf-8")
+
+        new_products_version, new_orders_version = get_versions(PRODUCTS, ORDERS)
+        self.assertGreater(new_products_version, products_version)
+        self.assertEqual(new_orders_version, orders_version)
+
+    def test_stale_value_while_recomputing(self):
+        get_or_compute("report", (PRODUCTS,), lambda: "old")
+        bump_version(PRODUCTS)
+        cache.add(versioned_key("report", (PRODUCTS,)) + ":lock", 1)
+
+        value = get_or_compute("report", (PRODUCTS,), lambda: self.fail("recomputed while locked"))
+
+        self.assertEqual(value, "old")
+        self.assertEqual(get_or_compute("other", (PRODUCTS,), lambda: "computed"), "computed")
+
+
+class ProductSearchTestCase(TestCase):
+    def setUp(self):
+        # LANGUAGE_CODE "en-us" нет в LANGUAGES, без явной активации reverse дает 404
+        translation.activate("en")
+        self.in_description = Product.objects.create(name="Mirror", description="Spare part for a quasar telescope")
+        self.in_name = Product.objects.create(name="Quasar telescope", description="Reflector")
+
+    def search(self, text):
+        return list(search_products(Product.objects.all(), [text]).order_by("-search_rank", "pk"))
+
+    def test_api_search_ranks_name_matches_first(self):
+        response = self.client.get(reverse("shopapp:product-list"), {"search": "quasar"})
+
+        names = [product["name"] for product in response.json()["results"]]
+        self.assertEqual(names, ["Quasar telescope", "Mirror"])
+
+    def test_prefix_and_all_words(self):
+        self.assertEqual(self.search("teles"), [self.in_name, self.in_description])
+        self.assertEqual(self.search("quasar reflector"), [self.in_name])
+        self.assertEqual(self.search('"quasar" OR NOT'), [])
+        self.assertEqual(self.search("!!!"), [])
+
+    def test_index_follows_bulk_changes(self):
+        Product.objects.bulk_create([Product(name="Nebula filter")])
+        self.assertEqual([product.name for product in self.search("nebula")], ["Nebula filter"])
+
+        Product.objects.filter(pk=self.in_name.pk).update(name="Pulsar telescope")
+        self.assertEqual(self.search("pulsar"), [self.in_name])
+        self.assertEqual(self.search("quasar"), [self.in_description])
+
+        self.in_description.delete()
+        self.assertEqual(self.search("quasar"), [])
+
+    def test_rebuild_restores_triggers(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TRIGGER {FTS_TABLE}_ai")
+        Product.objects.create(name="Comet catcher")
+        self.assertEqual(self.search("comet"), [])
+
+        call_command("rebuild_product_index", stdout=StringIO())
+
+        self.assertEqual([product.name for product in self.search("comet")], ["Comet catcher"])
+        Product.objects.create(name="Comet tail")
+        self.assertEqual(len(self.search("comet")), 2)
+
+
+class ConditionalGetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username="etag-staff", password="testpassword", is_staff=True)
+        cls.product = Product.objects.create(name="ETag product", description="Conditional")
+
+    def setUp(self):
+        # LANGUAGE_CODE "en-us" нет в LANGUAGES, без явной активации reverse дает 404
+        translation.activate("en")
+
+    def assertNotModified(self, url, **headers):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get(url, headers={"If-None-Match": etag, **headers})
+
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b"")
+        return etag, queries
+
+    def test_export_not_modified_without_queries(self):
+        url = reverse("shopapp:products_export")
+        etag, queries = self.assertNotModified(url)
+
+        self.assertEqual(len(queries), 0)
+        Product.objects.filter(pk=self.product.pk).update(price=1)
+        self.assertEqual(self.client.get(url, headers={"If-None-Match": etag}).status_code, 304)
+        self.product.save()
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_product_pages_and_feed(self):
+        for url in (
+            reverse("shopapp:product_details", kwargs={"pk": self.product.pk}),
+            reverse("shopapp:product_list"),
+            reverse("shopapp:product_feed"),
+        ):
+            with self.subTest(url=url):
+                self.assertNotModified(url)
+
+    async def test_not_modified_under_asgi(self):
+        for url in (reverse("shopapp:products_export"), reverse("shopapp:product_feed")):
+            with self.subTest(url=url):
+                response = await self.async_client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+                cached = await self.async_client.get(url, headers={"If-None-Match": response["ETag"]})
+
+                self.assertEqual(cached.status_code, 304)
+                self.assertEqual(cached["ETag"], response["ETag"])
+
+    def test_etag_varies_on_user(self):
+        url = reverse("shopapp:product_details", kwargs={"pk": self.product.pk})
+        etag = self.client.get(url)["ETag"]
+        self.client.force_login(self.staff)
+
+        self.assertEqual(self.client.get(url, headers={"If-None-Match": etag}).status_code, 200)
+
+    def test_orders_export_checks_access_first(self):
+        url = reverse("shopapp:orders_export")
+        self.client.force_login(self.staff)
+        etag, _ = self.assertNotModified(url)
+        self.client.logout()
+
+        response = self.client.get(url, headers={"If-None-Match": etag})
+
+        self.assertEqual(response.status_code, 302)
+        Order.objects.create(user=self.staff)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(url, headers={"If-None-Match": etag}).status_code, 200)
+
+
+@mock.patch("shopapp.changes.SETTLE_TIME", timedelta(0))
+class ChangeFeedTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username="feed-staff", password="testpassword", is_staff=True)
+        cls.buyer = User.objects.create_user(username="feed-buyer", password="testpassword")
+        cls.kept = Product.objects.create(name="Feed kept")
+        cls.changed = Product.objects.create(name="Feed changed")
+        cls.order = Order.objects.create(user=cls.buyer, delivery_address="Feed street")
+
+    def setUp(self):
+        # LANGUAGE_CODE "en-us" нет в LANGUAGES, без явной активации reverse дает 404
+        translation.activate("en")
+
+    def get_feed(self, name, since=None, **kwargs):
+        params = {"since": since} if since else {}
+        response = self.client.get(reverse(f"shopapp:{name}", kwargs=kwargs), params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b"".join(response.streaming_content))
+
+    def test_products_since_cursor(self):
+        full = self.get_feed("products_changes")
+        self.assertTrue({self.kept.pk, self.changed.pk} <= {change["id"] for change in full["changes"]})
+
+        self.changed.price = Decimal("5.00")
+        self.changed.save()
+        removed = Product.objects.create(name="Feed removed")
+        removed_pk = removed.pk
+        removed.delete()
+        feed = self.get_feed("products_changes", full["cursor"])
+
+        self.assertEqual(
+            [(change["op"], change["id"]) for change in feed["changes"]],
+            [("upsert", self.changed.pk), ("delete", removed_pk)],
+        )
+        self.assertEqual(feed["changes"][0]["price"], "5.00")
+        self.assertEqual(self.get_feed("products_changes", feed["cursor"])["changes"], [])
+
+    def test_archive_tombstones(self):
+        cursor = self.get_feed("products_changes")["cursor"]
+        self.changed.archived = True
+        self.changed.save()
+
+        changes = self.get_feed("products_changes", cursor)["changes"]
+        self.assertEqual(
+            [(change["op"], change.get("reason")) for change in changes],
+            [("upsert", None), ("delete", "archived")],
+        )
+
+        self.changed.archived = False
+        self.changed.save()
+        changes = self.get_feed("products_changes", cursor)["changes"]
+        self.assertEqual([(change["op"], change["archived"]) for change in changes], [("upsert", False)])
+
+    def test_orders_follow_product_changes(self):
+        self.client.force_login(self.staff)
+        cursor = self.get_feed("orders_changes")["cursor"]
+        self.order.products.add(self.kept)
+
+        changes = self.get_feed("orders_changes", cursor)["changes"]
+        self.assertEqual([(change["id"], change["products"]) for change in changes], [(self.order.pk, [self.kept.pk])])
+
+        cursor = self.get_feed("orders_changes")["cursor"]
+        self.kept.delete()
+        changes = self.get_feed("orders_changes", cursor)["changes"]
+        self.assertEqual([(change["id"], change["products"]) for change in changes], [(self.order.pk, [])])
+
+    def test_user_orders_changes(self):
+        self.client.force_login(self.buyer)
+        cursor = self.get_feed("user_orders_changes", user_id=self.buyer.pk)["cursor"]
+        other = Order.objects.create(user=self.staff, delivery_address="Elsewhere")
+        other.delete()
+        order_pk = self.order.pk
+        self.order.delete()
+
+        changes = self.get_feed("user_orders_changes", cursor, user_id=self.buyer.pk)["changes"]
+
+        self.assertEqual([(change["op"], change["id"]) for change in changes], [("delete", order_pk)])
+        self.assertEqual(Tombstone.objects.get(object_id=order_pk, kind="order").owner_id, self.buyer.pk)
+
+    def test_user_orders_changes_access(self):
+        url = reverse("shopapp:user_orders_changes", kwargs={"user_id": self.buyer.pk})
+
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(User.objects.create_user(username="feed-stranger", password="testpassword"))
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_long_atomic_import(self):
+        cursor = self.get_feed("products_changes")["cursor"]
+        client_cursors = []
+
+        def poll(report):
+            # Клиент опрашивает ленту, пока транзакция импорта еще не зафиксирована
+            client_cursors.append(encode_cursor(timezone.now()))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            import_products(
+                [{"name": "Feed imported 1"}, {"name": "Feed imported 2"}], chunk_size=1, progress=poll
+            )
+            self.changed.archived = True
+            self.changed.save()
+
+        imported = set(Product.objects.filter(name__startswith="Feed imported").values_list("pk", flat=True))
+        for since in (cursor, *client_cursors):
+            changes = self.get_feed("products_changes", since)["changes"]
+            self.assertTrue(imported <= {change["id"] for change in changes if change["op"] == "upsert"})
+            self.assertIn(("delete", self.changed.pk), [(change["op"], change["id"]) for change in changes])
+
+    def test_invalid_and_expired_cursors(self):
+        url = reverse("shopapp:products_changes")
+
+        self.assertEqual(self.client.get(url, {"since": "yesterday"}).status_code, 400)
+        expired = encode_cursor(timezone.now() - timedelta(days=365))
+        self.assertEqual(self.client.get(url, {"since": expired}).status_code, 410)
+
+    def test_queries_do_not_depend_on_table_size(self):
+        cursor = self.get_feed("products_changes")["cursor"]
+        Product.objects.bulk_create(Product(name=f"Feed bulk {i}") for i in range(50))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.get_feed("products_changes", cursor)
+
+        # Одна пачка изменений и одна пачка надгробий
+        self.assertEqual(len(queries), 2)
+
+
+class OrderTotalsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyer = User.objects.create_user(username="totals-buyer", password="testpassword")
+        cls.laptop = Product.objects.create(name="Totals laptop", price=Decimal("1000.00"), discount=10)
+        cls.mouse = Product.objects.create(name="Totals mouse", price=Decimal("19.99"), discount=15)
+
+    def setUp(self):
+        # LANGUAGE_CODE "en-us" нет в LANGUAGES, без явной активации reverse дает 404
+        translation.activate("en")
+        self.order = Order.objects.create(user=self.buyer, delivery_address="Totals street")
+
+    def assertTotals(self, order, total, discounted_total, items_count):
+        order.refresh_from_db()
+        self.assertEqual(
+            (order.total, order.discounted_total, order.items_count),
+            (Decimal(total), Decimal(discounted_total), items_count),
+        )
+
+    def test_totals_follow_order_products(self):
+        self.order.products.add(self.laptop, self.mouse)
+        # Экземпляр видит итоги сразу после изменения состава
+        self.assertEqual(self.order.items_count, 2)
+        self.assertTotals(self.order, "1019.99", "916.99", 2)
+
+        self.order.products.remove(self.laptop)
+        self.assertTotals(self.order, "19.99", "16.99", 1)
+
+        self.mouse.orders.clear()
+        self.assertTotals(self.order, "0", "0", 0)
+
+        self.laptop.orders.add(self.order)
+        self.assertTotals(self.order, "1000.00", "900.00", 1)
+
+    def test_save_does_not_overwrite_totals(self):
+        stale = Order.objects.get(pk=self.order.pk)
+        self.order.products.add(self.laptop)
+
+        stale.delivery_address = "New street"
+        stale.save()
+
+        self.assertTotals(self.order, "1000.00", "900.00", 1)
+
+    def test_price_changes_and_product_deletion(self):
+        other = Order.objects.create(user=self.buyer, delivery_address="Other street")
+        other.products.add(self.mouse)
+        self.order.products.add(self.laptop, self.mouse)
+
+        self.mouse.price = "29.99"
+        self.mouse.discount = 0
+        with CaptureQueriesContext(connection) as queries:
+            self.mouse.save()
+        self.assertEqual(len([query for query in queries if 'UPDATE "shopapp_order"' in query["sql"]]), 1)
+        self.assertTotals(self.order, "1029.99", "929.99", 2)
+        self.assertTotals(other, "29.99", "29.99", 1)
+
+        Product.objects.get(pk=self.mouse.pk).delete()
+        self.assertTotals(self.order, "1000.00", "900.00", 1)
+        self.assertTotals(other, "0", "0", 0)
+
+    def test_stale_product_instances_do_not_skew_totals(self):
+        self.order.products.add(self.laptop, self.mouse)
+        stale = Product.objects.get(pk=self.mouse.pk)
+        Product.objects.filter(pk=self.mouse.pk).update(price=Decimal("5.00"))
+
+        self.laptop.price = "1100.00"
+        self.laptop.save()
+        self.assertTotals(self.order, "1105.00", "994.25", 2)
+
+        stale.delete()
+        self.assertTotals(self.order, "1100.00", "990.00", 1)
+
+    def test_import_and_recompute_command(self):
+        file = BytesIO(b"user,products,promocode,delivery_address\ntotals-buyer,Totals laptop,,Imported\n")
+        save_csv(Order, file, encoding="utf-8", key="products")
+        imported = Order.objects.get(delivery_address="Imported")
+        self.assertTotals(imported, "1000.00", "900.00", 1)
+
+        self.order.products.add(self.mouse)
+        Order.objects.update(total=0, discounted_total=0, items_count=0)
+        call_command("recompute_order_totals", batch_size=1, stdout=StringIO())
+
+        self.assertTotals(imported, "1000.00", "900.00", 1)
+        self.assertTotals(self.order, "19.99", "16.99", 1)
+
+    def test_api_filters_and_sorts_by_totals(self):
+        cheap = Order.objects.create(user=self.buyer, delivery_address="Cheap street")
+        cheap.products.add(self.mouse)
+        self.order.products.add(self.laptop, self.mouse)
+
+        response = self.client.get(
+            reverse("shopapp:order-list"), {"user": self.buyer.pk, "total__gte": "10", "ordering": "-total"}
+        )
+
+        results = response.json()["results"]
+        self.assertEqual([result["pk"] for result in results], [self.order.pk, cheap.pk])
+        self.assertEqual((results[0]["total"], results[0]["items_count"]), ("1019.99", 2))
+
+
+class SalesReportTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username="sales-staff", password="testpassword", is_staff=True)
+        cls.buyer = User.objects.create_user(username="sales-buyer", password="testpassword")
+        cls.book = Product.objects.create(name="Sales book", price=Decimal("10.00"), discount=50)
+        cls.pen = Product.objects.create(name="Sales pen", price=Decimal("2.00"))
+        cls.today = timezone.localdate()
+        cls.first_day = cls.today - timedelta(days=3)
+        # День 0: два заказа, день 1 без заказов, день 2: один заказ
+        for offset, promocode, products in ((0, "SALE", [cls.book, cls.pen]), (0, "", [cls.pen]), (2, "", [cls.book])):
+            order = Order.objects.create(user=cls.buyer, delivery_address="Sales street", promocode=promocode)
+            order.products.set(products)
+            created_at = day_start(cls.first_day + timedelta(days=offset)) + timedelta(hours=23, minutes=30)
+            Order.objects.filter(pk=order.pk).update(created_at=created_at)
+
+    def setUp(self):
+        # LANGUAGE_CODE "en-us" нет в LANGUAGES, без явной активации reverse дает 404
+        translation.activate("en")
+
+    def rows(self, dimension, key=""):
+        return list(
+            DailySales.objects.filter(dimension=dimension, key=key, day__gte=self.first_day)
+            .order_by("day")
+            .values_list("day", "orders", "units", "revenue", "discounted_revenue")
+        )
+
+    def test_rollup_processes_only_new_days(self):
+        # Заказы других тестов могут быть старше, поэтому первый запуск начинается с first_day
+        self.assertEqual(rollup_sales(since=self.first_day, until=self.first_day + timedelta(days=2))[0], 2)
+        self.assertEqual(rollup_sales()[0], 1)
+        self.assertEqual(rollup_sales(), (0, 0))
+
+        day = lambda offset: self.first_day + timedelta(days=offset)  # noqa: E731
+        self.assertEqual(
+            self.rows("total"),
+            [
+                (day(0), 2, 3, Decimal("14.00"), Decimal("9.00")),
+                (day(1), 0, 0, Decimal("0"), Decimal("0")),
+                (day(2), 1, 1, Decimal("10.00"), Decimal("5.00")),
+            ],
+        )
+        self.assertEqual(self.rows("promocode", "SALE"), [(day(0), 1, 2, Decimal("12.00"), Decimal("7.00"))])
+        self.assertEqual([row[:3] for row in self.rows("user", str(self.buyer.pk))], [(day(0), 2, 3), (day(2), 1, 1)])
+        self.assertEqual([row[:3] for row in self.rows("product", str(self.pen.pk))], [(day(0), 2, 2)])
+
+    def test_since_recomputes_days(self):
+        rollup_sales(since=self.first_day)
+        Order.objects.filter(created_at__lt=day_start(self.first_day + timedelta(days=1))).delete()
+
+        call_command("rollup_sales", "--since", self.first_day.isoformat(), stdout=StringIO())
+
+        self.assertEqual(self.rows("total")[0][1], 0)
+        self.assertFalse(DailySales.objects.filter(dimension="promocode", key="SALE").exists())
+
+    def test_api_serves_series_to_staff(self):
+        rollup_sales(since=self.first_day)
+        url = reverse("shopapp:sales-list")
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(self.staff)
+        total = self.client.get(url, {"day__gte": self.first_day + timedelta(days=1)}).json()["results"]
+        self.assertEqual([point["orders"] for point in total], [0, 1])
+
+        with CaptureQueriesContext(connection) as queries:
+            book = self.client.get(url, {"dimension": "product", "key": self.book.pk}).json()["results"]
+        self.assertEqual([(point["day"], point["revenue"]) for point in book], [
+            (self.first_day.isoformat(), "10.00"),
+            ((self.first_day + timedelta(days=2)).isoformat(), "10.00"),
+        ])
+        self.assertFalse([query for query in queries if "shopapp_order" in query["sql"]])
+
+
+class ImageRenditionTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.settings_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        # LANGUAGE_CODE "en-us" нет в LANGUAGES, без явной активации reverse дает 404
+        translation.activate("en")
+
+    def upload(self, name="preview.png", size=(1200, 600)):
+        buffer = BytesIO()
+        Image.new("RGBA", size, (200, 50, 50, 128)).save(buffer, "PNG")
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+    def create_product(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(name="Picture product", preview=self.upload())
+
+    def test_upload_enqueues_rendering_job(self):
+        product = self.create_product()
+        job = Job.objects.get(kind=Job.Kind.RENDER_IMAGES, params__pk=product.pk)
+
+        claim_jobs(1)
+        self.assertEqual(run_job(job.pk), Job.Status.DONE)
+
+        job.refresh_from_db()
+        self.assertEqual(job.report, {"renditions": len(RENDITIONS) * len(FORMATS)})
+        dimensions = set(product.renditions.values_list("size", "format", "width", "height"))
+        self.assertIn(("thumb", "webp", 100, 100), dimensions)
+        self.assertIn(("list", "jpeg", 200, 100), dimensions)
+        self.assertIn(("detail", "webp", 800, 400), dimensions)
+
+    def test_renditions_of_replaced_image_are_ignored(self):
+        product = self.create_product()
+        render_renditions(product, "preview")
+        self.assertEqual(len(current_renditions(product.preview)), len(RENDITIONS) * len(FORMATS))
+
+        product.preview = self.upload("other.png", size=(600, 600))
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        product = Product.objects.get(pk=product.pk)
+        self.assertEqual(current_renditions(product.preview), [])
+
+    def test_picture_tag(self):
+        product = self.create_product()
+        template = Template('{% load shopapp_images %}{% picture product.preview "list" alt=product.name %}')
+
+        fallback = template.render(Context({"product": product}))
+        self.assertIn(f'src="{product.preview.url}"', fallback)
+        self.assertNotIn("<picture>", fallback)
+
+        render_renditions(product, "preview")
+        product = Product.objects.prefetch_related("renditions").get(pk=product.pk)
+        picture = template.render(Context({"product": product}))
+        self.assertIn('<source type="image/webp"', picture)
+        self.assertIn('width="200" height="100"', picture)
+        self.assertIn('alt="Picture product"', picture)
+        # Обрезанная квадратная копия thumb не подменяет вписанные копии
+        thumb = next(rendition for rendition in current_renditions(product.preview) if rendition.size == "thumb")
+        self.assertNotIn(thumb.file.url, picture)
+        self.assertIn(" 800w", picture)
+
+        response = self.client.get(reverse("shopapp:product_details", kwargs={"pk": product.pk}))
+        self.assertContains(response, "<picture>")
+
+
+class ProductImageUploadTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.settings_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        # LANGUAGE_CODE "en-us" нет в LANGUAGES, без явной активации reverse дает 404
+        translation.activate("en")
+        self.admin = User.objects.create_superuser(username="upload-admin", password="testpassword")
+        self.client.force_login(self.admin)
+
+    def upload(self, name, color):
+        buffer = BytesIO()
+        Image.new("RGB", (40, 20), color).save(buffer, "PNG")
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+    def test_create_view_saves_images_of_new_product(self):
+        data = {"name": "Upload product", "price": "10", "description": "", "discount": "0"}
+        data["images"] = [self.upload("red.png", "red"), self.upload("blue.png", "blue")]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("shopapp:product_create"), data)
+
+        product = Product.objects.get(name="Upload product")
+        self.assertEqual(product.created_by, self.admin)
+        images = list(product.images.all())
+        self.assertEqual(len(images), 2)
+        for image in images:
+            self.assertTrue(image.image.storage.exists(image.image.name))
+        jobs = Job.objects.filter(kind=Job.Kind.RENDER_IMAGES, params__model="shopapp.productimage")
+        self.assertEqual(
+            sorted(jobs.values_list("params__pk", flat=True)),
+            sorted(image.pk for image in images),
+        )
+
+    def test_duplicates_are_skipped(self):
+        product = Product.objects.create(name="Dedup product", created_by=self.admin)
+        files = [self.upload("a.png", "red"), self.upload("b.png", "red"), self.upload("c.png", "green")]
+        with CaptureQueriesContext(connection) as queries:
+            images = save_product_images(product, files)
+        self.assertEqual(len(images), 2)
+        self.assertEqual(sum("INSERT" in query["sql"] for query in queries.captured_queries), 1)
+
+        url = reverse("shopapp:product_update", kwargs={"pk": product.pk})
+        data = {"name": "Dedup product", "price": "0", "description": "", "discount": "0"}
+        data["images"] = [self.upload("again.png", "green"), self.upload("new.png", "blue")]
+        self.client.post(url, data)
+        self.assertEqual(product.images.count(), 3)
+
+    def test_failed_write_removes_stored_files(self):
+        product = Product.objects.create(name="Failed upload")
+        storage = ProductImage._meta.get_field("image").storage
+        save = storage.save
+        saved = []
+
+        def failing_save(name, content, **kwargs):
+            if "broken" in name:
+                raise OSError("disk full")
+            saved.append(save(name, content, **kwargs))
+            return saved[-1]
+
+        with mock.patch.object(storage, "save", side_effect=failing_save), mock.patch.object(storage, "delete") as delete:
+            with self.assertRaises(OSError):
+                save_product_images(product, [self.upload("ok.png", "red"), self.upload("broken.png", "blue")])
+
+        self.assertFalse(product.images.exists())
+        self.assertEqual(len(saved), 1)
+        delete.assert_called_once_with(saved[0])
@@ -0,0 +1,103 @@
+"""
+Итоги заказов: сумма, сумма со скидками и число товаров.
+
+Итоги хранятся в полях заказа (:data:`shopapp.models.TOTAL_FIELDS`), поэтому списки
+и отчеты сортируют и фильтруют заказы по индексу, без соединения с товарами и
+GROUP BY в каждом запросе. При изменении состава заказа, цены или скидки товара и
+удалении товара итоги затронутых заказов пересчитываются одним UPDATE с подзапросами
+по их строкам промежуточной таблицы. Пересчет идемпотентен и читает цены в том же
+запросе, поэтому, в отличие от прибавления разницы цен, не накапливает ошибку при
+параллельных изменениях.
+
+Команда ``recompute_order_totals`` пересчитывает итоги всех заказов.
+"""
+
+from decimal import Decimal
+from typing import Any, Iterable
+
+from django.db.models import (
+    Count,
+    DecimalField,
+    F,
+    IntegerField,
+    OuterRef,
+    QuerySet,
+    Subquery,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Coalesce, Round
+
+from .models import Order, Product
+
+CENT = Decimal("0.01")
+# Сколько заказов пересчитывается одним UPDATE при полном пересчете
+RECOMPUTE_BATCH_SIZE = 1000
+TOTAL_OUTPUT = DecimalField(max_digits=12, decimal_places=2)
+
+
+def as_price(value: Any) -> Decimal:
+    """Приводит цену из экземпляра товара (строку или число из формы, фикстуры) к Decimal."""
+    return Product._meta.get_field("price").to_python(value)
+
+
+def discounted_price_expression(prefix: str = "") -> Round:
+    """
+    SQL-выражение цены товара со скидкой, округленной до центов.
+
+    Умножение на 0.01 вместо деления на 100: в SQLite целая цена хранится как INTEGER,
+    и деление было бы целочисленным.
+    """
+    return Round(
+        F(f"{prefix}price") * (Value(100) - F(f"{prefix}discount")) * Value(CENT),
+        2,
+        output_field=TOTAL_OUTPUT,
+    )
+
+
+def totals_expressions(order_model: type[Order] = Order) -> dict[str, Any]:
+    """
+    Выражения для UPDATE, вычисляющие итоги заказа по его строкам промежуточной таблицы.
+
+    order_model - модель заказа, в миграциях историческая.
+    """
+    lines = order_model.products.through.objects.filter(order_id=OuterRef("pk")).order_by().values("order_id")
+
+    def aggregate(expression, output_field):
+        return Coalesce(Subquery(lines.annotate(value=expression).values("value")), Value(0), output_field=output_field)
+
+    return {
+        "total": aggregate(Sum("product__price"), TOTAL_OUTPUT),
+        "discounted_total": aggregate(Sum(discounted_price_expression("product__")), TOTAL_OUTPUT),
+        "items_count": aggregate(Count("pk"), IntegerField()),
+    }
+
+
+def recompute_totals(orders: QuerySet, order_model: type[Order] = Order, **fields: Any) -> int:
+    """
+    Пересчитывает итоги заказов orders одним UPDATE и возвращает число заказов.
+
+    fields - другие поля, которые нужно обновить тем же запросом.
+    """
+    return orders.update(**totals_expressions(order_model), **fields)
+
+
+def recompute_all_totals(order_model: type[Order] = Order, batch_size: int = RECOMPUTE_BATCH_SIZE) -> int:
+    """
+    Пересчитывает итоги всех заказов и возвращает их число.
+
+    Заказы обновляются пачками по диапазонам первичного ключа, чтобы не держать
+    блокировку всей таблицы одним UPDATE.
+    """
+    order_pks = order_model.objects.order_by("pk").values_list("pk", flat=True)
+    last_pk = updated = 0
+    while pks := list(order_pks.filter(pk__gt=last_pk)[:batch_size]):
+        updated += recompute_totals(order_model.objects.filter(pk__gte=pks[0], pk__lte=pks[-1]), order_model)
+        last_pk = pks[-1]
+    return updated
+
+
+def orders_with_products(product_ids: Iterable[int]) -> QuerySet:
+    """Заказы, в которых есть хотя бы один из товаров product_ids."""
+    through = Order.products.through
+    return Order.objects.filter(pk__in=through.objects.filter(product_id__in=product_ids).values("order_id"))
@@ -0,0 +1,109 @@
+"""
+Пакетная загрузка изображений товара.
+
+Файлы из формы товара записываются в хранилище параллельно пулом потоков: запись
+в хранилище - ввод-вывод, и загрузка нескольких десятков фотографий длится примерно
+столько же, сколько запись самой большой из них. Записи :class:`shopapp.models.ProductImage`
+создаются одним bulk_create, задачи построения копий (:mod:`shopapp.images`) ставятся
+в очередь одним INSERT после фиксации транзакции.
+
+Одинаковые по содержимому изображения (SHA-256) у товара хранятся один раз: повторы
+внутри загрузки и уже загруженные файлы пропускаются.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Iterable
+
+from django.core.files import File
+from django.db import transaction
+
+from mysite.storage import file_sha256
+
+from .cache import PRODUCTS, invalidate
+from .jobs import enqueue_renditions
+from .models import Product, ProductImage
+
+# Сколько файлов записывается в хранилище одновременно
+UPLOAD_WORKERS = 8
+
+
+def backfill_sha256(image_model: type[ProductImage] = ProductImage) -> int:
+    """
+    Считает SHA-256 изображений, загруженных без него, и возвращает их число.
+
+    image_model - модель изображения, в миграциях историческая. Изображения, файлов
+    которых нет в хранилище, пропускаются.
+    """
+    updated = 0
+    for image in image_model.objects.filter(sha256="").exclude(image="").only("pk", "image").iterator():
+        try:
+            with image.image.open("rb") as file:
+                sha256 = file_sha256(file)
+        except FileNotFoundError:
+            continue
+        updated += image_model.objects.filter(pk=image.pk).update(sha256=sha256)
+    return updated
+
+
+def _store(pool: ThreadPoolExecutor, images: list[ProductImage]) -> None:
+    """
+    Записывает файлы изображений в хранилище потоками пула pool.
+
+    Если запись хотя бы одного файла не удалась, уже записанные удаляются.
+    """
+    field = ProductImage._meta.get_field("image")
+
+    def store(image: ProductImage) -> None:
+        file = image.image
+        file.name = file.storage.save(field.generate_filename(image, file.name), file.file, max_length=field.max_length)
+        file._committed = True
+
+    futures = [pool.submit(store, image) for image in images]
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    if errors:
+        delete_files([image for image in images if image.image._committed])
+        raise errors[0]
+
+
+def delete_files(images: list[ProductImage]) -> None:
+    """Удаляет файлы изображений из хранилища, не трогая записи."""
+    for image in images:
+        image.image.delete(save=False)
+
+
+def save_product_images(product: Product, files: Iterable[File]) -> list[ProductImage]:
+    """
+    Загружает изображения товара и возвращает созданные записи.
+
+    Файлы, совпадающие по содержимому с другими файлами загрузки или с уже
+    загруженными изображениями товара, пропускаются.
+    """
+    files = list(files)
+    if not files:
+        return []
+    with ThreadPoolExecutor(max_workers=min(UPLOAD_WORKERS, len(files))) as pool:
+        # hashlib отпускает GIL на больших буферах, поэтому хэши тоже считаются параллельно
+        images = {}
+        for file, sha256 in zip(files, pool.map(file_sha256, files)):
+            images.setdefault(sha256, ProductImage(product=product, image=file, sha256=sha256))
+        existing = set(product.images.filter(sha256__in=images).values_list("sha256", flat=True))
+        images = [image for sha256, image in images.items() if sha256 not in existing]
+        if not images:
+            return []
+        _store(pool, images)
+
+    try:
+        with transaction.atomic():
+            images = ProductImage.objects.bulk_create(images)
+            if images[0].pk is None:
+                # База не возвращает первичные ключи из bulk_create (MySQL)
+                images = list(product.images.filter(sha256__in=[image.sha256 for image in images]))
+    except Exception:
+        delete_files(images)
+        raise
+
+    # bulk_create не отправляет сигналы сохранения: кэш и копии обрабатываются здесь
+    invalidate(PRODUCTS)
+    transaction.on_commit(partial(enqueue_renditions, *images))
+    return images
@@ -22,9 +22,15 @@ from .views import (
     OrdersExportView,
     ProductViewSet,
     OrderViewSet,
+    SalesReportViewSet,
     LatestProductsFeed,
     UserOrdersListView,
     UserOrdersExportView,
+    ProductChangesView,
+    OrderChangesView,
+    UserOrderChangesView,
+    JobDetailView,
+    JobDownloadView,
 )
 
 app_name = "shopapp"
@@ -32,6 +38,7 @@ app_name = "shopapp"
 router = DefaultRouter()
 router.register("products", ProductViewSet)
 router.register("orders", OrderViewSet)
+router.register("sales", SalesReportViewSet, basename="sales")
 
 urlpatterns = [
     # path("", cache_page(2 * 3)(ShopIndexView.as_view()), name="shop_index"), # Кэширование
@@ -41,6 +48,7 @@ urlpatterns = [
     path("groups/", GroupsListView.as_view(), name="group_list"),
     path("products/", ProductsListView.as_view(), name="product_list"),
     path("products/export/", ProductDataExportView.as_view(), name="products_export"),
+    path("products/changes/", ProductChangesView.as_view(), name="products_changes"),
     path("products/create/", ProductCreateView.as_view(), name="product_create"),
     path("products/<int:pk>/", ProductDetailsView.as_view(), name="product_details"),
     path("products/<int:pk>/update/", ProductUpdateView.as_view(), name="product_update"),
@@ -48,10 +56,14 @@ urlpatterns = [
     path("products/latest/feed/", LatestProductsFeed(), name="product_feed"),
     path("orders/", OrdersListView.as_view(), name="orders_list"),
     path("orders/export/", OrdersExportView.as_view(), name="orders_export"),
+    path("orders/changes/", OrderChangesView.as_view(), name="orders_changes"),
     path("orders/create/", OrderCreateView.as_view(), name="order_create"),
     path("orders/<int:pk>/", OrderDetailView.as_view(), name="order_details"),
     path("orders/<int:pk>/update/", OrderUpdateView.as_view(), name="order_update"),
     path("orders/<int:pk>/delete/", OrderDeleteView.as_view(), name="order_delete"),
     path("users/<int:user_id>/orders/", UserOrdersListView.as_view(), name="user_orders_list"),
     path("users/<int:user_id>/orders/export/", UserOrdersExportView.as_view(), name="user_orders_export"),
+    path("users/<int:user_id>/orders/changes/", UserOrderChangesView.as_view(), name="user_orders_changes"),
+    path("jobs/<int:pk>/", JobDetailView.as_view(), name="job_details"),
+    path("jobs/<int:pk>/download/", JobDownloadView.as_view(), name="job_download"),
 ]
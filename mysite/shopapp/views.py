@@ -6,17 +6,25 @@
 
 import csv
 import logging
+from abc import ABC, abstractmethod
+from functools import partial
 from timeit import default_timer as timer
 from typing import Any, Dict, List, Tuple
-from csv import DictWriter
 
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import Group, User
 from django.contrib.syndication.views import Feed
 from django.db.models import Prefetch
-from django.http import HttpRequest, HttpResponse, HttpResponseRedirect, JsonResponse
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpRequest,
+    HttpResponse,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import render, redirect, reverse, get_object_or_404
-from django.core.cache import cache
 from django.urls import reverse_lazy
 from django.utils.decorators import method_decorator
 from django.views import View
@@ -37,7 +45,9 @@ from django.contrib.auth.mixins import (
 from django.utils.translation import gettext_lazy as _
 from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.mixins import ListModelMixin
+from rest_framework.permissions import IsAdminUser
+from rest_framework.viewsets import GenericViewSet, ModelViewSet
 from rest_framework.request import Request
 from rest_framework.decorators import action
 from rest_framework.filters import SearchFilter, OrderingFilter
@@ -46,10 +56,34 @@ from drf_spectacular.utils import extend_schema, OpenApiResponse
 
 from faker import Faker
 
-from .common import save_csv
+from requestdataapp.uploads import UploadLimitMixin
+
+from .cache import ORDERS, PRODUCTS, get_or_compute
+from .changes import (
+    CursorError,
+    CursorExpired,
+    decode_cursor,
+    encode_cursor,
+    feed_window,
+    order_changes,
+    product_changes,
+)
+from .conditional import ConditionalFeedMixin, ConditionalGetMixin
+from .common import (
+    save_csv,
+    stream_csv,
+    stream_json,
+    stream_ndjson,
+    iter_order_chunks,
+    EXPORT_CHUNK_SIZE,
+    PRODUCT_IMPORT_MODES,
+)
 from .forms import OrderForm, GroupForm, ProductForm
-from .models import Order, Product, ProductImage
-from .serializers import ProductSerializer, OrderSerializer
+from .models import DailySales, ImageRendition, Job, Order, Product
+from .pagination import DailySalesPagination, OrderPagination, ProductPagination
+from .search import ProductSearchFilter
+from .serializers import DailySalesSerializer, ProductSerializer, OrderSerializer
+from .uploads import save_product_images
 
 log = logging.getLogger(__name__)
 
@@ -66,8 +100,9 @@ class ProductViewSet(ModelViewSet):
 
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = ProductPagination
     filter_backends = [
-        SearchFilter,
+        ProductSearchFilter,
         DjangoFilterBackend,
         OrderingFilter,
     ]
@@ -106,24 +141,24 @@ class ProductViewSet(ModelViewSet):
         return super().retrieve(*args, **kwargs)
 
     @action(methods=["get"], detail=False)
-    def downloads_csv(self, request: Request) -> HttpResponse:
-        response = HttpResponse(content_type='text/csv')
-        file_name = "products-export.csv"
-        response['Content-Disposition'] = f'attachment; filename={file_name}'
-        queryset = self.filter_queryset(self.get_queryset())
+    def downloads_csv(self, request: Request) -> StreamingHttpResponse:
+        """
+        Отдает товары в формате CSV потоком.
+
+        Строки читаются из базы пачками через итератор, так что память воркера не растет
+        с размером каталога. Поиск, фильтры и сортировка применяются так же, как в list.
+        """
         fields = [
             "name",
             "description",
             "price",
             "discount",
         ]
-        queryset = queryset.only(*fields)
-        writer = DictWriter(response, fieldnames=fields)
-        writer.writeheader()
-
-        for product in queryset:
-            writer.writerow({field: getattr(product, field) for field in fields})
-
+        queryset = self.filter_queryset(self.get_queryset()).values_list(*fields)
+        rows = queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        response = StreamingHttpResponse(stream_csv(rows, header=fields), content_type="text/csv")
+        file_name = "products-export.csv"
+        response["Content-Disposition"] = f"attachment; filename={file_name}"
         return response
 
     @action(
@@ -132,20 +167,40 @@ class ProductViewSet(ModelViewSet):
         parser_classes=[MultiPartParser],
     )
     def upload_csv(self, request: Request):
-        products = save_csv(
+        """
+        Импортирует товары из CSV пачками и возвращает отчет об импорте.
+
+        Параметр atomic=0 сохраняет каждую пачку отдельно, пропуская ошибочные строки.
+        По умолчанию при любой ошибке импорт откатывается целиком. Параметр mode=upsert
+        обновляет товары с уже известным SKU вместо создания дубликатов.
+        """
+        mode = request.query_params.get("mode", "insert")
+        if mode not in PRODUCT_IMPORT_MODES:
+            return Response({"mode": [f"Unknown import mode {mode!r}"]}, status=400)
+        report = save_csv(
             Product,
             request.FILES["file"].file,
             encoding=request.encoding,
+            atomic=request.query_params.get("atomic", "1") != "0",
+            mode=mode,
         )
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        return Response(report.as_dict(), status=400 if report.rolled_back else 200)
 
 
 class OrderViewSet(ModelViewSet):
-    """Класс для административной панели заказов."""
+    """
+    Класс для административной панели заказов.
+
+    Товары заказов страницы подгружаются одним запросом и только первичными ключами,
+    а пользователь сериализуется по user_id без JOIN, так что число запросов на
+    страницу не зависит от ее размера.
+    """
 
-    queryset = Order.objects.all()
+    queryset = Order.objects.prefetch_related(
+        Prefetch("products", queryset=Product.objects.only("pk")),
+    )
     serializer_class = OrderSerializer
+    pagination_class = OrderPagination
     filter_backends = [
         SearchFilter,
         DjangoFilterBackend,
@@ -155,20 +210,57 @@ class OrderViewSet(ModelViewSet):
         "created_at",
         "delivery_address",
     ]
-    filterset_fields = [
-        "user",
-        "products",
-        "promocode",
-        "delivery_address",
-        "created_at",
-    ]
+    # Итоги заказа хранятся в нем самом и проиндексированы, поэтому фильтры по диапазону
+    # и сортировка по ним не соединяют заказы с товарами
+    filterset_fields = {
+        "user": ["exact"],
+        "products": ["exact"],
+        "promocode": ["exact"],
+        "delivery_address": ["exact"],
+        "created_at": ["exact"],
+        "total": ["exact", "gte", "lte"],
+        "discounted_total": ["exact", "gte", "lte"],
+        "items_count": ["exact", "gte", "lte"],
+    }
     ordering_fields = [
         "user",
         "created_at",
         "delivery_address",
+        "total",
+        "discounted_total",
+        "items_count",
     ]
 
 
+@extend_schema(description="Daily sales time series from rollups")
+class SalesReportViewSet(ListModelMixin, GenericViewSet):
+    """
+    Временные ряды продаж по дневным итогам (см. shopapp.reports).
+
+    Ряд выбирается параметрами dimension (по умолчанию total) и key, период -
+    параметрами day__gte и day__lte. Запрос читает строки итогов по индексу
+    (dimension, key, day), а не заказы.
+    """
+
+    queryset = DailySales.objects.all()
+    serializer_class = DailySalesSerializer
+    permission_classes = [IsAdminUser]
+    pagination_class = DailySalesPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = {
+        "dimension": ["exact"],
+        "key": ["exact"],
+        "day": ["gte", "lte"],
+    }
+
+    def get_queryset(self):
+        """Без явного разреза отдает итоги по всему магазину."""
+        queryset = super().get_queryset()
+        if "dimension" not in self.request.query_params:
+            queryset = queryset.filter(dimension=DailySales.Dimension.TOTAL)
+        return queryset
+
+
 class ShopIndexView(View):
     """Класс представления."""
 
@@ -231,25 +323,34 @@ class GroupsListView(View):
 #         return context
 
 
-class ProductDetailsView(DetailView):
+class ProductDetailsView(ConditionalGetMixin, DetailView):
     """Класс выводит детали по каждому товару."""
 
+    etag_namespaces = (PRODUCTS,)
+    etag_vary_on_user = True
     template_name = "shopapp/products-details.html"
     # model = Product
-    queryset = Product.objects.prefetch_related("images")
+    # Копии изображений для тега picture: по запросу на превью и на все изображения товара
+    queryset = Product.objects.prefetch_related("renditions", "images__renditions")
     context_object_name = "product"
 
 
-class ProductsListView(ListView):
+class ProductsListView(ConditionalGetMixin, ListView):
     """Класс позволяет вывести список товаров."""
 
+    etag_namespaces = (PRODUCTS,)
+    etag_vary_on_user = True
     template_name = "shopapp/products_list.html"
     # model = Product
     context_object_name = "products"
-    queryset = Product.objects.filter(archived=False)
+    queryset = (
+        Product.objects.filter(archived=False)
+        .select_related("created_by")
+        .prefetch_related(Prefetch("renditions", queryset=ImageRendition.objects.filter(field="preview")))
+    )
 
 
-class ProductCreateView(PermissionRequiredMixin, CreateView):
+class ProductCreateView(PermissionRequiredMixin, UploadLimitMixin, CreateView):
     """Класс по созданию товара."""
 
     # UserPassesTestMixin можно использовать вместо Permission
@@ -261,6 +362,7 @@ class ProductCreateView(PermissionRequiredMixin, CreateView):
     model = Product
     # fields = "name", "price", "description", "discount", "preview"
     form_class = ProductForm
+    upload_limit = ProductForm.upload_limit
 
     # При объявления метода get_absolute_url в классе. Этот метод можно не использовать
     # success_url = reverse_lazy("shopapp:product_list")
@@ -271,12 +373,12 @@ class ProductCreateView(PermissionRequiredMixin, CreateView):
 
     def form_valid(self, form):
         """Метод проверяет, что все данные прошли проверку."""
-        form.instance.user = self.request.user
-        files = form.cleaned_data["images"]
-        for image in files:
-            ProductImage.objects.create(product=self.object, image=image)
+        form.instance.created_by = self.request.user
+        # Изображения сохраняются после товара: их записи ссылаются на него внешним ключом
+        response = super().form_valid(form)
+        save_product_images(self.object, form.cleaned_data["images"])
 
-        return super().form_valid(form)
+        return response
 
 
 # def create_product(request: HttpRequest) -> HttpResponse:
@@ -297,7 +399,7 @@ class ProductCreateView(PermissionRequiredMixin, CreateView):
 #     return render(request, "shopapp/create-product.html", context=context)
 
 
-class ProductUpdateView(UserPassesTestMixin, UpdateView):
+class ProductUpdateView(UserPassesTestMixin, UploadLimitMixin, UpdateView):
     """Класс позволяет обновить данные товара."""
 
     def test_func(self):
@@ -312,6 +414,7 @@ class ProductUpdateView(UserPassesTestMixin, UpdateView):
     # fields = "name", "price", "description", "discount", "preview"
     template_name_suffix = "_update_form"
     form_class = ProductForm
+    upload_limit = ProductForm.upload_limit
 
     # При объявления метода get_absolute_url в классе. Этот метод можно не использовать
     # def get_success_url(self):
@@ -324,8 +427,7 @@ class ProductUpdateView(UserPassesTestMixin, UpdateView):
     def form_valid(self, form):
         """Метод проверяет, что все данные прошли проверку."""
         response = super().form_valid(form)
-        for image in form.files.getlist("images"):
-            ProductImage.objects.create(product=self.object, image=image)
+        save_product_images(self.object, form.cleaned_data["images"])
 
         return response
 
@@ -418,58 +520,118 @@ class OrderDeleteView(DeleteView):
 #     return render(request, "shopapp/create-order.html", context=context)
 
 
-class ProductDataExportView(View):
+class ProductDataExportView(ConditionalGetMixin, View):
     """Класс экспорта товаров."""
 
+    etag_namespaces = (PRODUCTS,)
+
     def get(self, request: HttpRequest) -> JsonResponse:
         """Метод выводит все товары."""
-        cache_key = "myauth/cookie/get"
-        products_data = cache.get(cache_key)
-        if products_data is None:
-            products = Product.objects.order_by("pk").all()
-            products_data = [
-                {
-                    "pk": product.pk,
-                    "name": product.name,
-                    "price": product.price,
-                    "archived": product.archived,
-                }
-                for product in products
-            ]
-            cache.set(cache_key, products_data, 300)
-        elem = products_data[0]
-        name = elem["name"]
-        print("name", name)
+        products_data = get_or_compute("products-export", (PRODUCTS,), self.get_products_data)
         return JsonResponse({"products": products_data})
 
+    @staticmethod
+    def get_products_data() -> list[dict[str, Any]]:
+        """Выбирает данные всех товаров для экспорта."""
+        products = Product.objects.order_by("pk").only("pk", "name", "price", "archived")
+        return [
+            {
+                "pk": product.pk,
+                "name": product.name,
+                "price": product.price,
+                "archived": product.archived,
+            }
+            for product in products.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        ]
+
 
-class OrdersExportView(UserPassesTestMixin, View):
+class OrdersExportView(UserPassesTestMixin, ConditionalGetMixin, View):
     """Класс экспорт заказов."""
 
+    etag_namespaces = (ORDERS,)
+
     def test_func(self):
         """Проверка прав пользователя."""
         return self.request.user.is_staff
 
-    def get(self, request: HttpRequest, *args, **kwargs) -> JsonResponse:
-        """Метод выводит все заказы."""
-        orders = Order.objects.prefetch_related("products").all()
+    def get(self, request: HttpRequest, *args, **kwargs) -> StreamingHttpResponse:
+        """
+        Метод выводит все заказы потоком.
 
-        orders_data = [
-            {
-                "id": order.id,
-                "delivery_address": order.delivery_address,
-                "promocode": order.promocode,
-                "user_id": order.user.id,
-                "products": [prod.pk for prod in order.products.all()],
-                # "products": list(order.products.values_list("id", flat=True)),
-            }
-            for order in orders
-        ]
+        По умолчанию отдается документ JSON {"orders": [...]}, с параметром format=ndjson -
+        по заказу на строку. Заказы читаются пачками (см. iter_order_chunks), поэтому
+        память не растет с числом заказов.
+        """
+        chunks = iter_order_chunks()
+        if request.GET.get("format") == "ndjson":
+            return StreamingHttpResponse(stream_ndjson(chunks), content_type="application/x-ndjson")
+        return StreamingHttpResponse(stream_json(chunks, "orders"), content_type="application/json")
 
-        return JsonResponse({"orders": orders_data})
 
+class ChangeFeedView(ABC, View):
+    """
+    Базовый класс лент изменений (см. shopapp.changes).
 
-class LatestProductsFeed(Feed):
+    Параметр since - курсор из предыдущего ответа, без него отдается полная выгрузка.
+    Ответ {"cursor": ..., "changes": [...]} формируется потоком, изменения имеют
+    операцию upsert (запись целиком) или delete (id и причина).
+    """
+
+    @abstractmethod
+    def get_changes(self, since, until, **kwargs):
+        """Возвращает пачки изменений в (since, until]."""
+
+    def get(self, request: HttpRequest, **kwargs) -> HttpResponse:
+        """Отдает изменения после курсора since и новый курсор."""
+        try:
+            since, until = feed_window(decode_cursor(request.GET.get("since")))
+        except CursorExpired as exc:
+            return JsonResponse({"error": str(exc)}, status=410)
+        except CursorError as exc:
+            return JsonResponse({"error": str(exc)}, status=400)
+        chunks = self.get_changes(since, until, **kwargs)
+        return StreamingHttpResponse(
+            stream_json(chunks, "changes", header={"cursor": encode_cursor(until)}),
+            content_type="application/json",
+        )
+
+
+class ProductChangesView(ChangeFeedView):
+    """Лента изменений товаров."""
+
+    def get_changes(self, since, until, **kwargs):
+        """Возвращает пачки изменений товаров."""
+        return product_changes(since, until)
+
+
+class OrderChangesView(UserPassesTestMixin, ChangeFeedView):
+    """Лента изменений заказов, доступна персоналу, как и выгрузка заказов."""
+
+    def test_func(self):
+        """Проверка прав пользователя."""
+        return self.request.user.is_staff
+
+    def get_changes(self, since, until, **kwargs):
+        """Возвращает пачки изменений заказов."""
+        return order_changes(since, until)
+
+
+class UserOrderChangesView(UserPassesTestMixin, ChangeFeedView):
+    """Лента изменений заказов пользователя, доступна персоналу и самому пользователю."""
+
+    def test_func(self):
+        """Проверка прав пользователя."""
+        user = self.request.user
+        return user.is_staff or (user.is_authenticated and user.pk == self.kwargs["user_id"])
+
+    def get_changes(self, since, until, user_id=None):
+        """Возвращает пачки изменений заказов пользователя user_id."""
+        get_object_or_404(User.objects.only("pk"), pk=user_id)
+        return order_changes(since, until, user_id=user_id)
+
+
+class LatestProductsFeed(ConditionalFeedMixin, Feed):
+    etag_namespaces = (PRODUCTS,)
     title = _("Product list (latest)")
     description = _("Updates on changes and addition products")
     link = reverse_lazy("shopapp:product_list")
@@ -506,41 +668,94 @@ class UserOrdersListView(LoginRequiredMixin, ListView):
 
 
 class UserOrdersExportView(View):
-    def owner(self, user_id):
-        user_id = self.kwargs.get("user_id")
-        return get_object_or_404(User, pk=user_id)
-
     def get(self, request: HttpRequest, user_id) -> JsonResponse:
         """Метод выводит все заказы."""
-        user = self.owner(user_id)
-        cache_key = user.username + str(user.pk)
-        orders_data = cache.get(cache_key)
-        if orders_data is None:
-            orders = (
-                Order.objects.filter(user=user)
-                .select_related("user")
-                .prefetch_related(
-                    Prefetch("products", queryset=Product.objects.only("pk").order_by("pk")),
-                )
-                .order_by("pk")
+        user = get_object_or_404(User.objects.only("pk", "username"), pk=user_id)
+        # Имя пользователя входит в ключ: от него зависит ключ словаря в ответе
+        orders_data = get_or_compute(
+            "user-orders-export",
+            (ORDERS,),
+            partial(self.get_orders_data, user),
+            user.pk,
+            user.username,
+        )
+        return JsonResponse({"orders": orders_data})
+
+    @staticmethod
+    def get_orders_data(user: User) -> dict[str, list[dict[str, Any]]]:
+        """Выбирает данные всех заказов пользователя для экспорта."""
+        orders = (
+            Order.objects.filter(user=user)
+            .prefetch_related(
+                Prefetch("products", queryset=Product.objects.only("pk").order_by("pk")),
             )
-            user_orders_key = user.username + "_orders"
-            orders_data = {
-                user_orders_key: [
-                    {
-                        "id": order.id,
-                        "created_at": order.created_at,
-                        "delivery_address": order.delivery_address,
-                        "promocode": order.promocode,
-                        "user_id": order.user.id,
-                        "products": [prod.pk for prod in order.products.all()],
-                        "receipt": order.receipt.path if order.receipt else None,
-                        # "products": list(order.products.values_list("id", flat=True)),
-                    }
-                    for order in orders
-                ],
+            .order_by("pk")
+        )
+        user_orders_key = user.username + "_orders"
+        return {
+            user_orders_key: [
+                {
+                    "id": order.id,
+                    "created_at": order.created_at,
+                    "delivery_address": order.delivery_address,
+                    "promocode": order.promocode,
+                    "user_id": order.user_id,
+                    "products": [prod.pk for prod in order.products.all()],
+                    "receipt": order.receipt.path if order.receipt else None,
+                    # "products": list(order.products.values_list("id", flat=True)),
+                }
+                # prefetch_related в iterator работает только с chunk_size
+                for order in orders.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+            ],
+        }
+
+
+class JobAccessMixin(LoginRequiredMixin, UserPassesTestMixin):
+    """Доступ к фоновой задаче есть у персонала и у автора задачи."""
+
+    def get_job(self) -> Job:
+        """Возвращает задачу из URL."""
+        if not hasattr(self, "_job"):
+            self._job = get_object_or_404(Job, pk=self.kwargs["pk"])
+        return self._job
+
+    def test_func(self):
+        """Проверка прав пользователя."""
+        user = self.request.user
+        return user.is_staff or self.get_job().created_by_id == user.pk
+
+
+class JobDetailView(JobAccessMixin, View):
+    """Состояние и прогресс фоновой задачи."""
+
+    def get(self, request: HttpRequest, pk: int) -> JsonResponse:
+        """Метод выводит состояние задачи."""
+        job = self.get_job()
+        download_url = None
+        if job.status == Job.Status.DONE and job.result_file:
+            download_url = reverse("shopapp:job_download", kwargs={"pk": job.pk})
+        return JsonResponse(
+            {
+                "id": job.pk,
+                "kind": job.kind,
+                "status": job.status,
+                "progress": job.progress,
+                "report": job.report,
+                "error": job.error,
+                "created_at": job.created_at,
+                "started_at": job.started_at,
+                "finished_at": job.finished_at,
+                "download_url": download_url,
             }
-            cache.set(cache_key, orders_data, 300)
-            print("Create cache", cache_key)
-        print("Go back cache")
-        return JsonResponse({"orders": orders_data})
+        )
+
+
+class JobDownloadView(JobAccessMixin, View):
+    """Скачивание результата выполненной фоновой задачи."""
+
+    def get(self, request: HttpRequest, pk: int) -> FileResponse:
+        """Метод отдает файл результата."""
+        job = self.get_job()
+        if job.status != Job.Status.DONE or not job.result_file:
+            raise Http404(_("The job has no result yet"))
+        return FileResponse(job.result_file.open("rb"), as_attachment=True, filename=job.result_file.name.split("/")[-1])